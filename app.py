@@ -1,30 +1,114 @@
-from dash import Dash, dcc, html, Input, Output, State, ctx
+from dash import Dash, dcc, html, dash_table, Input, Output, State, ALL, ctx, no_update, Patch
+from flask import request, jsonify
+import plotly.colors
 import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-from urllib.request import urlretrieve
-from datetime import datetime, timedelta
+from datetime import timedelta
+from collections import OrderedDict
+from concurrent.futures import CancelledError
+import threading
+import base64
 import os
+import re
+import zlib
 import pandas as pd
 import numpy as np
 
-import indicators
-import signals
 import candlestick_patterns
+import storage
+import update
+import streaming
+import compute
+import jobs
+import backtest
+import sweep
+import summary
+import resample
+import metrics
+import trading_calendar
+import indicator_cache
+import downsample
+import window
 
 path = 'datasets/'
 if not os.path.exists(path):
 	os.makedirs(path)
 
+storage.migrate()																		# Converting CSV datasets left from older versions
+
 def list_datasets():
-	datasets = os.listdir(path)
-	assets = []
-	for dataset in datasets:
-		assets.append(dataset.replace('.csv',''))
-	return sorted(assets)
+	return storage.list_assets()
 
 avalaible_datasets = list_datasets()													# Initial creating list of datasets
 
+''' Process-wide dataset cache shared by all callbacks. Entries are keyed by asset and data version and hold
+the columns read so far, so each callback pays disk I/O only for columns nobody has asked for yet. Least recently
+used entries are evicted above cache_max_bytes '''
+cache_max_bytes = 512 * 1024 * 1024
+dataset_cache = OrderedDict()
+cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+cache_lock = threading.Lock()
+
+def schema_columns(asset):
+	''' Column names of the dataset, answered from the cache or schema.json without reading any rows '''
+	key = (asset, storage.data_version(asset))
+	with cache_lock:
+		if key in dataset_cache:
+			return dataset_cache[key]['columns']
+	return storage.read_schema(asset)['columns']
+
+@metrics.timed
+def load_dataset(asset, columns=None, schema=None):
+	''' Returns a DataFrame with the requested columns (all of them if None), cached under the data version of schema
+	(read if not given) '''
+	schema = schema or storage.read_schema(asset)
+	key = (asset, storage.data_version(asset, schema))
+	with cache_lock:
+		entry = dataset_cache.get(key)
+		if entry is not None:
+			dataset_cache.move_to_end(key)
+	if entry is None:
+		entry = {'columns': schema['columns'], 'data': {}, 'bytes': 0}
+
+	if columns is None:
+		columns = entry['columns']
+	missing = [column for column in columns if column not in entry['data']]
+	loaded = storage.read_columns(asset, missing)
+
+	with cache_lock:
+		if missing:
+			cache_stats['misses'] += 1
+		else:
+			cache_stats['hits'] += 1
+
+		for old_key in [k for k in dataset_cache if k[0] == asset and k != key]:			# Older versions of the same asset are stale
+			cache_stats['bytes'] -= dataset_cache.pop(old_key)['bytes']
+		if key not in dataset_cache:
+			dataset_cache[key] = entry
+		entry = dataset_cache[key]
+		for column, values in loaded.items():
+			if column not in entry['data']:
+				entry['data'][column] = values
+				entry['bytes'] += values.nbytes
+				cache_stats['bytes'] += values.nbytes
+		data = {column: entry['data'].get(column, loaded.get(column)) for column in columns}
+
+		while cache_stats['bytes'] > cache_max_bytes and len(dataset_cache) > 1:
+			cache_stats['bytes'] -= dataset_cache.popitem(last=False)[1]['bytes']
+			cache_stats['evictions'] += 1
+
+	return pd.DataFrame(data, columns=columns)
+
+def invalidate_dataset(asset):
+	with cache_lock:
+		for key in [k for k in dataset_cache if k[0] == asset]:
+			cache_stats['bytes'] -= dataset_cache.pop(key)['bytes']
+
+def cache_info():
+	with cache_lock:
+		return dict(cache_stats, entries=len(dataset_cache))
+
 all_indicators = ['SMA 5', 'SMA 10', 'SMA 20', 'SMA 50', 'SMA 100', 'SMA 200', 
 	'EMA 5', 'EMA 10', 'EMA 20', 'EMA 50', 'EMA 100', 'EMA 200', 
 	'Bollinger', 'MACD', 'RSI', 'Stochastic', 'Williams %R', 'CCI', 'Aroon']
@@ -33,11 +117,66 @@ all_overlays = ['SMA 5', 'SMA 10', 'SMA 20', 'SMA 50', 'SMA 100', 'SMA 200', 'EM
 all_oscillators = ['Volume', 'MACD', 'RSI', 'Stochastic', 'Williams %R', 'CCI', 'Aroon']
 all_signals = [
 	'Crossover SMA 5/20', 'Crossover SMA 10/50', 'Crossover SMA 20/100', 'Crossover SMA 50/200', 'MACD', 'RSI', 'Bollinger', 'Stochastic', 'Williams %R', 'CCI', 'Aroon']
-all_candlestick_patterns = ['White Marubozu', 'Black Marubozu', 
-	'Bullish Engulfing', 'Bearish Engulfing', 'Bullish Harami', 'Bearish Harami', 'Tweezer Bottom', 'Tweezer Top', 'Piercing Line', 'Dark Cloud Cover', 
-	'Morning Star', 'Evening Star', 'Three White Soldiers', 'Three Black Crows',
-	'Three Inside Up', 'Three Inside Down', 'Three Outside Up', 'Three Outside Down',
-	'Upside Tasuki Gap', 'Downside Tasuki Gap']
+all_candlestick_patterns = candlestick_patterns.all_patterns
+
+''' Columns each menu item is drawn from, used to load only what a callback needs '''
+overlay_columns = {item: [item] for item in all_overlays}
+overlay_columns['Bollinger'] = ['Upper band', 'Lower band', 'SMA 20']
+oscillator_columns = {
+	'Volume': ['Volume'], 'MACD': ['MACD', 'MACD Signal Line', 'MACD Histogram'], 'RSI': ['RSI'],
+	'Stochastic': ['Stochastic %K', 'Stochastic %D'], 'Williams %R': ['Williams %R'], 'CCI': ['CCI'], 'Aroon': ['Aroon Up', 'Aroon Down'],
+	'SMA Ratios': ['SMA 5/20 ratio', 'SMA 10/50 ratio', 'SMA 20/100 ratio', 'SMA 50/200 ratio'],
+	'EMA Ratios': ['EMA 5/20 ratio', 'EMA 10/50 ratio', 'EMA 20/100 ratio', 'EMA 50/200 ratio']}
+ohlc_columns = ['Date', 'Open', 'High', 'Low', 'Close']
+oscillator_ticks = {'RSI': [30, 70], 'Stochastic': [20, 80], 'CCI': [-100, 0, 100]}
+webgl_points = 5000																		# Points of a line or marker trace above which the chart is drawn with WebGL
+
+def webgl_trace(trace):
+	''' The same trace drawn with WebGL (go.Scattergl) if it is a go.Scatter, candlesticks and bars have no WebGL type '''
+	if not isinstance(trace, go.Scatter):
+		return trace
+	properties = trace.to_plotly_json()
+	properties.pop('type', None)
+	return go.Scattergl(properties)
+
+def trace_color(column):
+	''' Color of a line or bar, fixed per column so traces keep their color whatever else is on the chart '''
+	colors = plotly.colors.qualitative.Plotly
+	return colors[zlib.crc32(column.encode()) % len(colors)]
+
+def manifest(asset):
+	''' Overlays, oscillators, signals and candlestick patterns avalaible for the asset, read from its schema only '''
+	columns = schema_columns(asset)
+
+	avalaible_overlays = [item for item in all_overlays if item in columns]
+	if ('Upper band' in columns) and ('Lower band' in columns):
+		avalaible_overlays.append('Bollinger')
+
+	avalaible_oscillators = [item for item in all_oscillators if item in columns]
+	if ('Stochastic %K' in columns) and ('Stochastic %D' in columns):
+		avalaible_oscillators.append('Stochastic')
+	if ('Aroon Up' in columns) and ('Aroon Down' in columns):
+		avalaible_oscillators.append('Aroon')
+
+	avalaible_signals = [item for item in all_signals if f'{item} Signal' in columns]
+
+	avalaible_candlestick_patterns = [item for item in all_candlestick_patterns if item in columns]
+
+	return {'overlays': avalaible_overlays, 'oscillators': avalaible_oscillators,
+		'signals': avalaible_signals, 'candlestick_patterns': avalaible_candlestick_patterns}
+
+def chart_columns(main_chart, overlays, oscillators, selected_signals, selected_patterns):
+	''' Columns needed to draw the chart for the given menu selection '''
+	columns = ['Date', 'Close']
+	if main_chart == 'Candlesticks':
+		columns += ['Open', 'High', 'Low']
+	for overlay in overlays or []:
+		columns += overlay_columns.get(overlay, [])
+	for oscillator in oscillators:
+		columns += oscillator_columns.get(oscillator, [])
+	columns += [f'{signal} Signal' for signal in selected_signals or []]
+	columns += list(selected_patterns or [])
+	return list(dict.fromkeys(columns))
 
 nav_items = [
 	dbc.NavItem([
@@ -46,6 +185,9 @@ nav_items = [
 	dbc.NavItem([
 		dbc.Button('Import', id='open_modal_button', n_clicks=0),
 	]),
+	dbc.NavItem([
+		dbc.Button('Screener', id='open_screener_button', n_clicks=0),
+	]),
 	dbc.NavItem([
 		dcc.Dropdown(avalaible_datasets, id='asset'),
 	], style={'width': 100}),
@@ -54,6 +196,10 @@ nav_items = [
 			dcc.RadioItems(['3M', '6M', '1Y', '3Y', 'Max'], 'Max', id='date_range', labelStyle={'display': 'block'}),
 		], id='range_dropdown'),						
 	),
+	dbc.NavItem([
+		dcc.Input(id='timeframe', type='text', debounce=True, list='timeframes', placeholder='Timeframe'),		# Empty: bars as stored
+		html.Datalist(id='timeframes'),
+	], style={'width': 110}),
 	dbc.NavItem(
 		dbc.DropdownMenu(label='Main chart', children=[
 			dcc.RadioItems(['Candlesticks', 'Close'], 'Close', id='main_chart', labelStyle={'display': 'block'}),
@@ -83,7 +229,17 @@ nav_items = [
 		dbc.DropdownMenu(label='Candlestick Patterns', children = [
 			dcc.Checklist(options=[], id='candlestick_patterns', labelStyle={'display': 'block'})
 		], id='candlestick_patterns_dropdown'),
-	)			
+	),
+	dbc.NavItem([
+		dcc.Input(id='custom_indicators', type='text', debounce=True, placeholder='e.g. SMA 37; Bollinger(30, 2.5); RSI(21)'),
+		html.Div([], id='custom_indicators_errors', style={'color': 'red', 'fontSize': 'small'}),
+	], style={'width': 300}),
+	dbc.NavItem([
+		dcc.Checklist(options=['Live'], value=[], id='live'),
+	]),
+	dbc.NavItem([
+		html.Div([], id='live_status'),
+	]),
 ]
 
 app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions = True)
@@ -100,19 +256,35 @@ app.layout = html.Div(
 		dbc.Modal([
 			dbc.ModalHeader('Import new dataset'),
 			dbc.ModalBody([
-				dbc.Input(placeholder='Type asset symbol (e.g. "KGH")', id='import_symbol'),
+				dbc.Textarea(placeholder='Type asset symbols separated by commas or new lines (e.g. "KGH, PKN")', id='import_symbol'),
+				dcc.Upload(html.A('or select a file with symbols'), id='import_file'),
 				html.Div([], id='import_message'),
+				dcc.Interval(id='import_interval', interval=1000, disabled=True),
 			]),
 			dbc.ModalFooter([
 				dbc.Button('Import', id='import_button', n_clicks=0),
 				dbc.Button('Close', id='close_modal_button', n_clicks=0)
 			]),
 		], id='modal', is_open=False),
+		dbc.Modal([
+			dbc.ModalHeader('Screener'),
+			dbc.ModalBody([
+				dbc.Input(id='screener_conditions', debounce=True, placeholder='e.g. Bullish Engulfing == 1 or RSI Signal == 1; Close > 10'),
+				dcc.Dropdown(options=[], value=[], id='screener_columns', multi=True, placeholder='Columns to show'),
+				html.Div([], id='screener_message'),
+				dash_table.DataTable(id='screener_table', sort_action='native', filter_action='native', page_size=50),
+			]),
+			dbc.ModalFooter([
+				dbc.Button('Screen', id='screener_button', n_clicks=0),
+				dbc.Button('Close', id='close_screener_button', n_clicks=0)
+			]),
+		], id='screener_modal', is_open=False, size='xl'),
 		dbc.Offcanvas(
 			html.Div([
 				html.H5('Select assets'),
 				dcc.Dropdown(options=avalaible_datasets, value=[], id='assets_dropdown', multi=True),
 				dcc.Checklist(options=['Select All'], value=[], id='select_all_assets'),
+				dcc.Checklist(options=['Only new bars'], value=[], id='only_new_bars'),
 
 				html.H5('Select indicators'),
 				dcc.Dropdown(options=all_indicators, value=[], id='indicators_dropdown', multi=True),
@@ -135,6 +307,27 @@ app.layout = html.Div(
 				dbc.Button('Find signals', id='find_signals_button', n_clicks=0),
 				html.Div([], id='find_signals_message'),
 
+				html.H5('Backtest'),
+				dcc.Dropdown(options=[f'{signal} Signal' for signal in all_signals] + all_candlestick_patterns, value=[], id='backtest_columns_dropdown', multi=True),
+				dcc.RadioItems(['Long', 'Short', 'Long/Short'], 'Long', id='backtest_mode', inline=True),
+				dcc.Input(id='backtest_commission', type='number', value=backtest.commission * 100, min=0, step=0.01, placeholder='Commission %'),
+				dcc.Input(id='backtest_slippage', type='number', value=backtest.slippage * 100, min=0, step=0.01, placeholder='Slippage %'),
+				dcc.Input(id='backtest_hold', type='number', min=1, step=1, placeholder='Hold bars'),
+				dbc.Button('Backtest', id='backtest_button', n_clicks=0),
+				html.Div([], id='backtest_message'),
+
+				html.H5('Parameter sweep'),
+				dcc.Dropdown(options=list(sweep.strategies), value='SMA Crossover', id='sweep_strategy', clearable=False),
+				dcc.Input(id='sweep_ranges', type='text', debounce=True, placeholder='e.g. Fast 5-50/5; Slow 100-200/10'),
+				dbc.Button('Sweep', id='sweep_button', n_clicks=0),
+				dbc.Button('Cancel', id='cancel_sweep_button', n_clicks=0, color='secondary'),
+				html.Div([], id='sweep_message'),
+				dcc.Interval(id='sweep_interval', interval=2000, disabled=True),
+
+				html.H5('Jobs'),
+				html.Div([], id='jobs_message'),
+				dcc.Interval(id='jobs_interval', interval=1000, disabled=True),
+
 			]),
 			id='offcanvas',
 			title='Data',
@@ -142,7 +335,13 @@ app.layout = html.Div(
 		),
 		dbc.Row([
 			dbc.Col([
-				dcc.Graph('graph')
+				dcc.Graph('graph'),
+				dcc.Interval(id='live_interval', interval=2000, disabled=True),
+				dcc.Store(id='live_traces'),
+				dcc.Store(id='chart_view'),
+				dcc.Store(id='chart_traces'),
+				dcc.Store(id='chart_level'),
+				dcc.Store(id='live_asset'),
 			])
 		]),
 	], fluid=True)
@@ -160,6 +359,7 @@ app.layout = html.Div(
 	Input('asset', 'value')
 )
 
+@metrics.timed
 def disable_nav_items(asset):
 	if asset:
 		disabled = False
@@ -174,31 +374,19 @@ def disable_nav_items(asset):
 	Output('oscillator2', 'options'),
 	Output('signals', 'options'),
 	Output('candlestick_patterns', 'options'),
+	Output('timeframes', 'children'),
 	Input('asset', 'value')
 )
 
+@metrics.timed
 def update_dropdown(asset):
 	if asset:
-		df = pd.read_csv(f'datasets/{asset}.csv')
-		columns = df.columns
-
-		avalaible_overlays = [item for item in all_overlays if item in columns]
-		if ('Upper band' in columns) and ('Lower band' in columns):
-			avalaible_overlays.append('Bollinger')
-
-		avalaible_oscillators = [item for item in all_oscillators if item in columns]
-		if ('Stochastic %K' in columns) and ('Stochastic %D' in columns):
-			avalaible_oscillators.append('Stochastic')
-		if ('Aroon Up' in columns) and ('Aroon Down' in columns):
-			avalaible_oscillators.append('Aroon')
-
-		avalaible_signals = [item for item in all_signals if f'{item} Signal' in columns]
-
-		avalaible_candlestick_patterns = [item for item in all_candlestick_patterns if item in columns]
-
-		return avalaible_overlays, avalaible_oscillators, avalaible_oscillators, avalaible_signals, avalaible_candlestick_patterns
+		avalaible = manifest(asset)
+		intraday = resample.is_intraday(np.load(storage.column_file(asset, 'Date'), mmap_mode='r'))
+		timeframes = [html.Option(value=timeframe) for timeframe in (resample.intraday_timeframes if intraday else resample.daily_timeframes)]
+		return avalaible['overlays'], avalaible['oscillators'], avalaible['oscillators'], avalaible['signals'], avalaible['candlestick_patterns'], timeframes
 	else:
-		return [], [], [], [], []
+		return [], [], [], [], [], []
 	
 ''' Toggle offcanvas '''
 @app.callback(
@@ -208,11 +396,24 @@ def update_dropdown(asset):
 	prevent_initial_call=True
 )
 
+@metrics.timed
 def toggle_offcanvas(n1, is_open):
 	if n1:
 		return not is_open
 	return is_open
 
+''' Custom indicators that are not drawn: unknown names, wrong parameter counts or invalid values '''
+@app.callback(
+	Output('custom_indicators_errors', 'children'),
+	Input('custom_indicators', 'value'),
+)
+
+@metrics.timed
+def check_custom_indicators(custom_indicators):
+	errors = []
+	indicator_cache.parse_indicators(custom_indicators, errors)
+	return [html.Div(error) for error in errors]
+
 ''' Selecting all assets in dropdown '''
 @app.callback(
 	Output('assets_dropdown', 'value'),
@@ -220,6 +421,7 @@ def toggle_offcanvas(n1, is_open):
 	State('assets_dropdown', 'options'),
 )
 
+@metrics.timed
 def select_all(selected, options):
 	if 'Select All' in selected:
 		return options
@@ -231,6 +433,7 @@ def select_all(selected, options):
 	State('indicators_dropdown', 'options'),
 )
 
+@metrics.timed
 def select_all(selected, options):
 	if 'Select All' in selected:
 		return options
@@ -242,6 +445,7 @@ def select_all(selected, options):
 	State('select_candlestick_patterns_dropdown', 'options'),
 )
 
+@metrics.timed
 def select_all(selected, options):
 	if 'Select All' in selected:
 		return options
@@ -253,10 +457,36 @@ def select_all(selected, options):
 	State('select_signals_dropdown', 'options'),
 )
 
+@metrics.timed
 def select_all(selected, options):
 	if 'Select All' in selected:
 		return options
 
+''' Compute steps run as background jobs (see jobs.py) in worker processes across the selected assets (see compute.py),
+errors are collected per asset '''
+def compute_alert(results, status, assets):
+	if status == 'cancelled' and not results:											# Cancelled while still queued
+		return dbc.Alert(f'Cancelled: {len(assets)} assets not started', color='warning', dismissable=True)
+	cancelled = [asset for asset, error in results.items() if isinstance(error, CancelledError)]
+	failed = {asset: error for asset, error in results.items() if isinstance(error, Exception) and asset not in cancelled}
+	reports = [result for result in results.values() if isinstance(result, dict) and 'computed' in result]
+	planned = [html.Div(f'Computed {sum(len(report["computed"]) for report in reports)} nodes, reused {sum(len(report["reused"]) for report in reports)} stored columns')] if reports else []
+	skipped = [html.Div(f'{len(cancelled)} assets cancelled')] if cancelled else []
+	if not failed:
+		return dbc.Alert([html.Div(f'Success: {len(results) - len(cancelled)} assets')] + planned + skipped, color='warning' if cancelled else 'success', dismissable=True)
+	errors = [html.Div(f'{asset}: {type(error).__name__}: {error}') for asset, error in failed.items()]
+	color = 'danger' if len(failed) == len(results) else 'warning'
+	return dbc.Alert([html.Div(f'{len(results) - len(failed) - len(cancelled)} of {len(results)} assets done, {len(failed)} failed')] + skipped + errors, color=color, dismissable=True)
+
+def compute_progress(asset, result):
+	invalidate_dataset(asset)
+
+def submit_job(description, function, assets, batch=False, **kwargs):
+	job, queued = jobs.submit(description, function, assets or [], batch=batch, progress=compute_progress, **kwargs)
+	if not queued:
+		return dbc.Alert(f'Same job already queued (job {job.id})', color='warning', dismissable=True)
+	return dbc.Alert(f'Job {job.id} queued: {len(job.assets)} assets', color='info', dismissable=True)
+
 ''' Calculating technical indicators '''
 
 @app.callback(
@@ -264,55 +494,14 @@ def select_all(selected, options):
 	Input('calculate_indicators_button', 'n_clicks'),
 	State('assets_dropdown', 'value'),
 	State('indicators_dropdown', 'value'),
+	State('only_new_bars', 'value'),
 	prevent_initial_call=True
 )
 
-def calculate_indicators(button, selected_assets, selected_indicators):
-
-	for asset in selected_assets:
-
-		df = pd.read_csv(f'datasets/{asset}.csv')
-
-		open_price = df['Open']
-		high_price = df['High']
-		low_price = df['Low']
-		close_price = df['Close']
-
-		selected_SMA = [element for element in selected_indicators if 'SMA ' in element]
-		periods = [element.split(' ')[1] for element in selected_SMA]
-		for period in periods:
-			df[f'SMA {period}'] = indicators.simple_moving_average(close_price, int(period))
-
-		selected_EMA = [element for element in selected_indicators if 'EMA ' in element]
-		periods = [element.split(' ')[1] for element in selected_EMA]
-		for period in periods:
-			df[f'EMA {period}'] = indicators.exponential_moving_average(close_price, int(period))
-
-		if 'Bollinger' in selected_indicators:
-			df['Upper band'], df['Lower band'] = indicators.bollinger(high_price, low_price, close_price)
-
-		if 'RSI' in selected_indicators:
-			df['RSI'] = indicators.relative_strength_index(close_price)
-
-		if 'MACD' in selected_indicators:
-			df['MACD'], df['MACD Signal Line'], df['MACD Histogram'] = indicators.moving_average_convergence_divergence(close_price)
-
-		if 'Stochastic' in selected_indicators:
-			df['Stochastic %K'], df['Stochastic %D'] = indicators.stochastic(high_price, low_price, close_price)
-
-		if 'Williams %R' in selected_indicators:
-			df['Williams %R'] = indicators.williams_r(high_price, low_price, close_price)
-
-		if 'CCI' in selected_indicators:
-			df['CCI'] = indicators.commodity_channel_index(high_price, low_price, close_price)
-
-		if 'Aroon' in selected_indicators:
-			df['Aroon Up'], df['Aroon Down'] = indicators.aroon(high_price, low_price)
-
-		df.to_csv(f'datasets/{asset}.csv', index=False)
-
-	alert = dbc.Alert('Succes', color='success', dismissable=True)
-	return alert
+@metrics.timed
+def calculate_indicators(button, selected_assets, selected_indicators, only_new_bars):
+	return submit_job('Calculate indicators', compute.calculate_indicators, selected_assets, batch=True,
+		selected_indicators=selected_indicators, only_new_bars='Only new bars' in only_new_bars)
 
 ''' Finding candlestick patterns '''
 
@@ -321,27 +510,14 @@ def calculate_indicators(button, selected_assets, selected_indicators):
 	Input('find_candlestick_patterns_button', 'n_clicks'),
 	State('assets_dropdown', 'value'),
 	State('select_candlestick_patterns_dropdown', 'value'),
+	State('only_new_bars', 'value'),
 	prevent_initial_call=True
 )
 
-def find_candlestick_patterns(button, selected_assets, selected_candlestick_patterns):
-
-	for asset in selected_assets:
-
-		df = pd.read_csv(f'datasets/{asset}.csv')
-
-		open_price = df['Open']
-		high_price = df['High']
-		low_price = df['Low']
-		close_price = df['Close']
-
-		for pattern in selected_candlestick_patterns:
-			df[pattern] = candlestick_patterns.find_pattern(open_price, high_price, low_price, close_price, pattern)
-
-		df.to_csv(f'datasets/{asset}.csv', index=False)
-
-	alert = dbc.Alert('Succes', color='success', dismissable=True)
-	return alert
+@metrics.timed
+def find_candlestick_patterns(button, selected_assets, selected_candlestick_patterns, only_new_bars):
+	return submit_job('Find candlestick patterns', compute.find_candlestick_patterns, selected_assets,
+		selected_candlestick_patterns=selected_candlestick_patterns, only_new_bars='Only new bars' in only_new_bars)
 
 ''' Finding singnals '''
 
@@ -350,62 +526,226 @@ def find_candlestick_patterns(button, selected_assets, selected_candlestick_patt
 	Input('find_signals_button', 'n_clicks'),
 	State('assets_dropdown', 'value'),
 	State('select_signals_dropdown', 'value'),
+	State('only_new_bars', 'value'),
 	prevent_initial_call=True
 )
 
-def find_signals(button, selected_assets, selected_signals):
-
-	for asset in selected_assets:
-
-		df = pd.read_csv(f'datasets/{asset}.csv')
-		
-		close_price = df['Close']
-
-		'''
-		'Crossover SMA 5/20', 'Crossover SMA 10/50', 'Crossover SMA 20/100', 'Crossover SMA 50/200'
+@metrics.timed
+def find_signals(button, selected_assets, selected_signals, only_new_bars):
+	return submit_job('Find signals', compute.find_signals, selected_assets,
+		selected_signals=selected_signals, only_new_bars='Only new bars' in only_new_bars)
 
-		selected_EMA = [element for element in selected_indicators if 'EMA ' in element]
-		periods = [element.split(' ')[1] for element in selected_EMA]
-		for period in periods:
-			df[f'EMA {period}'] = indicators.exponential_moving_average(close_price, int(period))
-		'''
-
-		selected_ma_crossovers = [element for element in selected_signals if 'Crossover SMA' in element]
-		periods = [element.split(' ')[2] for element in selected_ma_crossovers]
-		for period in periods:
-			fast_and_slow = period.split('/')
-			fast_ma = df[f'SMA {fast_and_slow[0]}']
-			slow_ma = df[f'SMA {fast_and_slow[1]}']
-		
-			df[f'Crossover SMA {period} Signal'] = signals.moving_average_crossover(fast_ma, slow_ma)
-
-
-
-		if 'RSI' in selected_signals:
-			df['RSI Signal'] = signals.relative_strength_index(close_price, df['RSI'])
+''' Jobs with their progress, polled while any is pending or running; a cancelled job keeps the assets already done '''
+@app.callback(
+	Output('jobs_message', 'children'),
+	Output('jobs_interval', 'disabled'),
+	Input('jobs_interval', 'n_intervals'),
+	Input('calculate_indicators_message', 'children'),
+	Input('find_candlestick_patterns_message', 'children'),
+	Input('find_signals_message', 'children'),
+	Input({'type': 'cancel_job', 'index': ALL}, 'n_clicks'),
+	prevent_initial_call=True
+)
 
-		if 'MACD' in selected_signals:
-			df['MACD Signal'] = signals.moving_average_convergence_divergence(df['MACD Histogram'])
+@metrics.timed
+def display_jobs(n_intervals, indicators_message, patterns_message, signals_message, cancel_clicks):
+	if isinstance(ctx.triggered_id, dict) and ctx.triggered[0]['value']:
+		jobs.cancel(ctx.triggered_id['index'])
+
+	items = []
+	for job in reversed(jobs.snapshot()):
+		summary = job.summary()
+		rate = f', {summary["Assets/s"]} assets/s' if summary['Assets/s'] else ''
+		items.append(html.Div(f'Job {job.id}: {job.description}, {summary["Status"]}, {summary["Done"]} assets in {summary["Seconds"]} s{rate}'))
+		if summary['Status'] in ['pending', 'running']:
+			done = len(job.results) / len(job.assets) * 100 if job.assets else 0
+			items.append(dbc.Progress(value=done, label=summary['Done'], striped=summary['Status'] == 'running', animated=summary['Status'] == 'running'))
+			items.append(dbc.Button('Cancel', id={'type': 'cancel_job', 'index': job.id}, n_clicks=0, size='sm', color='secondary'))
+		else:
+			items.append(compute_alert(dict(job.results), summary['Status'], job.assets))
+	return items, not jobs.active()
+
+''' Backtesting signals and candlestick patterns of the selected assets, each alone and as an equal weight portfolio (see backtest.py) '''
+@app.callback(
+	Output('backtest_message', 'children'),
+	Input('backtest_button', 'n_clicks'),
+	State('assets_dropdown', 'value'),
+	State('backtest_columns_dropdown', 'value'),
+	State('backtest_mode', 'value'),
+	State('backtest_commission', 'value'),
+	State('backtest_slippage', 'value'),
+	State('backtest_hold', 'value'),
+	prevent_initial_call=True
+)
 
-		if 'Bollinger' in selected_signals:
-			df['Bollinger Signal'] = signals.bollinger(close_price, df['Upper band'], df['Lower band'])
+@metrics.timed
+def run_backtest(button, selected_assets, selected_columns, mode, commission, slippage, hold):
+	assets = [asset for asset in selected_assets or [] if storage.exists(asset)]
+	if not assets or not selected_columns:
+		return dbc.Alert('Select assets and signals', color='warning', dismissable=True)
+	results = backtest.run(assets, selected_columns, mode.lower(), (commission or 0) / 100, (slippage or 0) / 100, int(hold) if hold else None)
+	if results.empty:
+		return dbc.Alert('None of the selected signals are computed for these assets', color='warning', dismissable=True)
+	return dbc.Table.from_dataframe(results.round(2), size='sm', striped=True)
+
+''' Parameter sweep of a strategy over the selected assets, with the backtest settings above (see sweep.py). It runs in a
+background thread and the ranked configurations are polled while it runs; the same sweep started again resumes '''
+sweep_status = {}
+sweep_lock = threading.Lock()
+
+def sweep_progress(done, total, rows):
+	with sweep_lock:
+		sweep_status.update(done=done, total=total)
+		sweep_status['results'].append(rows)
+
+def run_sweep(assets, strategy, configurations, **kwargs):
+	try:
+		sweep.run(assets, strategy, configurations, progress=sweep_progress, stopped=sweep_status['stopped'], **kwargs)
+	except Exception as error:
+		with sweep_lock:
+			sweep_status['error'] = f'{type(error).__name__}: {error}'
+	with sweep_lock:
+		sweep_status['running'] = False
 
-		if 'Stochastic' in selected_signals:
-			df['Stochastic Signal'] = signals.stochastic(df['Stochastic %D'])
+@app.callback(
+	Output('sweep_message', 'children'),
+	Output('sweep_interval', 'disabled'),
+	Input('sweep_button', 'n_clicks'),
+	Input('cancel_sweep_button', 'n_clicks'),
+	Input('sweep_interval', 'n_intervals'),
+	State('assets_dropdown', 'value'),
+	State('sweep_strategy', 'value'),
+	State('sweep_ranges', 'value'),
+	State('backtest_mode', 'value'),
+	State('backtest_commission', 'value'),
+	State('backtest_slippage', 'value'),
+	State('backtest_hold', 'value'),
+	prevent_initial_call=True
+)
 
-		if 'Williams %R' in selected_signals:
-			df['Williams %R Signal'] = signals.williams_r(df['Williams %R'])
+@metrics.timed
+def parameter_sweep(sweep_button, cancel_button, n_intervals, selected_assets, strategy, ranges, mode, commission, slippage, hold):
+	if ctx.triggered_id == 'sweep_button':
+		configurations = sweep.grid(strategy, sweep.parse_ranges(ranges))
+		if not selected_assets or not configurations:
+			return dbc.Alert('Select assets and parameter ranges', color='warning', dismissable=True), True
+		with sweep_lock:
+			if sweep_status.get('running'):
+				return dbc.Alert('Sweep already running', color='warning', dismissable=True), False
+			sweep_status.clear()
+			sweep_status.update(strategy=strategy, configurations=configurations, results=[], done=0, total=None, running=True, error=None, stopped=threading.Event())
+		threading.Thread(target=run_sweep, args=(selected_assets, strategy, configurations), kwargs={'mode': mode.lower(),
+			'commission': (commission or 0) / 100, 'slippage': (slippage or 0) / 100, 'hold': int(hold) if hold else None}, daemon=True).start()
+	elif ctx.triggered_id == 'cancel_sweep_button':
+		with sweep_lock:
+			if sweep_status.get('running'):
+				sweep_status['stopped'].set()
+
+	with sweep_lock:
+		if not sweep_status:
+			return [], True
+		status = dict(sweep_status)
+		results = [rows for rows in sweep_status['results'] if len(rows)]
+	text = f'{status["strategy"]}: {len(status["configurations"])} configurations, {status["done"]} of {status["total"] or "?"} tasks done'
+	if status['error']:
+		alert = dbc.Alert(f'{text}, failed: {status["error"]}', color='danger', dismissable=True)
+	elif status['running']:
+		alert = dbc.Alert(text, color='info')
+	else:
+		alert = dbc.Alert(text + (', cancelled' if status['stopped'].is_set() else ''), color='warning' if status['stopped'].is_set() else 'success', dismissable=True)
+	ranked = sweep.rank(pd.concat(results, ignore_index=True), status['strategy'], status['configurations']) if results else pd.DataFrame()
+	return [alert] + ([dbc.Table.from_dataframe(ranked.round(2), size='sm', striped=True)] if len(ranked) else []), not status['running']
 
-		if 'CCI' in selected_signals:
-			df['CCI Signal'] = signals.commodity_channel_index(df['CCI'])
+''' Screener over the latest-state index of all assets (see summary.py), as a view and as /api/screener?conditions=...&sort=...
+&ascending=0&columns=a,b returning JSON records '''
+@app.callback(
+	Output('screener_modal', 'is_open'),
+	Input('open_screener_button', 'n_clicks'),
+	Input('close_screener_button', 'n_clicks'),
+	State('screener_modal', 'is_open'),
+	prevent_initial_call=True
+)
 
-		if 'Aroon' in selected_signals:
-			df['Aroon Signal'] = signals.aroon(df['Aroon Up'], df['Aroon Down'])
+@metrics.timed
+def toggle_screener(n1, n2, is_open):
+	return not is_open
 
-		df.to_csv(f'datasets/{asset}.csv', index=False)
+@app.callback(
+	Output('screener_table', 'data'),
+	Output('screener_table', 'columns'),
+	Output('screener_columns', 'options'),
+	Output('screener_message', 'children'),
+	Input('screener_modal', 'is_open'),
+	Input('screener_button', 'n_clicks'),
+	Input('screener_conditions', 'value'),
+	Input('screener_columns', 'value'),
+	prevent_initial_call=True
+)
 
-	alert = dbc.Alert('Succes', color='success', dismissable=True)
-	return alert
+@metrics.timed
+def run_screener(is_open, button, conditions, columns):
+	if not is_open:
+		return no_update, no_update, no_update, no_update
+	errors = []
+	conditions = summary.parse_conditions(conditions, errors)
+	if errors:																			# Not screened with the others only, that would widen the result
+		return [], [], no_update, [html.Div(error, style={'color': 'red'}) for error in errors]
+	result = summary.screen(conditions, columns=columns)
+	options = [column for column in summary.read_index(refresh=False).columns if column != 'Date']
+	result['Date'] = result['Date'].dt.strftime('%Y-%m-%d')
+	message = html.Div(f'{len(result)} assets' + ('' if conditions else ', no conditions given'))
+	return result.round(4).to_dict('records'), [{'name': column, 'id': column} for column in result.columns], options, message
+
+@app.server.route('/api/screener')
+def screener_api():
+	columns = [column for column in request.args.get('columns', '').split(',') if column]
+	try:
+		result = summary.screen(request.args.get('conditions', ''), request.args.get('sort'), request.args.get('ascending', '0') == '1', columns)
+	except ValueError as error:
+		return jsonify({'error': str(error)}), 400
+	result['Date'] = result['Date'].dt.strftime('%Y-%m-%d')
+	return jsonify(result.astype(object).where(result.notna(), None).to_dict('records'))
+
+''' Metrics: every callback request is timed under the name of its callback, the phases of the callback are spans of
+their own (see metrics.py). /metrics returns latency histograms, counters and cache statistics as JSON,
+/metrics?reset=1 starts them over. /metrics/profile?count=3&callback=display_graph profiles the next 3 requests of
+the callback (of any callback without callback=) and /metrics/profile lists the summaries of the saved profiles '''
+def callback_name():
+	if not request.path.endswith('_dash-update-component'):
+		return None
+	output = (request.get_json(silent=True) or {}).get('output')
+	callback = app.callback_map.get(output, {}).get('callback')
+	return getattr(callback, '__name__', output)
+
+@app.server.before_request
+def start_request_metrics():
+	name = callback_name()
+	if name:
+		metrics.start_request(name)
+
+@app.server.after_request
+def finish_request_metrics(response):
+	metrics.finish_request(response.calculate_content_length() or 0)
+	return response
+
+@app.server.teardown_request
+def close_request_metrics(error):
+	''' A request that raised skips after_request: its timing and profile end here, so the profiler stops and the next
+	profile can be taken '''
+	metrics.finish_request(0)
+
+@app.server.route('/metrics')
+def metrics_api():
+	if request.args.get('reset') == '1':
+		metrics.reset()
+	caches = {'datasets': cache_info(), 'indicators': indicator_cache.cache_info(), 'chart windows': {'entries': len(window.tables), 'max': window.tables_max}}
+	return jsonify(metrics.snapshot(caches))
+
+@app.server.route('/metrics/profile')
+def profile_api():
+	if 'count' in request.args:
+		metrics.arm_profile(int(request.args['count']), request.args.get('callback'))
+	return jsonify({'profiling': metrics.snapshot()['profiling'], 'profiles': list(metrics.profiles)})
 
 ''' Toggle modal '''
 @app.callback(
@@ -416,51 +756,161 @@ def find_signals(button, selected_assets, selected_signals):
 	prevent_initial_call=True
 )
 
+@metrics.timed
 def toggle_modal(n1, n2, is_open):
 	if n1 or n2:
 		return not is_open
 	return is_open
 
-''' Import dataset '''
+''' Import datasets. Symbols are downloaded in parallel by a background thread, the modal polls its progress '''
+import_status = {}																		# symbol -> status of the last bulk import
+import_lock = threading.Lock()
+
+def import_progress(symbol, result):
+	with import_lock:
+		if isinstance(result, Exception):
+			import_status[symbol] = {'Symbol': symbol, 'Status': 'failed', 'Rows': None, 'Seconds': None, 'Error': str(result)}
+			return
+		import_status[symbol] = {'Symbol': symbol, 'Status': 'imported', 'Rows': result['rows'], 'Seconds': round(result['seconds'], 2), 'Error': ''}
+	invalidate_dataset(symbol)
+	if symbol not in avalaible_datasets:
+		avalaible_datasets.append(symbol)														# Updating list of datasets
+
 @app.callback(
 	Output('import_message', 'children'),
-	[Input('import_button', 'n_clicks')],
-	[State('import_symbol', 'value')],
+	Output('import_interval', 'disabled'),
+	Input('import_button', 'n_clicks'),
+	Input('import_interval', 'n_intervals'),
+	State('import_symbol', 'value'),
+	State('import_file', 'contents'),
 	prevent_initial_call=True
 )
 
-def import_dataset(import_button, import_symbol):
-	if type(import_symbol) == str:
-		url = 'https://stooq.com/q/d/l/?s=' + import_symbol + '&i=d'
-		csv_file = ('datasets/' + import_symbol + '.csv')
-		urlretrieve(url, csv_file)
-		avalaible_datasets.append(import_symbol)													# Updating list of datasets
-		alert = dbc.Alert('{} imported'.format(str(import_symbol)), color='success', dismissable=True)
-		return alert
+@metrics.timed
+def import_dataset(import_button, n_intervals, import_symbol, import_file):
+	if ctx.triggered_id == 'import_button':
+		text = import_symbol or ''
+		if import_file:
+			text += ' ' + base64.b64decode(import_file.split(',', 1)[1]).decode()
+		symbols = update.parse_symbols(text)
+		if not symbols:
+			return dbc.Alert('No symbols given', color='warning', dismissable=True), True
+		with import_lock:
+			if any(status['Status'] == 'downloading' for status in import_status.values()):
+				return dbc.Alert('Import already running', color='warning', dismissable=True), False
+			import_status.clear()
+			for symbol in symbols:
+				import_status[symbol] = {'Symbol': symbol, 'Status': 'downloading', 'Rows': None, 'Seconds': None, 'Error': ''}
+		threading.Thread(target=update.import_datasets, args=(symbols,), kwargs={'progress': import_progress}, daemon=True).start()
+
+	with import_lock:
+		if not import_status:
+			return [], True
+		status = pd.DataFrame(list(import_status.values()))
+	running = (status['Status'] == 'downloading').any()
+	imported = (status['Status'] == 'imported').sum()
+	alert = dbc.Alert(f'{imported} of {len(status)} imported', color='info' if running else 'success', dismissable=True)
+	return [alert, dbc.Table.from_dataframe(status, size='sm')], not running
+
+''' Timeframe of the chart: the level of the asset (see resample.py), built the first time the timeframe is asked for.
+Cached levels are kept up to date by the imports, updates and compute jobs that write the asset '''
+@app.callback(
+	Output('chart_level', 'data'),
+	Input('asset', 'value'),
+	Input('timeframe', 'value'),
+)
+
+@metrics.timed
+def select_timeframe(asset, timeframe):
+	if asset is None or not timeframe:
+		return asset
+	try:
+		level = resample.level_name(asset, timeframe)
+	except ValueError:																	# Not a timeframe, bars as stored
+		return asset
+	if not storage.exists(level):
+		resample.update(asset, timeframe)
+	return level
+
+''' Live mode is started and stopped here, for the selected asset on its base bars only: one engine at a time '''
+@app.callback(
+	Output('live_asset', 'data'),
+	Input('live', 'value'),
+	Input('chart_level', 'data'),
+	State('asset', 'value'),
+)
+
+@metrics.timed
+def toggle_live(live, chart_level, asset):
+	live_asset = asset if 'Live' in (live or []) and asset is not None and chart_level == asset else None
+	for other in list(streaming.live_engines):
+		if other != live_asset:
+			streaming.stop(other)
+	if live_asset is not None:
+		streaming.start(live_asset)
+	return live_asset
 
 @app.callback(
 	Output('graph', 'figure'),
+	Output('live_traces', 'data'),
+	Output('live_interval', 'disabled'),
+	Output('chart_view', 'data'),
+	Output('chart_traces', 'data'),
 	Input('asset', 'value'),
 	Input('date_range', 'value'),
+	Input('chart_level', 'data'),
 	Input('main_chart', 'value'),
 	Input('overlays', 'value'),
 	Input('oscillator1', 'value'),
 	Input('oscillator2', 'value'),
 	Input('signals', 'value'),
 	Input('candlestick_patterns', 'value'),
+	Input('live_asset', 'data'),
+	Input('custom_indicators', 'value'),
+	Input('graph', 'relayoutData'),
+	State('chart_view', 'data'),
+	State('chart_traces', 'data'),
 	prevent_initial_call=True
 )
 
-def display_graph(asset, date_range, main_chart, overlays, oscillator1, oscillator2, signals, candlestick_patterns):
-
-	fig = make_subplots(rows=3, cols=1, shared_xaxes=True, vertical_spacing=0.03, row_heights=[0.6, 0.2, 0.2])
-
-	if asset is not None:
-
-		df = pd.read_csv('datasets/' + asset + '.csv')
-
-		# X AXIS RANGE
-
+@metrics.timed
+def display_graph(asset, date_range, chart_level, main_chart, overlays, oscillator1, oscillator2, signals, candlestick_patterns, live_asset, custom_indicators, relayout_data, chart_view, chart_traces):
+
+	# The view is the selected date range until the user zooms or pans the chart, then the zoomed range. A double
+	# click goes back to the selected date range
+	if ctx.triggered_id == 'graph':
+		view = zoomed_range(relayout_data)
+		if view is None:
+			return no_update, no_update, no_update, no_update, no_update
+		view = None if view == 'reset' else view
+	elif ctx.triggered_id in ['asset', 'date_range', 'chart_level']:
+		view = None
+	else:
+		view = chart_view
+
+	# TIMEFRAME: the chart is drawn from the level of the asset chosen by select_timeframe, streamed bars come from the
+	# engine started by toggle_live. Both are only read here
+	chart_asset = chart_level if asset is not None and (chart_level or '').startswith(f'{asset}/') else asset
+	is_live = live_asset is not None and live_asset == chart_asset
+
+	if asset is None:
+		return make_subplots(rows=3, cols=1, shared_xaxes=True, vertical_spacing=0.03, row_heights=[0.6, 0.2, 0.2]), [], True, view, None
+
+	metrics.mark('read dataset')
+	# One read of the schema for the whole render: the dataset cache, the extremes and the figure on screen are keyed by
+	# the same versions even if a write lands meanwhile
+	schema = storage.read_schema(chart_asset)
+	data_version, price_version = storage.data_version(chart_asset, schema), storage.price_version(chart_asset, schema)
+	df = load_dataset(chart_asset, chart_columns(main_chart, overlays, [oscillator1, oscillator2], signals, candlestick_patterns), schema)
+	dates = df['Date'].values.astype('datetime64[s]')									# Serialized without nanoseconds
+	breaks = trading_calendar.rangebreaks((chart_asset, price_version), dates)
+	axes = {1: {}, 2: {}, 3: {}}															# Y axis settings of each row
+
+	# X AXIS RANGE: only the rows in view and a margin around them are drawn (see window.py)
+
+	def view_range(view):
+		if view is not None:
+			return [np.datetime64(pd.Timestamp(date)).astype('datetime64[s]') for date in view]
 		if date_range != 'Max':
 			if date_range == '3M':
 				delta = timedelta(days = 30)
@@ -470,31 +920,111 @@ def display_graph(asset, date_range, main_chart, overlays, oscillator1, oscillat
 				delta = timedelta(days = 365)
 			elif date_range == '3Y':
 				delta = timedelta(days = 3 * 365)
-
-			end_date = df['Date'].iloc[-1]
-			end_date_object = datetime.strptime(end_date, '%Y-%m-%d').date()
-			start_date_object = end_date_object - delta
-			start_date = start_date_object.strftime('%Y-%m-%d')
-
-			fig.update_xaxes(range=[start_date, end_date])	
-
-		# Y AXIS RANGE
-
-			subset = df[(df['Date'] > start_date) & (df['Date'] < end_date)]
-
-			main_chart_max = subset['Close'].max() * 1.05
-			main_chart_min = subset['Close'].min() * 0.95
-
-			fig.update_yaxes(range=[main_chart_min, main_chart_max], row=1, col=1)
-
-		# MAIN CHART
+			return dates[-1] - np.timedelta64(delta).astype('timedelta64[s]'), dates[-1]
+		return dates[0], dates[-1]
+
+	# A view off the data (zoomed or panned past either end) has no rows to range the y axes on: the previous view is
+	# kept, or the selected date range if that one is off the data too, and the whole figure is redrawn at that range
+	requested = view
+	for view in [view] + ([chart_view] if view is not None and chart_view and chart_view != view else []) + [None]:
+		start_date, end_date = view_range(view)
+		first, last = window.rows(dates, start_date, end_date)							# Rows in view
+		if first < last or view is None:
+			break
+	zoomed = view is not None or date_range != 'Max'
+	margin = (end_date - start_date) * window.margin
+	shown_first, shown_last = window.rows(dates, start_date - margin, end_date + margin)
+
+	# Y AXIS RANGE of the rows in view, from sparse tables of the whole columns (volume bins are sums, that axis
+	# ranges itself)
+
+	metrics.mark('custom indicators')
+	custom = {}
+	for name, parameters in indicator_cache.parse_indicators(custom_indicators):			# Any parameters, memoized on disk, see indicator_cache.py
+		for column, values in indicator_cache.compute(chart_asset, name, parameters).items():
+			custom[column] = (values, 1 if name in indicator_cache.overlay_indicators else 2)
+
+	def extremes(column, values=None, key=None):
+		return window.extremes(key or (chart_asset, data_version, column), df[column].values if values is None else values, first, last)
+
+	metrics.mark('view ranges')
+	if zoomed:
+		main_chart_min = extremes('Low' if main_chart == 'Candlesticks' else 'Close')[0] * 0.95
+		main_chart_max = extremes('High' if main_chart == 'Candlesticks' else 'Close')[1] * 1.05
+
+		axes[1]['range'] = [main_chart_min, main_chart_max]
+
+	row_ranges = {2: [], 3: []}
+	for row_number, oscillator in [(2, oscillator1), (3, oscillator2)]:
+		axes[row_number] = {'title': {'text': oscillator}, 'tickvals': oscillator_ticks.get(oscillator), 'range': None, 'autorange': True}
+		if zoomed and oscillator in oscillator_columns and oscillator != 'Volume':
+			row_ranges[row_number] += [extremes(column) for column in oscillator_columns[oscillator]]
+	for column, (values, row) in custom.items():
+		if zoomed and row > 1:
+			row_ranges[row].append(extremes(column, values, (chart_asset, price_version, 'custom', column)))
+	for row_number, ranges in row_ranges.items():
+		ranges = [(low, high) for low, high in ranges if np.isfinite(low)]
+		if ranges:
+			axes[row_number].update(range=[min(low for low, high in ranges), max(high for low, high in ranges)], autorange=False)
+
+	df = df.iloc[shown_first:shown_last]
+	dates = dates[shown_first:shown_last]
+	custom = {column: (values[shown_first:shown_last], row) for column, (values, row) in custom.items()}
+
+	# TRACE GROUPS: every menu item draws a group of traces. When the data behind the chart is the same as in the
+	# figure on screen (same asset, data version, rows and main chart), only the groups that were added are built and
+	# the figure is patched, the others stay in the browser untouched
+
+	metrics.mark('traces')
+	metrics.count('rows charted', len(df))
+	state = [chart_asset, data_version, main_chart, shown_first, shown_last, first, last, is_live]
+	drawn = chart_traces['groups'] if chart_traces and chart_traces['state'] == state and view == requested else []
+	drawn_keys = [key for key, count, live_offsets in drawn]
+	groups = OrderedDict()																	# key: [(trace, row, live column)], None if already drawn
+	group = None
+
+	live_columns = streaming.live_columns() if is_live else []
+
+	def build(key):
+		''' Registers the group, True if its traces have to be made '''
+		nonlocal group
+		group = None if key in drawn_keys else []
+		groups[key] = group
+		return group is not None
+
+	def add(trace, row=1, live_marker=True):
+		group.append((trace, row, None))
+		column = 'Close' if trace.name == 'Close Price' else trace.name
+		if live_marker and column in live_columns:
+			group.append((go.Scatter(x=[], y=[], mode='markers', marker=dict(color='orange', size=8), name=column + ' live'), row, column))
+
+	# LEVEL OF DETAIL: traces are reduced to what the plot can show (see downsample.py), the rows in view get the
+	# whole budget. Signals and candlestick patterns are drawn from all shown rows
+	scale = len(df) / max(last - first, 1)
+	reduced = {}
+
+	def line(column, name=None, **style):
+		if column not in reduced:
+			values = custom[column][0] if column in custom else df[column]
+			reduced.update(downsample.lines(dates, {column: values}, downsample.line_budget(scale)))
+		x, y = reduced[column]
+		style.setdefault('line_color', trace_color(column))
+		return go.Scatter(x=x, y=y, name=name or column, **style)
+
+	def bars(column, how='sum'):
+		x, y = downsample.bars(dates, df[column], downsample.bar_budget(scale), how)
+		return go.Bar(x=x, y=y, name=column, marker_color=trace_color(column))
+
+	# MAIN CHART
+	if build(f'main {main_chart}'):
 		if main_chart == 'Candlesticks':
-			fig.add_trace(go.Candlestick(
-				x=df['Date'],
-				open=df['Open'],
-				high=df['High'],
-				low=df['Low'],
-				close=df['Close'],
+			x, open_price, high_price, low_price, close_price = downsample.ohlc(dates, df['Open'], df['High'], df['Low'], df['Close'], downsample.bar_budget(scale))
+			add(go.Candlestick(
+				x=x,
+				open=open_price,
+				high=high_price,
+				low=low_price,
+				close=close_price,
 				increasing_line_color='black',
 				decreasing_line_color='black',
 				increasing_fillcolor='white',
@@ -502,150 +1032,210 @@ def display_graph(asset, date_range, main_chart, overlays, oscillator1, oscillat
 				increasing_line_width=1,
 				decreasing_line_width=1,
 				showlegend=False,
-			), row=1, col=1)
+			))
+			if is_live:
+				group.append((go.Scatter(x=[], y=[], mode='lines', line=dict(color='orange', width=1), name='Live candle'), 1, 'Candle wick'))
+				group.append((go.Scatter(x=[], y=[], mode='lines', line=dict(color='orange', width=6), name='Live candle'), 1, 'Candle body'))
 		elif main_chart == 'Close':
-			fig.add_trace(go.Scatter(x=df['Date'], y=df['Close'], name='Close Price'), row=1, col=1)
-
-		# OVERLAYS
-		if type(overlays) == list:		
-			if 'SMA 5' in overlays:
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['SMA 5'], name='SMA 5'), row=1, col=1)
-			if 'SMA 10' in overlays:
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['SMA 10'], name='SMA 10'), row=1, col=1)
-			if 'SMA 20' in overlays:
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['SMA 20'], name='SMA 20'), row=1, col=1)
-			if 'SMA 50' in overlays:
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['SMA 50'], name='SMA 50'), row=1, col=1)
-			if 'SMA 100' in overlays:
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['SMA 100'], name='SMA 100'), row=1, col=1)
-			if 'SMA 200' in overlays:
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['SMA 200'], name='SMA 200'), row=1, col=1)
-			if 'EMA 5' in overlays:
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['EMA 5'], name='EMA 5'), row=1, col=1)
-			if 'EMA 10' in overlays:
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['EMA 10'], name='EMA 10'), row=1, col=1)
-			if 'EMA 20' in overlays:
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['EMA 20'], name='EMA 20'), row=1, col=1)
-			if 'EMA 50' in overlays:
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['EMA 50'], name='EMA 50'), row=1, col=1)
-			if 'EMA 100' in overlays:
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['EMA 100'], name='EMA 100'), row=1, col=1)
-			if 'EMA 200' in overlays:
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['EMA 200'], name='EMA 200'), row=1, col=1)
-			if 'Bollinger' in overlays:
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['Upper band'], name='Upper band'), row=1, col=1)
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['Lower band'], name='Lower band'), row=1, col=1)
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['SMA 20'], name='SMA 20'), row=1, col=1)
-
-
-		# OSCILLATORS
-		def oscillator_update(oscillator_number, row_number):
-			if oscillator_number == 'Volume':
-				fig.add_trace(go.Bar(x=df['Date'], y=df['Volume'], name='Volume'), row=row_number, col=1)
-				fig.update_yaxes(title_text='Volume', row=row_number, col=1)
-			elif oscillator_number == 'MACD':
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['MACD'], line_color='blue', name='MACD'), row=row_number, col=1)
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['MACD Signal Line'], line_color='red', name='MACD Signal Line'), row=row_number, col=1)
-				fig.add_trace(go.Bar(x=df['Date'], y=df['MACD Histogram'], name='MACD Histogram'), row=row_number, col=1)
-				fig.update_yaxes(title_text='MACD', row=row_number, col=1)
-				if date_range != 'Max':
-					subset_max = subset['MACD'].max()
-					subset_min = subset['MACD'].min()
-					fig.update_yaxes(range=[subset_min, subset_max], row=row_number, col=1)
-			elif oscillator_number == 'RSI':
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['RSI'], line_color='blue', name='RSI'), row=row_number, col=1)
-				fig.update_yaxes(title_text='RSI', tickvals=[30, 70], row=row_number, col=1)
-			elif oscillator_number == 'Stochastic':
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['Stochastic %K'], name='Stochastic %K'), row=row_number, col=1)
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['Stochastic %D'], name='Stochastic %D'), row=row_number, col=1)
-				fig.update_yaxes(title_text='Stochastic', tickvals=[20, 80], row=row_number, col=1)
-			elif oscillator_number == 'SMA Ratios':
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['SMA 5/20 ratio'], name='SMA 5/20 ratio'), row=row_number, col=1)
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['SMA 10/50 ratio'], name='SMA 10/50 ratio'), row=row_number, col=1)
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['SMA 20/100 ratio'], name='SMA 20/100 ratio'), row=row_number, col=1)
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['SMA 50/200 ratio'], name='SMA 50/200 ratio'), row=row_number, col=1)
-				fig.update_yaxes(title_text='SMA Ratios', row=row_number)
-			elif oscillator_number == 'EMA Ratios':
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['EMA 5/20 ratio'], name='EMA 5/20 ratio'), row=row_number, col=1)
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['EMA 10/50 ratio'], name='EMA 10/50 ratio'), row=row_number, col=1)
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['EMA 20/100 ratio'], name='EMA 20/100 ratio'), row=row_number, col=1)
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['EMA 50/200 ratio'], name='EMA 50/200 ratio'), row=row_number, col=1)
-				fig.update_yaxes(title_text='EMA Ratios', row=row_number)
-			elif oscillator_number == 'Williams %R':
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['Williams %R'], name='Williams %R'), row=row_number, col=1)
-				fig.update_yaxes(title_text='Williams %R', row=row_number)
-			elif oscillator_number == 'CCI':
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['CCI'], name='CCI'), row=row_number, col=1)
-				fig.update_yaxes(title_text='CCI', tickvals=[-100, 0, 100], row=row_number)
-			elif oscillator_number == 'Aroon':
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['Aroon Up'], name='Aroon Up'), row=row_number, col=1)
-				fig.add_trace(go.Scatter(x=df['Date'], y=df['Aroon Down'], name='Aroon Down'), row=row_number, col=1)
-				fig.update_yaxes(title_text='Aroon', row=row_number)
-
-		if oscillator1:
-			oscillator_update(oscillator1, 2)
-		if oscillator2:
-			oscillator_update(oscillator2, 3)
-
-		# SIGNALS
-		def show_signals(signal_type):
-			df_slice = df.loc[df[signal_type + ' Signal'] == 1]
-			x_list = df_slice['Date'].to_list()
-			y_list = df_slice['Close'].to_list()
-			fig.add_trace(go.Scatter(x=x_list, y=y_list, mode='markers', marker=dict(color='green', symbol='triangle-up', size=10), name=signal_type)) 
-			df_slice = df.loc[df[signal_type + ' Signal'] == -1]
-			x_list = df_slice['Date'].to_list()
-			y_list = df_slice['Close'].to_list()
-			fig.add_trace(go.Scatter(x=x_list, y=y_list, mode='markers', marker=dict(color='red', symbol='triangle-down', size=10), name=signal_type)) 
-
-		if type(signals) == list:
-			for signal in signals:
+			add(line('Close', name='Close Price'))
+
+	# OVERLAYS
+	for overlay in all_overlays:
+		if overlay in (overlays or []) and build(f'overlay {overlay}'):
+			for column in overlay_columns[overlay]:
+				add(line(column))
+
+	# OSCILLATORS
+	def oscillator_update(oscillator_number, row_number):
+		if oscillator_number == 'Volume':
+			add(bars('Volume'), row_number)
+		elif oscillator_number == 'MACD':
+			add(line('MACD', line_color='blue'), row_number)
+			add(line('MACD Signal Line', line_color='red'), row_number)
+			add(bars('MACD Histogram', 'extreme'), row_number)
+		elif oscillator_number == 'RSI':
+			add(line('RSI', line_color='blue'), row_number)
+		else:
+			for column in oscillator_columns.get(oscillator_number, []):
+				add(line(column), row_number)
+
+	if oscillator1 and build(f'oscillator 2 {oscillator1}'):
+		oscillator_update(oscillator1, 2)
+	if oscillator2 and build(f'oscillator 3 {oscillator2}'):
+		oscillator_update(oscillator2, 3)
+
+	# CUSTOM INDICATORS
+	for column, (values, row) in custom.items():
+		if build(f'custom {column}'):
+			add(line(column), row)
+
+	# SIGNALS
+	def show_signals(signal_type):
+		found = df[signal_type + ' Signal'].values == 1
+		x_list = dates[found]
+		y_list = df['Close'].values[found]
+		add(go.Scatter(x=x_list, y=y_list, mode='markers', marker=dict(color='green', symbol='triangle-up', size=10), name=signal_type), live_marker=False)
+		found = df[signal_type + ' Signal'].values == -1
+		x_list = dates[found]
+		y_list = df['Close'].values[found]
+		add(go.Scatter(x=x_list, y=y_list, mode='markers', marker=dict(color='red', symbol='triangle-down', size=10), name=signal_type), live_marker=False)
+
+	if type(signals) == list:
+		for signal in signals:
+			if build(f'signal {signal}'):
 				show_signals(signal)
 
-		# CANDLESTICK PATTERS
-		def show_candlestick_patterns(pattern):
-			df_slice = df.loc[df[pattern] == 1]
-			x_list = df_slice['Date'].to_list()
-			y_list = df_slice['Close'].to_list()
-			fig.add_trace(go.Scatter(x=x_list, y=y_list, mode='markers', marker=dict(color='green', symbol='circle', size=10), name=pattern)) 
-			df_slice = df.loc[df[pattern] == -1]
-			x_list = df_slice['Date'].to_list()
-			y_list = df_slice['Close'].to_list()
-			fig.add_trace(go.Scatter(x=x_list, y=y_list, mode='markers', marker=dict(color='red', symbol='circle', size=10), name=pattern)) 
-
-		if type(candlestick_patterns) == list:
-			for pattern in candlestick_patterns:
+	# CANDLESTICK PATTERS
+	def show_candlestick_patterns(pattern):
+		found = df[pattern].values == 1
+		x_list = dates[found]
+		y_list = df['Close'].values[found]
+		add(go.Scatter(x=x_list, y=y_list, mode='markers', marker=dict(color='green', symbol='circle', size=10), name=pattern), live_marker=False)
+		found = df[pattern].values == -1
+		x_list = dates[found]
+		y_list = df['Close'].values[found]
+		add(go.Scatter(x=x_list, y=y_list, mode='markers', marker=dict(color='red', symbol='circle', size=10), name=pattern), live_marker=False)
+
+	if type(candlestick_patterns) == list:
+		for pattern in candlestick_patterns:
+			if build(f'pattern {pattern}'):
 				show_candlestick_patterns(pattern)
 
-		# OTHER FORMATTING
+	# WEBGL: when a line or marker trace has more than webgl_points points, every scatter trace of the figure is drawn
+	# with WebGL, so layering and styles stay the same for all of them. Plotly hides WebGL traces on axes with
+	# rangebreaks, so such a figure keeps a continuous x axis. A figure on screen keeps its mode while groups are added;
+	# a new group needing WebGL on an SVG figure redraws the whole figure
+	longest = max([len(trace.x) for traces in groups.values() for trace, row, column in traces or [] if isinstance(trace, go.Scatter) and trace.x is not None] + [0])
+	webgl = longest > webgl_points or bool(drawn and chart_traces.get('webgl'))
+	if drawn and webgl != bool(chart_traces.get('webgl')):
+		return display_graph(asset, date_range, chart_level, main_chart, overlays, oscillator1, oscillator2, signals, candlestick_patterns, live_asset, custom_indicators, relayout_data, chart_view, None)
+	if webgl:
+		for key, traces in groups.items():
+			if traces is not None:
+				groups[key] = [(webgl_trace(trace), row, column) for trace, row, column in traces]
+		breaks = []
+
+	# Groups kept in their place, new ones after them
+	records = {key: [key, count, live_offsets] for key, count, live_offsets in drawn if key in groups}
+	for key, traces in groups.items():
+		if traces is not None:
+			records[key] = [key, len(traces), [[offset, column] for offset, (trace, row, column) in enumerate(traces) if column]]
+	order = [key for key in drawn_keys if key in groups] + [key for key, traces in groups.items() if traces is not None]
+
+	live_traces = []
+	position = 0
+	for key in order:
+		live_traces += [[position + offset, column] for offset, column in records[key][2]]
+		position += records[key][1]
+	chart_traces = {'state': state, 'groups': [records[key] for key in order], 'webgl': webgl}
+
+	metrics.mark('figure')
+	if drawn:
+		return patch_figure(drawn, groups, axes), live_traces, not live_traces, view, chart_traces
 
-		fig.update_xaxes(
-			showline=True, linewidth=2, linecolor='gray', mirror=True, 
-			gridcolor='white')
-		fig.update_yaxes(
-			showline=True, linewidth=2, linecolor='gray', mirror=True, 
-			gridcolor='white',
-			zeroline=True, zerolinewidth=1, zerolinecolor='gray')
+	fig = make_subplots(rows=3, cols=1, shared_xaxes=True, vertical_spacing=0.03, row_heights=[0.6, 0.2, 0.2])
+	for key in order:
+		for trace, row, column in groups[key]:
+			fig.add_trace(trace, row=row, col=1)
+
+	if zoomed:
+		fig.update_xaxes(range=[pd.Timestamp(start_date), pd.Timestamp(end_date)])
+	for row_number, axis in axes.items():
+		fig.update_yaxes(axis, row=row_number, col=1)
+
+	# OTHER FORMATTING
+
+	fig.update_xaxes(
+		showline=True, linewidth=2, linecolor='gray', mirror=True, 
+		gridcolor='white')
+	fig.update_yaxes(
+		showline=True, linewidth=2, linecolor='gray', mirror=True, 
+		gridcolor='white',
+		zeroline=True, zerolinewidth=1, zerolinecolor='gray')
+
+	fig.update_xaxes(showticklabels=True, row=1, col=1)
+	fig.update_xaxes(showticklabels=True, row=2, col=1)
+	fig.update_xaxes(rangebreaks=breaks)												# Weekends, holidays and nights cut out, see trading_calendar.py
+
+	fig.update_layout(
+		height=800,
+		margin_t=10, margin_l=10, margin_r=20, margin_b=20, 
+		paper_bgcolor='white', plot_bgcolor='whitesmoke',
+		xaxis_rangeslider_visible=False,
+		showlegend=False
+	)
+
+	return fig, live_traces, not live_traces, view, chart_traces
+
+def patch_figure(drawn, groups, axes):
+	''' Patch turning the figure on screen (groups drawn, as [key, number of traces, live offsets]) into the new one:
+	traces of dropped groups are deleted, new groups appended, oscillator axes updated '''
+	patch = Patch()
+	removed = []
+	position = 0
+	for key, count, live_offsets in drawn:
+		if key not in groups:
+			removed += range(position, position + count)
+		position += count
+	for index in reversed(removed):
+		del patch['data'][index]
+
+	for traces in groups.values():
+		for trace, row, column in traces or []:
+			trace.update(xaxis='x' if row == 1 else f'x{row}', yaxis='y' if row == 1 else f'y{row}')
+			patch['data'].append(trace)
+
+	for row_number in [2, 3]:
+		for name, value in axes[row_number].items():
+			patch['layout'][f'yaxis{row_number}'][name] = value
+	return patch
+
+def zoomed_range(relayout_data):
+	''' [start, end] of the x axis after the user zoomed or panned the chart, 'reset' after a double click, None if the
+	x axis did not change (zooming a y axis, resizing) '''
+	relayout_data = relayout_data or {}
+	for key, value in relayout_data.items():
+		match = re.fullmatch(r'(xaxis\d*)\.(range\[0\]|range|autorange)', key)
+		if match is None:
+			continue
+		if match.group(2) == 'autorange':
+			return 'reset'
+		if match.group(2) == 'range':
+			return list(value)
+		return [value, relayout_data[match.group(1) + '.range[1]']]
+	return None
+
+''' Live mode: the streaming engine (see streaming.py) is polled and the forming bar is pushed into the live traces
+with extendData, two points per trace, so the figure is never rebuilt between ticks '''
+@app.callback(
+	Output('graph', 'extendData'),
+	Output('live_status', 'children'),
+	Input('live_interval', 'n_intervals'),
+	State('asset', 'value'),
+	State('live_traces', 'data'),
+	prevent_initial_call=True
+)
 
-		fig.update_xaxes(showticklabels=True, row=1, col=1)
-		fig.update_xaxes(showticklabels=True, row=2, col=1)
+@metrics.timed
+def display_live(n_intervals, asset, live_traces):
+	values = streaming.latest(asset)
+	if not values or not live_traces:
+		return no_update, 'Live: waiting for bars'
 
-		fig.update_layout(
-			height=800,
-			margin_t=10, margin_l=10, margin_r=20, margin_b=20, 
-			paper_bgcolor='white', plot_bgcolor='whitesmoke',
-			xaxis_rangeslider_visible=False,
-			showlegend=False
-		)
+	x, y = [], []
+	for index, column in live_traces:
+		x.append([values['Date'], values['Date']])
+		if column == 'Candle wick':
+			y.append([values['Low'], values['High']])
+		elif column == 'Candle body':
+			y.append([values['Open'], values['Close']])
+		else:
+			y.append([values[column], values[column]])
 
-	return fig
+	fired = [f'{name} {"buy" if values[name] == 1 else "sell"}' for name in streaming.all_signal_columns + all_candlestick_patterns if values.get(name, 0) != 0]
+	status = f'Live {values["Time"]}  Close {values["Close"]}' + (': ' + ', '.join(fired) if fired else '')
+	return [{'x': x, 'y': y}, [index for index, column in live_traces], 2], status
 
 
 if __name__ == '__main__':
 	app.run_server(debug=True, use_reloader=True)
-
-		# Removing empty dates from X axis            ! NEED RUN FASTER
-	#	dt_all = pd.date_range(start=df['Date'].iloc[0],end=df['Date'].iloc[-1])
-	#	dt_obs = [d.strftime("%Y-%m-%d") for d in pd.to_datetime(df['Date'])]
-	#	dt_breaks = [d for d in dt_all.strftime("%Y-%m-%d").tolist() if not d in dt_obs]
-	#	fig.update_xaxes(rangebreaks=[dict(values=dt_breaks)])
\ No newline at end of file
@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+
+import storage
+
+''' Vectorized backtests of the signal and candlestick pattern columns (+1 buy, -1 sell). A strategy holds the position of
+its last signal, trades at the close of the signal bar and pays commission and slippage, both as fractions of the traded
+value, on every change of position. Strategies are the columns of 2-D arrays (bars x strategies), so every column of
+every asset runs in one pass with no loop over bars. Assets are aligned on the union of their dates; an equal weight
+portfolio of the assets is backtested per column, rebalanced every bar over the assets trading that day '''
+
+commission = 0.001																		# Fraction of the traded value
+slippage = 0.0005																		# Fraction of the traded value lost to the spread and market impact
+modes = ['long', 'short', 'long/short']
+chunk_size = 256																		# Assets per pass, bounds memory to chunk_size x columns x bars
+days_per_year = 365.25
+
+def positions(signals, mode='long', hold=None):
+	''' Position after each bar (bars x strategies): the last +1 or -1 signal, held until the opposite one or for hold bars
+	at most (candlestick patterns only give signals of one side). Long mode is flat after a -1, short mode flat after a +1 '''
+	signals = np.asarray(signals, dtype=float)
+	bars = np.arange(len(signals)).reshape((-1,) + (1,) * (signals.ndim - 1))
+	last = np.where((signals == 1) | (signals == -1), bars, -1)
+	np.maximum.accumulate(last, axis=0, out=last)
+	state = np.where(last >= 0, np.take_along_axis(signals, np.maximum(last, 0), axis=0), 0)
+	if hold is not None:
+		state[bars - last >= hold] = 0
+	if mode == 'long':
+		return (state == 1).astype(float)
+	if mode == 'short':
+		return -(state == -1).astype(float)
+	return state
+
+def strategy_returns(close, signals, mode='long', commission=commission, slippage=slippage, hold=None):
+	''' (net returns, positions) per bar and strategy. close and signals are bars x strategies; returns are NaN where there
+	is no price, the position taken at a bar earns the return of the next one '''
+	close = np.asarray(close, dtype=float)
+	held = positions(signals, mode, hold)
+	held[~np.isfinite(close)] = 0
+	with np.errstate(invalid='ignore', divide='ignore'):
+		returns = np.concatenate([np.full((1,) + close.shape[1:], np.nan), close[1:] / close[:-1] - 1])
+	previous = np.concatenate([np.zeros((1,) + held.shape[1:]), held[:-1]])
+	turnover = np.abs(held - previous)
+	net = previous * np.nan_to_num(returns) - turnover * (commission + slippage)
+	net[~np.isfinite(close)] = np.nan
+	return net, held
+
+def statistics(returns, held, dates, cost=0):
+	''' DataFrame of summary statistics, one row per strategy (column of returns), each over its own bars with a price.
+	cost is the commission and slippage per unit of turnover that returns were charged, so the cost of opening a trade
+	counts against that trade rather than the one the bar's return belongs to '''
+	returns, held = np.asarray(returns, dtype=float), np.asarray(held, dtype=float)
+	bars, strategies = returns.shape
+	valid = np.isfinite(returns)
+	counts = valid.sum(axis=0)
+	rows = np.arange(bars)[:, None]
+	first = np.where(valid, rows, bars).min(axis=0).clip(max=bars - 1)
+	last = np.where(valid, rows, -1).max(axis=0).clip(min=0)
+	years = (dates[last] - dates[first]) / np.timedelta64(1, 'D') / days_per_year
+
+	equity = np.cumprod(1 + np.nan_to_num(returns), axis=0)
+	drawdown = equity / np.maximum.accumulate(equity, axis=0) - 1
+
+	# Trades: a trade starts when the position changes to a new non-zero one and collects the returns it earns
+	previous = np.concatenate([np.zeros((1, strategies)), held[:-1]])
+	entries = (held != 0) & (held != previous)
+	trade = np.cumsum(entries, axis=0) * (held != 0)									# Trade number held after each bar, 0 when flat
+	earning = np.concatenate([np.zeros((1, strategies), dtype=int), trade[:-1]])			# Trade the return of each bar belongs to
+	entry_cost = np.where(entries, np.abs(held) * cost, 0)								# Charged at the entry bar, whose return the previous trade earns
+	offset = np.arange(strategies) * (bars + 1)
+	flat = np.concatenate([(earning + offset).ravel(), (trade + offset).ravel()])
+	with np.errstate(invalid='ignore'):
+		logs = np.concatenate([np.log1p(np.nan_to_num(returns) + entry_cost).ravel(), np.log1p(-entry_cost).ravel()])
+		trade_returns = np.bincount(flat, logs, minlength=strategies * (bars + 1)).reshape(strategies, bars + 1)
+	trades = entries.sum(axis=0)
+	wins = ((trade_returns[:, 1:] > 0) & (np.arange(1, bars + 1) <= trades[:, None])).sum(axis=1)
+
+	with np.errstate(invalid='ignore', divide='ignore'):
+		periods = counts / years
+		mean = np.where(valid, returns, 0).sum(axis=0) / counts
+		deviation = np.sqrt((np.where(valid, returns - mean, 0) ** 2).sum(axis=0) / counts)
+		return pd.DataFrame({
+			'Total return %': (equity[-1] - 1) * 100,
+			'CAGR %': (equity[-1] ** (1 / years) - 1) * 100,
+			'Volatility %': deviation * np.sqrt(periods) * 100,
+			'Sharpe': mean / deviation * np.sqrt(periods),
+			'Max drawdown %': drawdown.min(axis=0) * 100,
+			'Trades': trades,
+			'Win rate %': wins / trades * 100,
+			'Exposure %': (held != 0).sum(axis=0) / counts * 100,
+		})
+
+def load(assets, columns):
+	''' (dates, close bars x assets, signals bars x assets x columns) aligned on the union of the dates, NaN where an asset
+	has no bar or no such column '''
+	data = []
+	for asset in assets:
+		available = set(storage.read_schema(asset)['columns'])
+		data.append(storage.read_columns(asset, ['Date', 'Close'] + [column for column in columns if column in available], copy=False))
+	dates = np.unique(np.concatenate([asset_data['Date'] for asset_data in data]))
+	close = np.full((len(dates), len(assets)), np.nan)
+	signals = np.full((len(dates), len(assets), len(columns)), np.nan)
+	for number, asset_data in enumerate(data):
+		rows = np.searchsorted(dates, asset_data['Date'])
+		close[rows, number] = asset_data['Close']
+		for position, column in enumerate(columns):
+			if column in asset_data:
+				signals[rows, number, position] = asset_data[column]
+	return dates, close, signals
+
+def run(assets, columns, mode='long', commission=commission, slippage=slippage, hold=None):
+	''' Backtests every column of every asset, and with more than one asset the equal weight portfolio of each column.
+	Returns a DataFrame of statistics with Asset and Signal columns, the portfolio as asset 'Portfolio' '''
+	results = []
+	chunks = []
+	for first in range(0, len(assets), chunk_size):
+		chunk = assets[first:first + chunk_size]
+		dates, close, signals = load(chunk, columns)
+		strategies = np.repeat(close, len(columns), axis=1)							# One strategy per asset and column
+		returns, held = strategy_returns(strategies, signals.reshape(len(dates), -1), mode, commission, slippage, hold)
+		missing = np.isnan(signals).all(axis=0).ravel()								# Assets without the column
+		stats = statistics(returns, held, dates, commission + slippage)
+		stats.insert(0, 'Signal', np.tile(columns, len(chunk)))
+		stats.insert(0, 'Asset', np.repeat(chunk, len(columns)))
+		results.append(stats[~missing])
+		returns[:, missing] = np.nan
+		held[np.isnan(returns)] = np.nan
+		chunks.append((pd.DataFrame(returns, index=dates), pd.DataFrame(held, index=dates)))
+
+	if len(assets) > 1:
+		returns = pd.concat([chunk[0] for chunk in chunks], axis=1)						# Bars of every chunk on the dates of all
+		held = pd.concat([chunk[1] for chunk in chunks], axis=1).values.reshape(len(returns), -1, len(columns))
+		values = returns.values.reshape(len(returns), -1, len(columns))
+		trading = np.isfinite(values).sum(axis=1)
+		with np.errstate(invalid='ignore', divide='ignore'):
+			portfolio = np.nansum(values, axis=1) / trading								# Equal weight over the assets trading each bar
+			exposure = np.nansum(np.abs(held), axis=1) / trading
+		stats = statistics(portfolio, np.nan_to_num(exposure), returns.index.values)
+
+		# Trades of the portfolio are the trades of its assets
+		per_asset = pd.concat(results)
+		totals = per_asset.assign(Wins=(per_asset['Win rate %'].fillna(0) * per_asset['Trades'] / 100).round()).groupby('Signal')[['Trades', 'Wins']].sum().reindex(columns)
+		with np.errstate(invalid='ignore', divide='ignore'):
+			stats['Trades'] = totals['Trades'].fillna(0).astype(int).values
+			stats['Win rate %'] = (totals['Wins'] / totals['Trades']).values * 100
+			stats['Exposure %'] = np.nansum(exposure, axis=0) / np.isfinite(exposure).sum(axis=0) * 100
+		stats.insert(0, 'Signal', columns)
+		stats.insert(0, 'Asset', 'Portfolio')
+		results.append(stats[totals['Trades'].notna().values])					# Columns no asset has are left out
+
+	return pd.concat(results, ignore_index=True)
@@ -0,0 +1,249 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+import candlestick_patterns
+import compute
+import indicator_cache
+import planner
+import storage
+import streaming
+
+''' Benchmarks of the indicators, candlestick patterns, signals, the dataset store and chart building on synthetic
+OHLCV bars, from 10^3 to 10^7 rows for one asset and from 1 to 5,000 assets for the compute steps. Every case reports
+its best time over a few runs and its peak memory (Python and numpy allocations of the calling process, from an extra
+traced run). A run is saved as JSON in datasets/.benchmarks/ and compared with an earlier one: cases slower by more than
+tolerance are flagged as regressions. Benchmarks run in a temporary directory, so the datasets/ every module writes to
+is scratch data, never the real store.
+
+	python benchmark.py --rows 1000 100000 --groups indicators patterns --compare datasets/.benchmarks/<run>.json '''
+
+results_path = os.path.abspath(os.path.join(storage.path, '.benchmarks'))
+row_counts = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]
+asset_counts = [1, 10, 100, 1000, 5000]
+asset_rows = 2500																		# Bars per asset of the multi-asset cases, about ten years of daily bars
+repeats = 3																				# Best of, cases slower than a second run once
+tolerance = 0.25																		# Slower by more than this fraction is a regression
+noise_floor = 0.005																		# Seconds, faster cases are not compared
+single_groups = ['indicators', 'patterns', 'signals', 'storage', 'chart']				# Timed on one asset per row count
+groups = single_groups + ['assets']														# Timed per asset count
+
+def synthetic(rows, seed=0):
+	''' Random walk OHLCV bars, one a minute from 2000 (10^7 of them fit in datetime64[ns]) '''
+	rng = np.random.default_rng(seed)
+	close_price = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, rows)))
+	open_price = np.concatenate([[100], close_price[:-1]]) * np.exp(rng.normal(0, 0.002, rows))
+	high_price = np.fmax(open_price, close_price) * (1 + np.abs(rng.normal(0, 0.005, rows)))
+	low_price = np.fmin(open_price, close_price) * (1 - np.abs(rng.normal(0, 0.005, rows)))
+	return pd.DataFrame({'Date': pd.date_range('2000-01-03', periods=rows, freq='min'), 'Open': open_price, 'High': high_price,
+		'Low': low_price, 'Close': close_price, 'Volume': rng.integers(1000, 1000000, rows).astype(float)})
+
+def measure(function):
+	''' (best seconds, peak bytes) of function() '''
+	times = []
+	while len(times) < repeats and sum(times) < 1:
+		gc.collect()
+		start = time.perf_counter()
+		function()
+		times.append(time.perf_counter() - start)
+	gc.collect()
+	tracemalloc.start()
+	try:
+		function()
+		peak = tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+	return min(times), peak
+
+def indicator_cases(df):
+	cases = []
+	for name, (function, inputs, outputs, parameters) in indicator_cache.indicator_functions.items():
+		cases.append((name, partial(function, *[df[column] for column in inputs], *parameters)))
+	return cases
+
+def pattern_cases(df):
+	prices = [df['Open'], df['High'], df['Low'], df['Close']]
+	cases = [(pattern, partial(candlestick_patterns.find_pattern, *prices, pattern)) for pattern in candlestick_patterns.all_patterns]
+	return cases + [('All patterns', partial(candlestick_patterns.find_patterns, *prices, candlestick_patterns.all_patterns, True))]
+
+def signal_cases(df):
+	''' Signal functions on their inputs, the indicators they need are computed beforehand (see planner.py) '''
+	order, reused = planner.plan(streaming.all_signal_columns, list(df.columns))
+	values = {column: df[column] for column in reused}
+	cases = []
+	for spec in order:
+		inputs = [values[column] for column in spec['inputs']]
+		results = spec['function'](*inputs)
+		results = results if type(results) == tuple else (results,)
+		for column, result in zip(spec['outputs'], results):
+			values[column] = pd.Series(result, index=df.index) if isinstance(result, np.ndarray) else result
+		if spec['name'] in streaming.all_signal_columns:
+			cases.append((spec['name'], partial(spec['function'], *inputs)))
+	return cases
+
+def append_bars(asset, bars):
+	''' Appends the bars dated after the last stored bar, so every call adds new rows '''
+	last = np.load(storage.column_file(asset, 'Date'), mmap_mode='r')[-1]
+	storage.append_rows(asset, bars.assign(Date=last + (bars['Date'] - bars['Date'].iloc[0]).values + np.timedelta64(1, 'm')))
+
+def storage_cases(df):
+	storage.write_dataset('benchmark', df)
+	df.to_csv('benchmark.csv', index=False)
+	bars = synthetic(max(1, len(df) // 100), seed=1)
+	return [
+		('Write dataset', partial(storage.write_dataset, 'benchmark write', df)),
+		('Read dataset', partial(storage.read_dataset, 'benchmark')),
+		('Read Date and Close', partial(storage.read_columns, 'benchmark', ['Date', 'Close'])),
+		('Append 1% rows', partial(append_bars, 'benchmark', bars)),
+		('Write CSV', partial(df.to_csv, 'benchmark write.csv', index=False)),
+		('Read CSV', partial(pd.read_csv, 'benchmark.csv', parse_dates=['Date'])),
+	]
+
+def chart_cases(df):
+	''' display_graph of the app with candlesticks, overlays, oscillators, signals and patterns: a new figure with the
+	datasets read from disk, the same figure again (datasets cached, as on a change of menu) and its serialization '''
+	import plotly.io
+	from dash._callback_context import context_value
+	from dash._utils import AttributeDict
+
+	import app																			# Dash is needed for this group only
+	import window
+
+	storage.write_dataset('chart', df)
+	patterns = candlestick_patterns.all_patterns[:3]
+	planner.run('chart', ['SMA 50', 'Upper band', 'Lower band', 'SMA 20', 'MACD', 'MACD Signal Line', 'MACD Histogram', 'RSI']
+		+ streaming.all_signal_columns + patterns)
+	arguments = dict(asset='chart', date_range='Max', chart_level='chart', main_chart='Candlesticks', overlays=['SMA 50', 'Bollinger'],
+		oscillator1='Volume', oscillator2='MACD', signals=[column.replace(' Signal', '') for column in streaming.all_signal_columns],
+		candlestick_patterns=patterns, live_asset=None, custom_indicators=None, relayout_data=None, chart_view=None, chart_traces=None)
+
+	def figure(cold=False):
+		if cold:
+			app.dataset_cache.clear()
+			window.tables.clear()
+		context_value.set(AttributeDict(triggered_inputs=[{'prop_id': 'asset.value', 'value': 'chart'}]))
+		return app.display_graph(**arguments)[0]
+
+	return [
+		('Figure, datasets read', partial(figure, True)),
+		('Figure, datasets cached', figure),
+		('Serialize figure', partial(plotly.io.to_json, figure(), validate=False)),
+	]
+
+def read_datasets(assets):
+	for asset in assets:
+		storage.read_dataset(asset)
+
+def write_datasets(assets, df):
+	for asset in assets:
+		storage.write_dataset(asset, df)
+
+def asset_cases(count, workers):
+	''' Compute steps of the app over count assets of asset_rows bars each, as run from its offcanvas '''
+	df = synthetic(asset_rows)
+	assets = [f'asset {number}' for number in range(count)]
+	write_datasets(assets, df)
+	run = partial(compute.run_in_processes, assets=assets, workers=workers)
+	return [
+		('Write datasets', partial(write_datasets, assets, df)),
+		('Read datasets', partial(read_datasets, assets)),
+		('Indicators', partial(run, compute.calculate_indicators, batch=True, selected_indicators=list(indicator_cache.indicator_functions))),
+		('Candlestick patterns', partial(run, compute.find_candlestick_patterns, selected_candlestick_patterns=candlestick_patterns.all_patterns)),
+		('Signals', partial(run, compute.find_signals, selected_signals=[column.replace(' Signal', '') for column in streaming.all_signal_columns])),
+	]
+
+single_cases = {'indicators': indicator_cases, 'patterns': pattern_cases, 'signals': signal_cases, 'storage': storage_cases, 'chart': chart_cases}
+
+def run(rows=row_counts, assets=asset_counts, selected_groups=groups, workers=compute.max_workers, report=print):
+	''' Runs the selected groups in a temporary directory and returns the results as a dict ready for JSON '''
+	results = []
+
+	def time_cases(group, cases, row_count, asset_count):
+		for case, function in cases:
+			seconds, peak = measure(function)
+			results.append({'group': group, 'case': case, 'rows': row_count, 'assets': asset_count, 'seconds': seconds, 'peak_bytes': peak})
+			report(f'{group:<10} {case:<32} {row_count:>10} rows {asset_count:>5} assets {seconds * 1000:>12.2f} ms {peak / 2 ** 20:>10.1f} MB')
+
+	directory = os.getcwd()
+	with tempfile.TemporaryDirectory() as scratch:
+		os.chdir(scratch)
+		try:
+			for row_count in rows:
+				df = synthetic(row_count)
+				for group in [group for group in single_groups if group in selected_groups]:
+					time_cases(group, single_cases[group](df), row_count, 1)
+			if 'assets' in selected_groups:
+				for asset_count in assets:
+					time_cases('assets', asset_cases(asset_count, workers), asset_rows, asset_count)
+		finally:
+			os.chdir(directory)
+
+	return {
+		'started': datetime.now().isoformat(timespec='seconds'),
+		'machine': {'platform': platform.platform(), 'processor': platform.processor(), 'cpus': os.cpu_count(), 'workers': workers,
+			'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__},
+		'results': results,
+	}
+
+def save(run_results, file=None):
+	os.makedirs(results_path, exist_ok=True)
+	file = file or os.path.join(results_path, run_results['started'].replace(':', '-') + '.json')
+	with open(file, 'w') as f:
+		json.dump(run_results, f, indent=1)
+	return file
+
+def load(file):
+	with open(file) as f:
+		return json.load(f)
+
+def latest_run(exclude=None):
+	''' File of the most recent saved run, None if there is none '''
+	if not os.path.exists(results_path):
+		return None
+	files = sorted(os.path.join(results_path, file) for file in os.listdir(results_path) if file.endswith('.json'))
+	files = [file for file in files if exclude is None or not os.path.samefile(file, exclude)]
+	return files[-1] if files else None
+
+def compare(current, baseline, tolerance=tolerance):
+	''' DataFrame of the cases of both runs with their time and memory ratios (current / baseline) and a Regression
+	column: slower by more than tolerance, cases under noise_floor in both runs left out '''
+	key = ['group', 'case', 'rows', 'assets']
+	table = pd.DataFrame(current['results']).merge(pd.DataFrame(baseline['results']), on=key, suffixes=('', ' baseline'))
+	table = table[(table['seconds'] >= noise_floor) | (table['seconds baseline'] >= noise_floor)].copy()
+	table['time ratio'] = table['seconds'] / table['seconds baseline']
+	table['memory ratio'] = table['peak_bytes'] / table['peak_bytes baseline'].replace(0, np.nan)
+	table['Regression'] = table['time ratio'] > 1 + tolerance
+	return table.reset_index(drop=True)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmarks of indicators, patterns, signals, storage and chart building')
+	parser.add_argument('--rows', type=int, nargs='+', default=row_counts, help='Row counts of the single asset groups')
+	parser.add_argument('--assets', type=int, nargs='+', default=asset_counts, help='Asset counts of the assets group')
+	parser.add_argument('--groups', nargs='+', default=groups, choices=groups)
+	parser.add_argument('--workers', type=int, default=compute.max_workers, help='Worker processes of the assets group')
+	parser.add_argument('--output', help='JSON file of the results, by default a new file in ' + results_path)
+	parser.add_argument('--compare', help='JSON file of an earlier run, by default the latest saved run')
+	parser.add_argument('--tolerance', type=float, default=tolerance)
+	arguments = parser.parse_args()
+
+	baseline = arguments.compare or latest_run()
+	current = run(arguments.rows, arguments.assets, arguments.groups, arguments.workers)
+	file = save(current, arguments.output)
+	print(f'Saved {file}')
+	if baseline is not None:
+		table = compare(current, load(baseline), arguments.tolerance)
+		regressions = table[table['Regression']]
+		print(f'Compared with {baseline}: {len(table)} cases, {len(regressions)} regressions')
+		if len(regressions):
+			print(regressions[['group', 'case', 'rows', 'assets', 'seconds baseline', 'seconds', 'time ratio']].to_string(index=False))
+			raise SystemExit(1)
@@ -1,206 +1,213 @@
 import pandas as pd
 import numpy as np
 
-def find_pattern(open_price, high_price, low_price, close_price, pattern):
+all_patterns = ['White Marubozu', 'Black Marubozu', 
+	'Bullish Engulfing', 'Bearish Engulfing', 'Bullish Harami', 'Bearish Harami', 'Tweezer Bottom', 'Tweezer Top', 'Piercing Line', 'Dark Cloud Cover', 
+	'Morning Star', 'Evening Star', 'Three White Soldiers', 'Three Black Crows',
+	'Three Inside Up', 'Three Inside Down', 'Three Outside Up', 'Three Outside Down',
+	'Upside Tasuki Gap', 'Downside Tasuki Gap']
 
-	realbody = (open_price - close_price).abs()
-	candle_range = high_price - low_price
-	upper_shadow = high_price - pd.concat([close_price, open_price], axis=1).max(axis=1)
-	lower_shadow = pd.concat([close_price, open_price], axis=1).min(axis=1) - low_price
+''' Every pattern is a rule over the features of the bar and of the two bars before it (o, h, l, c, realbody, candle_range,
+body_top, body_bottom; suffixes 1 and 2 are the bars one and two days back, NaN before the first bar, so comparisons
+with them are False like with Series.shift). find_patterns() builds the features once and evaluates any number of rules '''
 
+pattern_rules = {
 	# TREND REVERSAL PATTERNS
-	if pattern == 'White Marubozu':
-		series = np.where(
-			(close_price > open_price) &
-			(close_price == high_price) &
-			(open_price == low_price)
-		, 1, 0)
-
-	if pattern == 'Black Marubozu':
-		series = np.where(
-			(close_price < open_price) &
-			(close_price == low_price) &
-			(open_price == high_price)
-		, -1, 0)
-
-	if pattern == 'Bullish Engulfing':
-		series = np.where(
-			(close_price > open_price) &
-			(close_price.shift(1) < open_price.shift(1)) &
-			(close_price > open_price.shift(1)) &
-			(open_price < close_price.shift(1))
-		, 1, 0)
-
-	if pattern == 'Bearish Engulfing':
-		series = np.where(
-			(close_price < open_price) &
-			(close_price.shift(1) > open_price.shift(1)) &
-			(close_price < open_price.shift(1)) &
-			(open_price > close_price.shift(1))
-		, -1, 0)
-
-	if pattern == 'Bullish Harami':
-		series = np.where(
-			(close_price > open_price) &
-			(close_price.shift(1) < open_price.shift(1)) &
-			(close_price < open_price.shift(1)) &
-			(open_price > close_price.shift(1))
-		, 1, 0)
-
-	if pattern == 'Bearish Harami':
-		series = np.where(
-			(close_price < open_price) &
-			(close_price.shift(1) > open_price.shift(1)) &
-			(close_price > open_price.shift(1)) &
-			(open_price < close_price.shift(1))
-		, -1, 0)
-
-	if pattern == 'Tweezer Bottom':
-		series = np.where(
-			(open_price < close_price) &
-			(open_price.shift(1) < close_price.shift(1)) &
-			(low_price == low_price.shift(1))
-		, 1, 0)
-
-	if pattern == 'Tweezer Top':
-		series = np.where(
-			(open_price > close_price) &
-			(open_price.shift(1) > close_price.shift(1)) &
-			(high_price == high_price.shift(1))
-		, -1, 0)
-
-	if pattern == 'Piercing Line':
-		series = np.where(
-			(close_price > open_price) &
-			(close_price.shift(1) < open_price.shift(1)) &
-			(open_price < close_price.shift(1)) &
-			(close_price > (open_price.shift(1) + close_price.shift(1))/2)
-		, 1, 0)
-
-	if pattern == 'Dark Cloud Cover':
-		series = np.where(
-			(close_price < open_price) &
-			(close_price.shift(1) > open_price.shift(1)) &
-			(close_price > open_price.shift(1)) &
-			(close_price < (open_price.shift(1) + close_price.shift(1))/2)
-		, -1, 0)
-
-	if pattern == 'Morning Star':
-		series = np.where(
-			(close_price.shift(2) < open_price.shift(2)) &
-			(close_price > open_price) &
-			(open_price > pd.concat([close_price, open_price], axis=1).max(axis=1).shift(1)) &
-			(close_price.shift(2) > pd.concat([close_price, open_price], axis=1).max(axis=1).shift(1)) &
-			(close_price > (close_price.shift(2) + open_price.shift(2))/2)
-		, 1, 0)
-
-	if pattern == 'Evening Star':
-		series = np.where(
-			(close_price.shift(2) > open_price.shift(2)) &
-			(close_price < open_price) &
-			(open_price < pd.concat([close_price, open_price], axis=1).min(axis=1).shift(1)) &
-			(close_price.shift(2) < pd.concat([close_price, open_price], axis=1).min(axis=1).shift(1)) &
-			(close_price < (close_price.shift(2) + open_price.shift(2))/2)
-		, -1, 0)
-
-	if pattern == 'Three White Soldiers':
-		series = np.where(
-			(close_price > open_price) &
-			(close_price.shift(1) > open_price.shift(1)) &
-			(close_price.shift(2) > open_price.shift(2)) &
-			(close_price > close_price.shift(1)) &
-			(close_price.shift(1) > close_price.shift(2)) &
-			(open_price > open_price.shift(1)) &
-			(open_price.shift(1) > open_price.shift(2)) &
-			(realbody > 0.8 * candle_range) &
-			(realbody.shift(1) > 0.8 * candle_range.shift(1)) &
-			(realbody.shift(2) > 0.8 * candle_range.shift(2)) &
-			(open_price < close_price.shift(1)) &
-			(open_price.shift(1) < close_price.shift(2))
-		, 1, 0)
-
-	if pattern == 'Three Black Crows':
-		series = np.where(
-			(close_price < open_price) &
-			(close_price.shift(1) < open_price.shift(1)) &
-			(close_price.shift(2) < open_price.shift(2)) &
-			(close_price < close_price.shift(1)) &
-			(close_price.shift(1) < close_price.shift(2)) &
-			(open_price < open_price.shift(1)) &
-			(open_price.shift(1) < open_price.shift(2)) &
-			(realbody > 0.8 * candle_range) &
-			(realbody.shift(1) > 0.8 * candle_range.shift(1)) &
-			(realbody.shift(2) > 0.8 * candle_range.shift(2)) &
-			(open_price < close_price.shift(1)) &
-			(open_price.shift(1) < close_price.shift(2))
-		, -1, 0)
-
-	if pattern == 'Three Inside Up':
-		series = np.where(
-			(open_price.shift(2) > close_price.shift(2)) &
-			(open_price.shift(1) < close_price.shift(1)) &
-			(open_price < close_price) &
-			(close_price.shift(1) < open_price.shift(2)) &
-			(close_price.shift(2) < open_price.shift(1)) &
-			(close_price > close_price.shift(1)) &
-			(open_price > open_price.shift(1))
-		,1 ,0)
-
-	if pattern == 'Three Inside Down':
-		series = np.where(
-			(open_price.shift(2) < close_price.shift(2)) &
-			(open_price.shift(1) > close_price.shift(1)) &
-			(open_price > close_price) &
-			(close_price.shift(1) > open_price.shift(2)) &
-			(close_price.shift(2) > open_price.shift(1)) &
-			(close_price < close_price.shift(1)) &
-			(open_price < open_price.shift(1))
-		,-1 ,0)
-
-	if pattern == 'Three Outside Up':
-		series = np.where(
-			(open_price.shift(2) > close_price.shift(2)) &
-			(open_price.shift(1) < close_price.shift(1)) &
-			(open_price < close_price) &
-			(close_price.shift(1) > open_price.shift(2)) &
-			(close_price.shift(2) > open_price.shift(1)) &
-			(close_price > close_price.shift(1)) &
-			(open_price > open_price.shift(1))
-		,1 ,0)
-
-	if pattern == 'Three Outside Down':
-		series = np.where(
-			(open_price.shift(2) < close_price.shift(2)) &
-			(open_price.shift(1) > close_price.shift(1)) &
-			(open_price > close_price) &
-			(close_price.shift(1) > open_price.shift(2)) &
-			(close_price.shift(2) > open_price.shift(1)) &
-			(close_price < close_price.shift(1)) &
-			(open_price < open_price.shift(1))
-		,-1 ,0)
-
-	if pattern == 'Upside Tasuki Gap':
-		series = np.where(
-			(close_price.shift(2) > open_price.shift(2)) &
-			(close_price.shift(1) > open_price.shift(1)) &
-			(open_price > close_price) &
-			(open_price.shift(1) > close_price.shift(2)) &
-			(open_price > open_price.shift(1)) &
-			(close_price < close_price.shift(2)) &
-			(open_price < close_price.shift(1)) &
-			(close_price > open_price.shift(2))
-		, 1, 0)
-
-	if pattern == 'Downside Tasuki Gap':
-		series = np.where(
-			(close_price.shift(2) < open_price.shift(2)) &
-			(close_price.shift(1) < open_price.shift(1)) &
-			(open_price < close_price) &
-			(open_price.shift(1) < close_price.shift(2)) &
-			(open_price < open_price.shift(1)) &
-			(close_price > close_price.shift(2)) &
-			(open_price > close_price.shift(1)) &
-			(close_price < open_price.shift(2))
-		, -1, 0)
-
-	return series
\ No newline at end of file
+	'White Marubozu': (1, lambda f:
+		(f.c > f.o) &
+		(f.c == f.h) &
+		(f.o == f.l)),
+
+	'Black Marubozu': (-1, lambda f:
+		(f.c < f.o) &
+		(f.c == f.l) &
+		(f.o == f.h)),
+
+	'Bullish Engulfing': (1, lambda f:
+		(f.c > f.o) &
+		(f.c1 < f.o1) &
+		(f.c > f.o1) &
+		(f.o < f.c1)),
+
+	'Bearish Engulfing': (-1, lambda f:
+		(f.c < f.o) &
+		(f.c1 > f.o1) &
+		(f.c < f.o1) &
+		(f.o > f.c1)),
+
+	'Bullish Harami': (1, lambda f:
+		(f.c > f.o) &
+		(f.c1 < f.o1) &
+		(f.c < f.o1) &
+		(f.o > f.c1)),
+
+	'Bearish Harami': (-1, lambda f:
+		(f.c < f.o) &
+		(f.c1 > f.o1) &
+		(f.c > f.o1) &
+		(f.o < f.c1)),
+
+	'Tweezer Bottom': (1, lambda f:
+		(f.o < f.c) &
+		(f.o1 < f.c1) &
+		(f.l == f.l1)),
+
+	'Tweezer Top': (-1, lambda f:
+		(f.o > f.c) &
+		(f.o1 > f.c1) &
+		(f.h == f.h1)),
+
+	'Piercing Line': (1, lambda f:
+		(f.c > f.o) &
+		(f.c1 < f.o1) &
+		(f.o < f.c1) &
+		(f.c > (f.o1 + f.c1)/2)),
+
+	'Dark Cloud Cover': (-1, lambda f:
+		(f.c < f.o) &
+		(f.c1 > f.o1) &
+		(f.c > f.o1) &
+		(f.c < (f.o1 + f.c1)/2)),
+
+	'Morning Star': (1, lambda f:
+		(f.c2 < f.o2) &
+		(f.c > f.o) &
+		(f.o > f.body_top1) &
+		(f.c2 > f.body_top1) &
+		(f.c > (f.c2 + f.o2)/2)),
+
+	'Evening Star': (-1, lambda f:
+		(f.c2 > f.o2) &
+		(f.c < f.o) &
+		(f.o < f.body_bottom1) &
+		(f.c2 < f.body_bottom1) &
+		(f.c < (f.c2 + f.o2)/2)),
+
+	'Three White Soldiers': (1, lambda f:
+		(f.c > f.o) &
+		(f.c1 > f.o1) &
+		(f.c2 > f.o2) &
+		(f.c > f.c1) &
+		(f.c1 > f.c2) &
+		(f.o > f.o1) &
+		(f.o1 > f.o2) &
+		(f.realbody > 0.8 * f.candle_range) &
+		(f.realbody1 > 0.8 * f.candle_range1) &
+		(f.realbody2 > 0.8 * f.candle_range2) &
+		(f.o < f.c1) &
+		(f.o1 < f.c2)),
+
+	'Three Black Crows': (-1, lambda f:
+		(f.c < f.o) &
+		(f.c1 < f.o1) &
+		(f.c2 < f.o2) &
+		(f.c < f.c1) &
+		(f.c1 < f.c2) &
+		(f.o < f.o1) &
+		(f.o1 < f.o2) &
+		(f.realbody > 0.8 * f.candle_range) &
+		(f.realbody1 > 0.8 * f.candle_range1) &
+		(f.realbody2 > 0.8 * f.candle_range2) &
+		(f.o < f.c1) &
+		(f.o1 < f.c2)),
+
+	'Three Inside Up': (1, lambda f:
+		(f.o2 > f.c2) &
+		(f.o1 < f.c1) &
+		(f.o < f.c) &
+		(f.c1 < f.o2) &
+		(f.c2 < f.o1) &
+		(f.c > f.c1) &
+		(f.o > f.o1)),
+
+	'Three Inside Down': (-1, lambda f:
+		(f.o2 < f.c2) &
+		(f.o1 > f.c1) &
+		(f.o > f.c) &
+		(f.c1 > f.o2) &
+		(f.c2 > f.o1) &
+		(f.c < f.c1) &
+		(f.o < f.o1)),
+
+	'Three Outside Up': (1, lambda f:
+		(f.o2 > f.c2) &
+		(f.o1 < f.c1) &
+		(f.o < f.c) &
+		(f.c1 > f.o2) &
+		(f.c2 > f.o1) &
+		(f.c > f.c1) &
+		(f.o > f.o1)),
+
+	'Three Outside Down': (-1, lambda f:
+		(f.o2 < f.c2) &
+		(f.o1 > f.c1) &
+		(f.o > f.c) &
+		(f.c1 > f.o2) &
+		(f.c2 > f.o1) &
+		(f.c < f.c1) &
+		(f.o < f.o1)),
+
+	'Upside Tasuki Gap': (1, lambda f:
+		(f.c2 > f.o2) &
+		(f.c1 > f.o1) &
+		(f.o > f.c) &
+		(f.o1 > f.c2) &
+		(f.o > f.o1) &
+		(f.c < f.c2) &
+		(f.o < f.c1) &
+		(f.c > f.o2)),
+
+	'Downside Tasuki Gap': (-1, lambda f:
+		(f.c2 < f.o2) &
+		(f.c1 < f.o1) &
+		(f.o < f.c) &
+		(f.o1 < f.c2) &
+		(f.o < f.o1) &
+		(f.c > f.c2) &
+		(f.o > f.c1) &
+		(f.c < f.o2)),
+}
+
+bitmask_column = 'Candlestick Patterns Bitmask'
+
+class Features:
+	''' Price arrays of the bar and of the two previous bars plus body and range features, computed once per call '''
+
+	def __init__(self, open_price, high_price, low_price, close_price):
+		for name, values in [('o', open_price), ('h', high_price), ('l', low_price), ('c', close_price)]:
+			values = np.asarray(values, dtype=float)
+			setattr(self, name, values)
+			setattr(self, name + '1', shift(values, 1))
+			setattr(self, name + '2', shift(values, 2))
+		for days in ['', '1', '2']:
+			o, h, l, c = [getattr(self, name + days) for name in 'ohlc']
+			setattr(self, 'realbody' + days, np.abs(o - c))
+			setattr(self, 'candle_range' + days, h - l)
+			setattr(self, 'body_top' + days, np.fmax(c, o))									# Like the NaN-skipping max of pandas
+			setattr(self, 'body_bottom' + days, np.fmin(c, o))
+
+def shift(values, days):
+	shifted = np.full(len(values), np.nan)
+	shifted[days:] = values[:len(values) - days]
+	return shifted
+
+def find_patterns(open_price, high_price, low_price, close_price, patterns=all_patterns, bitmask=False):
+	''' All requested patterns in one pass. Returns {pattern: array of 1 / -1 / 0}, plus an int32 column under
+	bitmask_column with bit all_patterns.index(pattern) set on bars where the pattern occurs, if bitmask is True '''
+	features = Features(open_price, high_price, low_price, close_price)
+	results = {}
+	mask = np.zeros(len(features.c), dtype=np.int32)
+
+	with np.errstate(invalid='ignore'):
+		for pattern in patterns:
+			direction, rule = pattern_rules[pattern]
+			found = rule(features)
+			results[pattern] = np.where(found, direction, 0)
+			mask |= found.astype(np.int32) << all_patterns.index(pattern)
+
+	if bitmask:
+		results[bitmask_column] = mask
+	return results
+
+def find_pattern(open_price, high_price, low_price, close_price, pattern):
+	return find_patterns(open_price, high_price, low_price, close_price, [pattern])[pattern]
@@ -0,0 +1,115 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, CancelledError, FIRST_COMPLETED, wait
+
+import candlestick_patterns
+import storage
+import incremental
+import metrics
+import panel
+import planner
+import resample
+import summary
+
+''' Compute steps of the app (indicators, candlestick patterns, signals) as plain functions of assets, so they can run
+in worker processes. Every worker reads, computes and writes its own assets; only asset names, parameters and short
+result summaries cross process boundaries '''
+
+max_workers = os.cpu_count() or 1														# Worker processes, 1 runs everything in the calling process
+batches_per_worker = 4																	# Batches of assets per worker with batch=True, more batches report progress more often
+
+# Workers are started by a fork server instead of being forked from the app: a fork copies the locks other threads of
+# the server (job runner, imports, live feeds) hold at that moment, and the child would wait on them forever
+start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+pool_context = multiprocessing.get_context(start_method)
+
+def calculate_indicators(assets, selected_indicators, only_new_bars=False):
+	''' Indicators of a batch of assets, computed as one panel (see panel.py) or incrementally. Missing datasets fail
+	on their own instead of failing the whole batch '''
+	results = {asset: FileNotFoundError(f'{asset}: no dataset') for asset in assets if not storage.exists(asset)}
+	assets = [asset for asset in assets if asset not in results]
+	if only_new_bars:																	# Recompute only bars appended since the last run
+		results.update({asset: incremental.update(asset, selected_indicators) for asset in assets})
+	elif assets:
+		panel.calculate_indicators(assets, selected_indicators)
+		results.update({asset: 'full' for asset in assets})
+	for asset in assets:
+		resample.refresh(asset)															# Timeframe levels get the new columns too
+	return results
+
+def find_candlestick_patterns(asset, selected_candlestick_patterns, only_new_bars=False):
+	if only_new_bars:
+		result = incremental.update(asset, selected_candlestick_patterns)
+	else:
+		df = storage.read_dataset(asset, ['Open', 'High', 'Low', 'Close'])
+		storage.write_columns(asset, candlestick_patterns.find_patterns(df['Open'], df['High'], df['Low'], df['Close'], selected_candlestick_patterns))
+		result = 'full'
+	resample.refresh(asset)
+	return result
+
+def find_signals(asset, selected_signals, only_new_bars=False):
+	if only_new_bars:
+		result = incremental.update(asset, [f'{signal} Signal' for signal in selected_signals])
+	else:
+		result = planner.run(asset, [f'{signal} Signal' for signal in selected_signals])					# Missing indicators are computed too
+	resample.refresh(asset)
+	return result
+
+def split(assets, parts):
+	''' Assets dealt round-robin by history length into parts batches of similar total work '''
+	assets = sorted(assets, key=lambda asset: storage.read_schema(asset)['rows'] if storage.exists(asset) else 0, reverse=True)
+	return [batch for batch in (assets[number::parts] for number in range(parts)) if batch]
+
+def counted(function, task, **kwargs):
+	''' (result or exception, counters it added) of function(task, **kwargs) in a worker, so the app can add the bytes and
+	rows its workers read and wrote to its own counters (see metrics.py) '''
+	before = metrics.counts()
+	try:
+		result = function(task, **kwargs)
+	except Exception as error:
+		result = error
+	return result, metrics.changes(before)
+
+def run_in_processes(function, assets, workers=max_workers, batch=False, progress=None, stopped=None, **kwargs):
+	''' Calls function(asset, **kwargs) for every asset (or function(batch_of_assets, **kwargs) with batch=True, a few
+	batches per worker) in a process pool. Returns {asset: result or exception}; a failed batch fails all of its assets.
+	progress(asset, result) is called as results come in. Once stopped (a threading.Event) is set, tasks not started yet
+	are dropped and their assets get a CancelledError '''
+	workers = max(1, min(workers, len(assets)))
+	tasks = split(assets, workers * batches_per_worker) if batch else assets
+	results = {}
+
+	def collect(task, outcome):
+		for asset in task if batch else [task]:
+			results[asset] = outcome[asset] if batch and not isinstance(outcome, Exception) else outcome
+			if progress is not None:
+				progress(asset, results[asset])
+
+	if workers == 1:
+		for task in tasks:
+			if stopped is not None and stopped.is_set():
+				collect(task, CancelledError())
+				continue
+			try:
+				collect(task, function(task, **kwargs))
+			except Exception as error:
+				collect(task, error)
+	else:
+		with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context) as executor:
+			futures = {executor.submit(counted, function, task, **kwargs): task for task in tasks}
+			running = set(futures)
+			while running:
+				done, running = wait(running, timeout=0.5, return_when=FIRST_COMPLETED)
+				if stopped is not None and stopped.is_set():
+					for future in running:
+						future.cancel()
+				for future in done:
+					try:
+						outcome, deltas = future.result()
+					except Exception as error:											# Includes CancelledError of dropped tasks
+						outcome, deltas = error, {}
+					metrics.merge(deltas)
+					collect(futures[future], outcome)
+
+	summary.update([asset for asset, result in results.items() if not isinstance(result, Exception)])		# Latest-state index of the screener
+	return results
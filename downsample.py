@@ -0,0 +1,115 @@
+import numpy as np
+
+''' Level of detail for the chart. A plot is only so many pixels wide, so every trace is reduced to a points budget
+before it is sent to the browser: line traces with Largest-Triangle-Three-Buckets (LTTB), which keeps the points that
+shape the line, candlesticks by merging consecutive bars into one OHLC bar, and bar traces (volume, histograms) by
+summing or keeping the largest bar of each bin. Markers (signals, candlestick patterns) are not reduced '''
+
+chart_width = 1500																		# Plot area in pixels
+points_per_pixel = 1																	# Line points per pixel
+candle_pixels = 3																		# Pixels per candle or bar
+
+def line_budget(scale=1):
+	''' Points per line trace, scale is the ratio of all rows to the rows in view '''
+	return max(3, int(chart_width * points_per_pixel * scale))
+
+def bar_budget(scale=1):
+	''' Candles or bars per trace '''
+	return max(1, int(chart_width / candle_pixels * scale))
+
+def lttb(values, max_points):
+	''' Indices of the points LTTB keeps, one row per column of values (rows x columns array). Row positions are used as
+	x, so bars are evenly spaced like on a trading day axis. NaN points are never preferred over real ones.
+	LTTB picks the point of each bucket that makes the largest triangle with the point picked in the bucket before,
+	which is sequential; here every bucket is solved at once with a guessed previous point and only buckets whose
+	previous point changed are solved again, until nothing changes. That gives exactly the LTTB points, usually after
+	a few passes over shrinking sets of buckets '''
+	values = np.asarray(values, dtype=float)
+	if values.ndim == 1:
+		values = values[:, None]
+	rows, columns = values.shape
+	if rows <= max_points:
+		return np.tile(np.arange(rows), (columns, 1))
+
+	# Buckets between the first and the last point, padded to the widest bucket
+	edges = np.linspace(1, rows - 1, max_points - 1).astype(int)
+	buckets = max_points - 2
+	positions = edges[:-1, None] + np.arange(np.diff(edges).max())
+	positions = np.minimum(positions, edges[1:, None] - 1)
+
+	values = np.ascontiguousarray(values.T)												# columns x rows, one column per row of memory
+	finite = np.isfinite(values)
+	clean = np.where(finite, values, 0)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		mean_y = np.add.reduceat(clean[:, :edges[-1]], edges[:-1], axis=1) / np.add.reduceat(finite[:, :edges[-1]], edges[:-1], axis=1)
+	gaps = np.add.reduceat(~finite[:, :edges[-1]], edges[:-1], axis=1) > 0				# Buckets with NaN points
+	mean_x = (edges[:-1] + edges[1:] - 1) / 2
+	next_x = np.append(mean_x[1:], rows - 1)											# Average of the next bucket, the last point after the last bucket
+	next_y = np.concatenate([mean_y[:, 1:], values[:, -1:]], axis=1)
+
+	previous = np.tile(np.append(0, edges[:-2]), (columns, 1))							# Guess: first point of the bucket before
+	selected = np.full((columns, buckets), -1)
+	column, bucket = [index.ravel() for index in np.indices((columns, buckets))]
+
+	while len(column):
+		x = positions[bucket]
+		previous_x = previous[column, bucket]
+		previous_y = values[column, previous_x]
+		slope_x = previous_x - next_x[bucket]
+		slope_y = next_y[column, bucket] - previous_y
+
+		# Twice the area of the triangle (previous point, candidate, average of the next bucket). Padding repeats the
+		# last point of a bucket, so argmax never picks it over the real one
+		with np.errstate(invalid='ignore'):
+			area = clean[column[:, None], x] * slope_x[:, None]
+			area += x * slope_y[:, None]
+			area -= (slope_x * previous_y + previous_x * slope_y)[:, None]
+			np.abs(area, out=area)
+		nan = gaps[column, bucket]
+		if nan.any():
+			area[nan] = np.where(finite[column[nan, None], x[nan]], area[nan], -np.inf)
+		chosen = x[np.arange(len(x)), area.argmax(axis=1)]
+
+		changed = chosen != selected[column, bucket]
+		selected[column, bucket] = chosen
+		column, bucket = column[changed], bucket[changed] + 1
+		column, bucket = column[bucket < buckets], bucket[bucket < buckets]
+		previous[column, bucket] = selected[column, bucket - 1]
+
+	return np.concatenate([np.zeros((columns, 1), dtype=int), selected, np.full((columns, 1), rows - 1)], axis=1)
+
+def lines(x, columns, max_points):
+	''' {name: (x, y)} of the columns (name: values of the same length as x) reduced to max_points each '''
+	x = np.asarray(x)
+	names = list(columns)
+	if not names:
+		return {}
+	values = np.column_stack([np.asarray(columns[name], dtype=float) for name in names])
+	selected = lttb(values, max_points)
+	return {name: (x[selected[number]], values[selected[number], number]) for number, name in enumerate(names)}
+
+def bins(rows, max_bins):
+	''' Start rows of consecutive bins of equal size, the first one shorter so that the last bin ends on the last bar '''
+	size = -(-rows // max_bins) if rows else 1
+	return np.arange((rows - 1) % size + 1 - size, rows, size).clip(0) if rows else np.zeros(0, dtype=int)
+
+def ohlc(x, open_price, high_price, low_price, close_price, max_bins):
+	''' (x, open, high, low, close) with consecutive bars merged into at most max_bins bars, each dated by its first bar '''
+	x, open_price, high_price, low_price, close_price = [np.asarray(values) for values in (x, open_price, high_price, low_price, close_price)]
+	if len(x) <= max_bins:
+		return x, open_price, high_price, low_price, close_price
+	starts = bins(len(x), max_bins)
+	ends = np.append(starts[1:], len(x)) - 1
+	return (x[starts], open_price[starts], np.fmax.reduceat(high_price, starts), np.fmin.reduceat(low_price, starts), close_price[ends])
+
+def bars(x, y, max_bins, how='sum'):
+	''' (x, y) of a bar trace with consecutive bars merged into at most max_bins bars: summed (volume) or the bar
+	furthest from zero (histograms) '''
+	x, y = np.asarray(x), np.asarray(y, dtype=float)
+	if len(x) <= max_bins:
+		return x, y
+	starts = bins(len(x), max_bins)
+	if how == 'sum':
+		return x[starts], np.add.reduceat(np.nan_to_num(y), starts)
+	highest, lowest = np.fmax.reduceat(y, starts), np.fmin.reduceat(y, starts)
+	return x[starts], np.where(np.abs(lowest) > np.abs(highest), lowest, highest)
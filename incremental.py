@@ -0,0 +1,423 @@
+import math
+import re
+from collections import deque
+
+import numpy as np
+
+import indicators
+import signals
+import candlestick_patterns
+import indicator_cache
+import planner
+import storage
+
+''' Incremental (tail-only) recomputation of indicators, signals and candlestick patterns for bars added with
+storage.append_rows. Rolling means, rolling variances and exponential means are continued by kernels carrying the same
+running state as the pandas implementations (Kahan sums, Welford variance, ewm weights), so new values are bit-identical
+to a full recompute. Rolling extremes, patterns and signals only depend on a short warm-up window and are recomputed over
+it. CCI is normalised by a mean over the whole history, so every new bar changes all of its values and it is recomputed in full '''
+
+NaN = float('nan')
+
+class Kernel:
+	''' Base of the stateful kernels: one update() per bar, state saved to / restored from plain JSON data.
+	Also used by streaming.py for live values of the forming bar '''
+
+	def get_state(self):
+		state = dict(vars(self))
+		if 'values' in state:
+			state['values'] = list(self.values)
+		return state
+
+	def preview(self, value):
+		''' Output if value were the next bar, leaving the state unchanged. O(1): only the window ends are touched '''
+		state = dict(vars(self))
+		values = state.get('values')
+		oldest = values[0] if values is not None and len(values) >= self.window else None
+		result = self.update(value)
+		self.__dict__.update(state)
+		if values is not None:
+			values.pop()
+			if oldest is not None:
+				values.appendleft(oldest)
+		return result
+
+	@classmethod
+	def from_state(cls, state):
+		kernel = cls.__new__(cls)
+		kernel.__dict__.update(state)
+		if 'values' in state:
+			kernel.values = deque(state['values'])
+		return kernel
+
+class RollingMean(Kernel):
+	''' Series.rolling(window).mean() one bar at a time (pandas roll_mean) '''
+
+	def __init__(self, window):
+		self.window = window
+		self.values = deque()
+		self.nobs = self.neg_ct = self.same_count = 0
+		self.sum_x = self.compensation_add = self.compensation_remove = 0.0
+		self.prev_value = None
+
+	def update(self, value):
+		if self.prev_value is None:
+			self.prev_value = value
+		self.values.append(value)
+		if len(self.values) > self.window:
+			self.remove(self.values.popleft())
+		self.add(value)
+
+		if self.nobs >= self.window and self.nobs > 0:
+			result = self.sum_x / self.nobs
+			if self.same_count >= self.nobs:
+				result = self.prev_value
+			elif self.neg_ct == 0 and result < 0:
+				result = 0.0
+			elif self.neg_ct == self.nobs and result > 0:
+				result = 0.0
+			return result
+		return NaN
+
+	def add(self, value):
+		if value == value:
+			self.nobs += 1
+			y = value - self.compensation_add
+			t = self.sum_x + y
+			self.compensation_add = t - self.sum_x - y
+			self.sum_x = t
+			if math.copysign(1.0, value) < 0:
+				self.neg_ct += 1
+			self.same_count = self.same_count + 1 if value == self.prev_value else 1
+			self.prev_value = value
+
+	def remove(self, value):
+		if value == value:
+			self.nobs -= 1
+			y = - value - self.compensation_remove
+			t = self.sum_x + y
+			self.compensation_remove = t - self.sum_x - y
+			self.sum_x = t
+			if math.copysign(1.0, value) < 0:
+				self.neg_ct -= 1
+
+class RollingVariance(Kernel):
+	''' Series.rolling(window).var() one bar at a time (pandas roll_var, Welford's method with Kahan summation) '''
+
+	def __init__(self, window, ddof=1):
+		self.window = window
+		self.ddof = ddof
+		self.values = deque()
+		self.nobs = self.mean_x = self.ssqdm_x = self.compensation_add = self.compensation_remove = 0.0
+		self.same_count = 0
+		self.prev_value = None
+
+	def update(self, value):
+		if self.prev_value is None:
+			self.prev_value = value
+		self.values.append(value)
+		if len(self.values) > self.window:
+			self.remove(self.values.popleft())
+		self.add(value)
+
+		if self.nobs >= max(self.window, 1) and self.nobs > self.ddof:
+			if self.nobs == 1 or self.same_count >= self.nobs:
+				return 0.0
+			return self.ssqdm_x / (self.nobs - self.ddof)
+		return NaN
+
+	def add(self, value):
+		if value != value:
+			return
+		self.nobs += 1
+		self.same_count = self.same_count + 1 if value == self.prev_value else 1
+		self.prev_value = value
+
+		prev_mean = self.mean_x - self.compensation_add
+		y = value - self.compensation_add
+		t = y - self.mean_x
+		self.compensation_add = t + self.mean_x - y
+		if self.nobs:
+			self.mean_x = self.mean_x + t / self.nobs
+		else:
+			self.mean_x = 0.0
+		self.ssqdm_x = self.ssqdm_x + (value - prev_mean) * (value - self.mean_x)
+
+	def remove(self, value):
+		if value == value:
+			self.nobs -= 1
+			if self.nobs:
+				prev_mean = self.mean_x - self.compensation_remove
+				y = value - self.compensation_remove
+				t = y - self.mean_x
+				self.compensation_remove = t + self.mean_x - y
+				self.mean_x = self.mean_x - t / self.nobs
+				self.ssqdm_x = self.ssqdm_x - (value - prev_mean) * (value - self.mean_x)
+			else:
+				self.mean_x = 0.0
+				self.ssqdm_x = 0.0
+
+class ExponentialMean(Kernel):
+	''' Series.ewm(...).mean() one bar at a time (pandas ewm). Use span_com() / alpha_com() to get com like pandas does '''
+
+	def __init__(self, com, adjust=True, min_periods=0):
+		self.alpha = 1. / (1. + com)
+		self.old_wt_factor = 1. - self.alpha
+		self.new_wt = 1. if adjust else self.alpha
+		self.adjust = adjust
+		self.min_periods = max(int(min_periods), 1)
+		self.weighted = None
+		self.old_wt = 1.
+		self.nobs = 0
+
+	def update(self, value):
+		is_observation = value == value
+		if self.weighted is None:
+			self.weighted = value
+			self.nobs = int(is_observation)
+		else:
+			self.nobs += is_observation
+			if self.weighted == self.weighted:
+				self.old_wt *= self.old_wt_factor
+				if is_observation:
+					if self.weighted != value:
+						self.weighted = self.old_wt * self.weighted + self.new_wt * value
+						self.weighted /= (self.old_wt + self.new_wt)
+					if self.adjust:
+						self.old_wt += self.new_wt
+					else:
+						self.old_wt = 1.
+			elif is_observation:
+				self.weighted = value
+
+		return self.weighted if self.nobs >= self.min_periods else NaN
+
+kernel_types = {'RollingMean': RollingMean, 'RollingVariance': RollingVariance, 'ExponentialMean': ExponentialMean}
+
+def span_com(span):
+	return (span - 1) / 2
+
+def alpha_com(alpha):
+	return (1 - alpha) / alpha
+
+def feed(kernel, values):
+	return np.array([kernel.update(value) for value in np.asarray(values, dtype=float).tolist()])
+
+def zsqrt(values):
+	with np.errstate(invalid='ignore'):
+		result = np.sqrt(values)
+	result[values < 0] = 0
+	return result
+
+''' Specs of everything that can be recomputed incrementally. columns - columns written, inputs - columns read,
+context - warm-up bars needed before the first new bar (None: whole history), kernels - factory of the running state,
+run(kernels, df, skip) - values of the columns for rows of df after the first skip ones '''
+
+def sma_spec(period):
+	def run(kernels, df, skip):
+		return {f'SMA {period}': feed(kernels[0], df['Close'].values[skip:])}
+	return {'columns': [f'SMA {period}'], 'inputs': ['Close'], 'context': 0,
+		'kernels': lambda: [RollingMean(period)], 'run': run}
+
+def ema_spec(period):
+	def run(kernels, df, skip):
+		return {f'EMA {period}': feed(kernels[0], df['Close'].values[skip:])}
+	return {'columns': [f'EMA {period}'], 'inputs': ['Close'], 'context': 0,
+		'kernels': lambda: [ExponentialMean(span_com(period), adjust=False, min_periods=period)], 'run': run}
+
+def bollinger_spec(period, multiplier):
+	def run(kernels, df, skip):
+		typical_price = indicators.typical_price(df['High'], df['Low'], df['Close']).values[skip:]
+		standard_deviation = zsqrt(feed(kernels[0], typical_price))
+		sma = feed(kernels[1], df['Close'].values[skip:])
+		upper_band, lower_band = indicators.bollinger_bands(sma, standard_deviation, multiplier)
+		return {'Upper band': upper_band, 'Lower band': lower_band}
+	return {'columns': ['Upper band', 'Lower band'], 'inputs': ['High', 'Low', 'Close'], 'context': 0,
+		'kernels': lambda: [RollingVariance(period), RollingMean(period)], 'run': run}
+
+def rsi_spec(period):
+	def run(kernels, df, skip):
+		close_price = df['Close']
+		upward_change = np.select([close_price > close_price.shift(1)], [close_price - close_price.shift(1)])[skip:]
+		downward_change = np.select([close_price < close_price.shift(1)], [close_price.shift(1) - close_price])[skip:]
+		with np.errstate(divide='ignore', invalid='ignore'):
+			relative_strength = feed(kernels[0], upward_change) / feed(kernels[1], downward_change)
+			return {'RSI': 100 - (100 / (1 + relative_strength))}
+	return {'columns': ['RSI'], 'inputs': ['Close'], 'context': 1,
+		'kernels': lambda: [ExponentialMean(alpha_com(1 / period)), ExponentialMean(alpha_com(1 / period))], 'run': run}
+
+def macd_spec(slow_ma_period, fast_ma_period, macd_ma_period):
+	def run(kernels, df, skip):
+		close_price = df['Close'].values[skip:]
+		macd = feed(kernels[1], close_price) - feed(kernels[0], close_price)
+		macd_signal_line = feed(kernels[2], macd)
+		return {'MACD': macd, 'MACD Signal Line': macd_signal_line, 'MACD Histogram': macd - macd_signal_line}
+	return {'columns': ['MACD', 'MACD Signal Line', 'MACD Histogram'], 'inputs': ['Close'], 'context': 0,
+		'kernels': lambda: [ExponentialMean(alpha_com(2 / slow_ma_period)), ExponentialMean(alpha_com(2 / fast_ma_period)),
+			ExponentialMean(alpha_com(2 / macd_ma_period))], 'run': run}
+
+def stochastic_spec(k_period, d_period):
+	def run(kernels, df, skip):
+		stochastic_k = indicators.stochastic(df['High'], df['Low'], df['Close'], k_period, d_period)[0].values[skip:]
+		return {'Stochastic %K': stochastic_k, 'Stochastic %D': feed(kernels[0], stochastic_k)}
+	return {'columns': ['Stochastic %K', 'Stochastic %D'], 'inputs': ['High', 'Low', 'Close'], 'context': k_period - 1,
+		'kernels': lambda: [RollingMean(d_period)], 'run': run}
+
+def window_spec(columns, inputs, context, function):
+	''' Indicators depending only on the last context + 1 bars, recomputed over that window with indicators.py '''
+	def run(kernels, df, skip):
+		result = function(*[df[column] for column in inputs])
+		result = result if type(result) == tuple else (result,)
+		return {column: np.asarray(values)[skip:] for column, values in zip(columns, result)}
+	return {'columns': columns, 'inputs': inputs, 'context': context, 'kernels': None, 'run': run}
+
+def signal_spec(column, inputs, function):
+	def run(kernels, df, skip):
+		return {column: function(*[df[column] for column in inputs])[skip:]}
+	return {'columns': [column], 'inputs': inputs, 'context': 1, 'kernels': None, 'run': run}
+
+def pattern_spec(pattern):
+	def run(kernels, df, skip):
+		return {pattern: candlestick_patterns.find_pattern(df['Open'], df['High'], df['Low'], df['Close'], pattern)[skip:]}
+	return {'columns': [pattern], 'inputs': ['Open', 'High', 'Low', 'Close'], 'context': 2, 'kernels': None, 'run': run}
+
+def find_specs(columns):
+	''' Specs of everything present in the dataset, in dependency order: indicators, patterns, signals. Indicators have
+	the default parameters of indicators.py, like the stored columns they write '''
+	specs = {}
+
+	for column in columns:
+		match = re.fullmatch(r'(SMA|EMA) (\d+)', column)
+		if match:
+			spec = sma_spec if match.group(1) == 'SMA' else ema_spec
+			specs[column] = spec(int(match.group(2)))
+
+	williams_period, = planner.defaults('Williams %R')
+	aroon_period, = planner.defaults('Aroon')
+	candidates = {
+		'Bollinger': bollinger_spec(*planner.defaults('Bollinger')),
+		'RSI': rsi_spec(*planner.defaults('RSI')),
+		'MACD': macd_spec(*planner.defaults('MACD')),
+		'Stochastic': stochastic_spec(*planner.defaults('Stochastic')),
+		'Williams %R': window_spec(['Williams %R'], ['High', 'Low', 'Close'], williams_period - 1, indicators.williams_r),
+		'CCI': window_spec(['CCI'], ['High', 'Low', 'Close'], None, indicators.commodity_channel_index),
+		'Aroon': window_spec(['Aroon Up', 'Aroon Down'], ['High', 'Low'], aroon_period, indicators.aroon),
+	}
+	for pattern in candlestick_patterns.all_patterns:
+		candidates[pattern] = pattern_spec(pattern)
+	for column in columns:
+		match = re.fullmatch(r'Crossover SMA (\d+)/(\d+) Signal', column)
+		if match:
+			candidates[column] = signal_spec(column, [f'SMA {match.group(1)}', f'SMA {match.group(2)}'], signals.moving_average_crossover)
+	candidates['RSI Signal'] = signal_spec('RSI Signal', ['Close', 'RSI'], signals.relative_strength_index)
+	candidates['MACD Signal'] = signal_spec('MACD Signal', ['MACD Histogram'], signals.moving_average_convergence_divergence)
+	candidates['Bollinger Signal'] = signal_spec('Bollinger Signal', ['Close', 'Upper band', 'Lower band'], signals.bollinger)
+	candidates['Stochastic Signal'] = signal_spec('Stochastic Signal', ['Stochastic %D'], signals.stochastic)
+	candidates['Williams %R Signal'] = signal_spec('Williams %R Signal', ['Williams %R'], signals.williams_r)
+	candidates['CCI Signal'] = signal_spec('CCI Signal', ['CCI'], signals.commodity_channel_index)
+	candidates['Aroon Signal'] = signal_spec('Aroon Signal', ['Aroon Up', 'Aroon Down'], signals.aroon)
+
+	for name, spec in candidates.items():
+		if all(column in columns for column in spec['columns']):
+			specs[name] = spec
+
+	return specs
+
+def update(asset, names=None):
+	''' Recomputes the pending rows (see storage.append_rows) of every indicator, pattern and signal of the asset, or
+	only of the given spec names. Returns {name: 'incremental' | 'full' | 'skipped'} '''
+	schema = storage.read_schema(asset)
+	pending = dict(schema.get('pending', {}))
+	rows = schema['rows']
+	state = storage.read_state(asset)
+	rewritten = {}
+	report = {}
+	specs = find_specs(schema['columns'])
+
+	for name, spec in specs.items():
+		if names is not None and name not in names:
+			continue
+		starts = [pending[column] for column in spec['columns'] if column in pending]
+		starts += [rewritten[column] for column in spec['inputs'] if column in rewritten]			# e.g. signals of CCI
+		if not starts:
+			continue
+		if any(column in pending for column in spec['inputs']):							# Inputs have not been computed yet
+			report[name] = 'skipped'
+			continue
+		start = min(starts)
+
+		saved = state.get(name)
+		replay = spec['kernels'] is not None and (saved is None or saved['rows'] != start)
+		if spec['kernels'] is None:
+			kernels = None
+		elif replay:
+			kernels = spec['kernels']()
+		else:
+			kernels = [kernel_types[kernel['type']].from_state(kernel['state']) for kernel in saved['kernels']]
+
+		if replay or spec['context'] is None:
+			first = 0
+		else:
+			first = max(0, start - spec['context'])
+		skip = 0 if replay or spec['context'] is None else start - first
+		df = storage.read_dataset(asset, spec['inputs'] + (spec['columns'] if replay else []), start=first)
+		results = spec['run'](kernels, df, skip)
+
+		if spec['context'] is None:
+			storage.write_tail(asset, results, 0)
+			report[name] = 'full'
+		elif replay and not all(np.array_equal(results[column][:start], df[column].values[:start], equal_nan=True) for column in spec['columns']):
+			# The stored values were computed differently (other parameters or pandas version), the replay covers the whole history
+			storage.write_tail(asset, results, 0)
+			report[name] = 'full'
+		else:
+			storage.write_tail(asset, {column: values[start - first - skip:] for column, values in results.items()}, start)
+			report[name] = 'incremental'
+
+		if kernels is not None:
+			state[name] = {'rows': rows, 'kernels': [{'type': type(kernel).__name__, 'state': kernel.get_state()} for kernel in kernels]}
+		for column in spec['columns']:
+			pending.pop(column, None)
+			rewritten[column] = 0 if report[name] == 'full' else start
+
+	# Pending columns no spec matches are recomputed in full: indicators with custom parameters ('Upper band(30, 2.5)')
+	# through indicator_cache, signals and patterns with the planner. Columns nothing computes (e.g. stored with the
+	# import) are left padded and no longer pending
+	specified = {column for spec in specs.values() for column in spec['columns']}
+	wanted = None if names is None else indicator_cache.parse_indicators(';'.join(names))
+	planned = []
+	padded = []
+	written = set()
+	for column in [column for column in pending if column not in specified]:
+		if column in written:															# With another output of its indicator
+			continue
+		try:
+			parsed = indicator_cache.parse_column(column)
+		except ValueError:
+			parsed = None
+		if parsed is not None:
+			if wanted is None or parsed in wanted:
+				results = indicator_cache.compute(asset, *parsed)
+				storage.write_tail(asset, {output: values for output, values in results.items() if output in schema['columns']}, 0)
+				report.update({output: 'full' for output in results})
+				written.update(results)
+			continue
+		try:
+			planner.find_node(column)
+		except KeyError:
+			padded.append(column)
+			continue
+		if names is None or column in names:
+			planned.append(column)
+	if planned:
+		planner.run(asset, planned)
+		report.update({column: 'full' for column in planned})
+	if padded:
+		schema = storage.read_schema(asset)
+		for column in padded:
+			schema['pending'].pop(column, None)
+			report.setdefault(column, 'padded')											# Spec names and columns may clash
+		storage.write_schema(asset, schema)
+
+	storage.write_state(asset, state)
+	return report
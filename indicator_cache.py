@@ -0,0 +1,160 @@
+import hashlib
+import math
+import os
+import re
+import threading
+
+import numpy as np
+
+import indicators
+import storage
+
+''' Indicators with arbitrary parameters, memoized on disk. An indicator is written as in the app, e.g. 'SMA 37',
+'Bollinger(30, 2.5)', 'RSI(21)' or 'MACD(26, 12, 9)'; parameters left out take the defaults of indicators.py.
+Results are kept in datasets/.cache/ as one .npz file per asset, price data version (storage.price_version),
+indicator and parameters, so a repeat view is a file read and new bars or a re-import simply miss the cache.
+The least recently used files are evicted above cache_max_bytes '''
+
+cache_path = os.path.join(storage.path, '.cache')
+cache_max_bytes = 1024 * 1024 * 1024
+cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+cache_lock = threading.Lock()
+
+# name: (function, input columns, output columns, default parameters)
+indicator_functions = {
+	'SMA': (indicators.simple_moving_average, ['Close'], ['SMA'], (20,)),
+	'EMA': (indicators.exponential_moving_average, ['Close'], ['EMA'], (20,)),
+	'Bollinger': (indicators.bollinger, ['High', 'Low', 'Close'], ['Upper band', 'Lower band'], (20, 2)),
+	'RSI': (indicators.relative_strength_index, ['Close'], ['RSI'], (14,)),
+	'MACD': (indicators.moving_average_convergence_divergence, ['Close'], ['MACD', 'MACD Signal Line', 'MACD Histogram'], (26, 12, 9)),
+	'Stochastic': (indicators.stochastic, ['High', 'Low', 'Close'], ['Stochastic %K', 'Stochastic %D'], (10, 3)),
+	'Williams %R': (indicators.williams_r, ['High', 'Low', 'Close'], ['Williams %R'], (14,)),
+	'CCI': (indicators.commodity_channel_index, ['High', 'Low', 'Close'], ['CCI'], (20, 0.015)),
+	'Aroon': (indicators.aroon, ['High', 'Low'], ['Aroon Up', 'Aroon Down'], (25,)),
+}
+
+# name: kind of each parameter, a window (int of at least that many bars) or None for a positive float (multiplier, constant)
+parameter_kinds = {
+	'SMA': (1,), 'EMA': (1,), 'Bollinger': (1, None), 'RSI': (1,), 'MACD': (2, 2, 2),				# MACD weights the bars with 2 / window
+	'Stochastic': (1, 1), 'Williams %R': (1,), 'CCI': (1, None), 'Aroon': (1,),
+}
+
+overlay_indicators = ['SMA', 'EMA', 'Bollinger']										# Drawn over prices, the others below
+
+def number(text):
+	value = float(text)
+	return int(value) if value.is_integer() and '.' not in text else value
+
+def parse_indicator(text):
+	''' 'Bollinger(30, 2.5)' -> ('Bollinger', (30, 2.5)), 'SMA 37' -> ('SMA', (37,)), 'RSI' -> ('RSI', (14,)) '''
+	text = text.strip()
+	match = re.fullmatch(r'(SMA|EMA) (\d+)', text) or re.fullmatch(r'(.+?)\s*\((.*)\)', text) or re.fullmatch(r'(.+)()', text)
+	name = match.group(1).strip()
+	if name not in indicator_functions:
+		raise ValueError(f'Unknown indicator {name}')
+	defaults = indicator_functions[name][3]
+	try:
+		parameters = tuple(number(parameter) for parameter in match.group(2).replace(',', ' ').split())
+	except ValueError:
+		raise ValueError(f'{name}: parameters {match.group(2)} are not numbers')
+	if len(parameters) > len(defaults):
+		raise ValueError(f'{name} takes at most {len(defaults)} parameters')
+	for parameter, kind in zip(parameters, parameter_kinds[name]):
+		if kind is None and not (math.isfinite(parameter) and parameter > 0):
+			raise ValueError(f'{name}: {parameter} is not a positive number')
+		if kind is not None and not (isinstance(parameter, int) and parameter >= kind):
+			raise ValueError(f'{name}: window {parameter} is not a whole number of at least {kind} bars')
+	return name, parameters + defaults[len(parameters):]
+
+def parse_indicators(text, errors=None):
+	''' Indicators separated by semicolons or new lines. Entries that do not parse are skipped and their messages
+	appended to errors, if given '''
+	parsed = []
+	for item in re.split(r'[;\n]', text or ''):
+		if not item.strip():
+			continue
+		try:
+			parsed.append(parse_indicator(item))
+		except ValueError as error:
+			if errors is not None:
+				errors.append(str(error))
+	return parsed
+
+def column_names(name, parameters):
+	''' Output columns, named like the stored ones: 'SMA 37', 'Upper band(30, 2.5)', 'RSI' for default parameters '''
+	outputs = indicator_functions[name][2]
+	if name in ['SMA', 'EMA']:
+		return [f'{name} {parameters[0]}']
+	if parameters == indicator_functions[name][3]:
+		return outputs
+	return [f'{output}({", ".join(str(parameter) for parameter in parameters)})' for output in outputs]
+
+def parse_column(column):
+	''' Indicator and parameters of a column named by column_names: 'Upper band(30, 2.5)' -> ('Bollinger', (30, 2.5)),
+	'SMA 37' -> ('SMA', (37,)), 'RSI' -> ('RSI', (14,)); ValueError for columns no indicator writes '''
+	match = re.fullmatch(r'(SMA|EMA) (\d+)', column) or re.fullmatch(r'(.+?)\((.*)\)', column) or re.fullmatch(r'(.+)()', column)
+	for name, (function, inputs, outputs, defaults) in indicator_functions.items():
+		if match.group(1) in outputs:
+			parsed = parse_indicator(f'{name}({match.group(2)})')
+			if column in column_names(*parsed):
+				return parsed
+	raise ValueError(f'No indicator writes {column}')
+
+def cache_file(asset, name, parameters):
+	key = f'{asset}|{storage.price_version(asset)}|{name}|{parameters}'
+	return os.path.join(cache_path, hashlib.sha1(key.encode()).hexdigest() + '.npz')
+
+def compute(asset, name, parameters, df=None):
+	''' {column: array} of the indicator for the asset, computed once per price data version. df (with the input
+	columns) can be passed when the caller already has the data loaded '''
+	function, inputs, outputs, defaults = indicator_functions[name]
+	file = cache_file(asset, name, parameters)
+	columns = column_names(name, parameters)
+
+	if os.path.exists(file):
+		try:
+			with np.load(file) as data:
+				results = {column: data[str(position)] for position, column in enumerate(columns)}
+			os.utime(file)																# Last use, for eviction
+			with cache_lock:
+				cache_stats['hits'] += 1
+			return results
+		except (OSError, KeyError, ValueError):											# Evicted or half written by another process
+			pass
+
+	if df is None:
+		df = storage.read_dataset(asset, inputs)
+	values = function(*[df[column] for column in inputs], *parameters)
+	values = values if type(values) == tuple else (values,)
+	results = {column: np.asarray(result, dtype=float) for column, result in zip(columns, values)}
+
+	os.makedirs(cache_path, exist_ok=True)
+	temporary = f'{file}.{os.getpid()}.{threading.get_ident()}.tmp'
+	with open(temporary, 'wb') as f:
+		np.savez(f, **{str(position): results[column] for position, column in enumerate(columns)})
+	os.replace(temporary, file)
+	with cache_lock:
+		cache_stats['misses'] += 1
+	evict()
+	return results
+
+def evict(max_bytes=None):
+	''' Removes least recently used results until the cache fits in max_bytes (cache_max_bytes by default) '''
+	max_bytes = cache_max_bytes if max_bytes is None else max_bytes
+	entries = [entry for entry in os.scandir(cache_path) if entry.name.endswith('.npz')]
+	total = sum(entry.stat().st_size for entry in entries)
+	for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime_ns):
+		if total <= max_bytes:
+			break
+		total -= entry.stat().st_size
+		try:
+			os.remove(entry.path)
+		except FileNotFoundError:
+			continue
+		with cache_lock:
+			cache_stats['evictions'] += 1
+
+def cache_info():
+	entries = [entry for entry in os.scandir(cache_path) if entry.name.endswith('.npz')] if os.path.exists(cache_path) else []
+	with cache_lock:
+		return dict(cache_stats, entries=len(entries), bytes=sum(entry.stat().st_size for entry in entries))
@@ -1,7 +1,8 @@
 import pandas as pd
 import numpy as np
 
-''' Every function in this package accepts pandas Series as input or inputs, parameters and returns pandas Series as output/outputs '''
+''' Every function in this package accepts pandas Series as input or inputs, parameters and returns pandas Series as output/outputs.
+DataFrames with one column per asset (a panel, see panel.py) are accepted too and give DataFrames '''
 
 def simple_moving_average(close_price, period):
 	return close_price.rolling(period).mean()
@@ -9,12 +10,17 @@ def simple_moving_average(close_price, period):
 def exponential_moving_average(close_price, period):
 	return close_price.ewm(span=period, min_periods=period, adjust=False).mean()
 
-def bollinger(high_price, low_price, close_price):
-	typical_price = (high_price + low_price + close_price) / 3
-	standard_deviation = typical_price.rolling(20).std()
-	sma = simple_moving_average(close_price, 20)
-	upper_band = sma + 2 * standard_deviation
-	lower_band = sma - 2 * standard_deviation
+def typical_price(high_price, low_price, close_price):
+	return (high_price + low_price + close_price) / 3
+
+def bollinger(high_price, low_price, close_price, period=20, multiplier=2):
+	standard_deviation = typical_price(high_price, low_price, close_price).rolling(period).std()
+	sma = simple_moving_average(close_price, period)
+	return bollinger_bands(sma, standard_deviation, multiplier)
+
+def bollinger_bands(sma, standard_deviation, multiplier=2):
+	upper_band = sma + multiplier * standard_deviation
+	lower_band = sma - multiplier * standard_deviation
 
 	return upper_band, lower_band
 
@@ -34,8 +40,9 @@ def relative_strength_index(close_price, period=14):
 #	df.loc[df['Close'] < df['Close'].shift(1), 'Downward change'] = close_price.shift(1) - close_price
 #	df.loc[df['Close'] >= df['Close'].shift(1), 'Downward change'] = 0
 
-	upward_SMMA = pd.Series(upward_change).ewm(alpha=1/period).mean()
-	downward_SMMA = pd.Series(downward_change).ewm(alpha=1/period).mean()
+	started = close_price.ffill().notna()											# Rows before the first bar (panel padding) are not observations
+	upward_SMMA = like(close_price, upward_change).where(started).ewm(alpha=1/period).mean()
+	downward_SMMA = like(close_price, downward_change).where(started).ewm(alpha=1/period).mean()
 	relative_strength = upward_SMMA / downward_SMMA	
 	rsi = 100 - (100 / (1+ relative_strength))
 
@@ -60,23 +67,105 @@ def moving_average_convergence_divergence(close_price, slow_ma_period=26, fast_m
 
 	return macd, macd_signal_line, macd_histogram
 
-def stochastic(high_price, low_price, close_price):
-	stochastic_k = ((close_price - low_price.rolling(10).min()) / (high_price.rolling(10).max() - low_price.rolling(10).min())) * 100
-	stochastic_d = stochastic_k.rolling(3).mean()
+def rolling_extremum(values, window, find_max=True, positions=True):
+	''' Sliding window maximum (or minimum) and its position in O(n) for any window (van Herk / Gil-Werman blocks).
+	Position 0 is the oldest bar of the window, window - 1 the newest; ties resolve to the oldest bar, like argmax.
+	Windows that are incomplete or contain NaN give NaN, like rolling(window).max(). Positions are None unless requested.
+	2-D values (bars x assets) are processed column-wise in the same pass '''
+	x = np.asarray(values, dtype=float)
+	shape = x.shape
+	x = x.reshape(len(x), -1)
+	x = x if find_max else -x
+	n, m = x.shape
+	if n < window:
+		return np.full(shape, np.nan), np.full(shape, np.nan) if positions else None
+
+	missing = np.isnan(x)
+	blocks = -(-n // window)
+	padded = np.full((blocks * window, m), -np.inf)
+	padded[:n] = np.where(missing, -np.inf, x)
+	padded = padded.reshape(blocks, window, m)
+
+	# Window [i - window + 1, i] = suffix of one block + prefix of the next (or exactly one block)
+	prefix = np.maximum.accumulate(padded, axis=1)
+	suffix = np.maximum.accumulate(padded[:, ::-1], axis=1)[:, ::-1]
+	end = np.arange(window - 1, n)
+	start = end - window + 1
+	left = suffix.reshape(-1, m)[start]
+	right = prefix.reshape(-1, m)[end]
+	use_left = left >= right
+
+	counts = np.concatenate([np.zeros((1, m), dtype=int), np.cumsum(missing, axis=0)])
+	incomplete = counts[end + 1] - counts[start] > 0
+	extremum = np.full((n, m), np.nan)
+	extremum[window - 1:] = np.where(incomplete, np.nan, np.where(use_left, left, right))
+	extremum = extremum if find_max else -extremum
+	if not positions:
+		return extremum.reshape(shape), None
+
+	# First occurrence of the running maximum: last strict record from the block start, first equal value to the block end
+	index = np.broadcast_to(np.arange(blocks * window).reshape(blocks, window, 1), padded.shape)
+	record = np.ones(padded.shape, dtype=bool)
+	record[:, 1:] = padded[:, 1:] > prefix[:, :-1]
+	prefix_index = np.maximum.accumulate(np.where(record, index, -1), axis=1)
+	suffix_index = np.minimum.accumulate(np.where(padded == suffix, index, blocks * window)[:, ::-1], axis=1)[:, ::-1]
+
+	position = np.full((n, m), np.nan)
+	first = np.where(use_left, suffix_index.reshape(-1, m)[start], prefix_index.reshape(-1, m)[end]) - start[:, None]
+	position[window - 1:] = np.where(incomplete, np.nan, first)
+
+	return extremum.reshape(shape), position.reshape(shape)
+
+def like(price, values):
+	''' values as a Series or DataFrame with the index (and columns) of price '''
+	if isinstance(price, pd.DataFrame):
+		return pd.DataFrame(values, index=price.index, columns=price.columns)
+	return pd.Series(values, index=price.index)
+
+def rolling_max(price, period):
+	return like(price, rolling_extremum(price, period, positions=False)[0])
+
+def rolling_min(price, period):
+	return like(price, rolling_extremum(price, period, find_max=False, positions=False)[0])
+
+def rolling_argmax(price, period):
+	return like(price, rolling_extremum(price, period)[1])
+
+def rolling_argmin(price, period):
+	return like(price, rolling_extremum(price, period, find_max=False)[1])
+
+''' The indicators below are also split into their final step, taking the rolling extremes, positions or means they
+are built from, so planner.py can share those between indicators and still compute every value with this module '''
+
+def stochastic(high_price, low_price, close_price, k_period=10, d_period=3):
+	return stochastic_from_extremes(close_price, rolling_max(high_price, k_period), rolling_min(low_price, k_period), d_period)
+
+def stochastic_from_extremes(close_price, highest_high, lowest_low, d_period=3):
+	stochastic_k = ((close_price - lowest_low) / (highest_high - lowest_low)) * 100
+	stochastic_d = stochastic_k.rolling(d_period).mean()
 
 	return stochastic_k, stochastic_d
 
 def williams_r(high_price, low_price, close_price, period=14):
-	williams = (high_price.rolling(14).max() - close_price) / (high_price.rolling(14).max() - low_price.rolling(14).min()) * -100
+	return williams_r_from_extremes(close_price, rolling_max(high_price, period), rolling_min(low_price, period))
+
+def williams_r_from_extremes(close_price, highest_high, lowest_low):
+	williams = (highest_high - close_price) / (highest_high - lowest_low) * -100
 	return williams
 
-def commodity_channel_index(high_price, low_price, close_price):
-	typical_price = (high_price + low_price + close_price) / 3
-	cci = ( typical_price - typical_price.rolling(20).mean() ) / ( abs(typical_price - typical_price.rolling(20).mean()).mean() * 0.015 )
-	return cci	
+def commodity_channel_index(high_price, low_price, close_price, period=20, constant=0.015):
+	price = typical_price(high_price, low_price, close_price)
+	return commodity_channel_index_from_mean(price, simple_moving_average(price, period), constant)
+
+def commodity_channel_index_from_mean(typical_price, typical_price_sma, constant=0.015):
+	cci = ( typical_price - typical_price_sma ) / ( abs(typical_price - typical_price_sma).mean() * constant )
+	return cci
+
+def aroon(high_price, low_price, period=25):
+	return aroon_from_positions(rolling_argmax(high_price, period + 1), rolling_argmin(low_price, period + 1), period)
 
-def aroon(high_price, low_price):
-	aroon_up = 100 * high_price.rolling(25 + 1).apply(lambda x: x.argmax()) / 25
-	aroon_down = 100 * low_price.rolling(25 + 1).apply(lambda x: x.argmin()) / 25
+def aroon_from_positions(high_position, low_position, period=25):
+	aroon_up = 100 * high_position / period
+	aroon_down = 100 * low_position / period
 
 	return aroon_up, aroon_down
\ No newline at end of file
@@ -0,0 +1,114 @@
+import itertools
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError
+
+import compute
+
+''' Local queue of background jobs for the compute steps of the app. A job runs a compute function over assets in
+worker processes (see compute.run_in_processes) from a single runner thread, so the callback that submits it returns at
+once and chart callbacks keep their Dash workers. Jobs run one at a time in submission order, report per-asset progress,
+can be cancelled (assets not started yet are skipped) and a job identical to one pending or running is not queued twice '''
+
+finished_max = 10																		# Finished jobs kept for display
+jobs = OrderedDict()																	# id -> Job, in submission order
+jobs_lock = threading.Lock()
+pending = queue.Queue()
+runner = None
+numbers = itertools.count(1)
+
+class Job:
+
+	def __init__(self, description, function, assets, batch, progress, kwargs):
+		self.id = next(numbers)
+		self.key = (function.__name__, tuple(sorted(assets)), batch, repr(sorted(kwargs.items())))
+		self.description = description
+		self.function = function
+		self.assets = list(assets)
+		self.batch = batch
+		self.progress = progress
+		self.kwargs = kwargs
+		self.status = 'pending'															# pending, running, done, cancelled
+		self.results = {}																# asset -> result or exception
+		self.submitted = time.time()
+		self.started = None
+		self.finished = None
+		self.stopped = threading.Event()
+
+	def collect(self, asset, result):
+		with jobs_lock:
+			self.results[asset] = result
+		if self.progress is not None:
+			self.progress(asset, result)
+
+	def run(self):
+		with jobs_lock:
+			if self.stopped.is_set():
+				self.status, self.finished = 'cancelled', time.time()
+				return
+			self.status, self.started = 'running', time.time()
+		try:
+			compute.run_in_processes(self.function, self.assets, batch=self.batch, progress=self.collect, stopped=self.stopped, **self.kwargs)
+		except Exception as error:														# Pool failure, every asset left fails with it
+			for asset in self.assets:
+				if asset not in self.results:
+					self.collect(asset, error)
+		with jobs_lock:
+			self.status = 'cancelled' if self.stopped.is_set() else 'done'
+			self.finished = time.time()
+
+	def summary(self):
+		''' Progress of the job as plain values: done and total assets, seconds running, assets per second '''
+		with jobs_lock:
+			done = len(self.results)
+			cancelled = sum(isinstance(result, CancelledError) for result in self.results.values())
+			failed = sum(isinstance(result, Exception) for result in self.results.values()) - cancelled
+			seconds = ((self.finished or time.time()) - self.started) if self.started else 0
+		return {'Job': self.id, 'Description': self.description, 'Status': self.status, 'Done': f'{done - cancelled} / {len(self.assets)}',
+			'Failed': failed, 'Seconds': round(seconds, 1), 'Assets/s': round((done - cancelled) / seconds, 2) if seconds else None}
+
+def run_jobs():
+	while True:
+		job = pending.get()
+		job.run()
+
+def submit(description, function, assets, batch=False, progress=None, **kwargs):
+	''' Queues function over the assets (arguments as for compute.run_in_processes) and returns (job, True), or
+	(job, False) with the pending or running job doing the same work. progress(asset, result) is called from the
+	runner thread as results come in '''
+	global runner
+	job = Job(description, function, assets, batch, progress, kwargs)
+	with jobs_lock:
+		for other in jobs.values():
+			if other.key == job.key and other.status in ['pending', 'running'] and not other.stopped.is_set():
+				return other, False
+		jobs[job.id] = job
+		finished = [other.id for other in jobs.values() if other.status in ['done', 'cancelled']]
+		for number in finished[:max(0, len(finished) - finished_max)]:
+			jobs.pop(number)
+		if runner is None:
+			runner = threading.Thread(target=run_jobs, daemon=True)
+			runner.start()
+	pending.put(job)
+	return job, True
+
+def cancel(job_id):
+	''' Stops the job: a pending job never starts, a running one finishes the assets already started '''
+	with jobs_lock:
+		job = jobs.get(job_id)
+		if job is None:
+			return
+		job.stopped.set()
+		if job.status == 'pending':														# Shown as cancelled now, not when the runner gets to it
+			job.status, job.finished = 'cancelled', time.time()
+
+def active():
+	''' True while any job is pending or running '''
+	with jobs_lock:
+		return any(job.status in ['pending', 'running'] for job in jobs.values())
+
+def snapshot():
+	with jobs_lock:
+		return list(jobs.values())
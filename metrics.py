@@ -0,0 +1,192 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+''' Timing spans, counters and opt-in profiles of the app process. A span times a block under its name; spans opened
+inside another one are named after it ('display_graph/read dataset'), so every phase of a callback has its own latency
+histogram, and consecutive phases of a span are marked with mark() instead of nesting blocks. Counters add up bytes and
+rows read and written, including those of compute workers, which send theirs back with their results (spans stay in the
+process that timed them). The app serves all of it on /metrics; profiles of the next callback requests are armed there
+too and saved as pstats files in .profiles/ of the dataset store (python -m pstats <file>) '''
+
+bounds = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30]		# Upper bounds of the histogram buckets, seconds
+profile_path = None																		# Directory of the profile files, .profiles in storage.path if None
+profiles_max = 20																		# Profile files kept, the oldest are deleted
+profile_lines = 25																		# Functions in the summary of a profile
+histograms = OrderedDict()																# span name -> histogram
+counters = OrderedDict()																# counter name -> total
+profiles = []																			# Summaries of the saved profiles, newest last
+armed = {'count': 0, 'callback': None}													# Profiles still to take and of which callback
+metrics_lock = threading.Lock()
+profile_lock = threading.Lock()															# One profiler runs at a time
+local = threading.local()																# Open spans, phases and the request of the thread
+
+def record(name, seconds):
+	with metrics_lock:
+		histogram = histograms.get(name)
+		if histogram is None:
+			histogram = histograms[name] = {'count': 0, 'total': 0.0, 'min': seconds, 'max': seconds, 'buckets': [0] * (len(bounds) + 1)}
+		histogram['count'] += 1
+		histogram['total'] += seconds
+		histogram['min'] = min(histogram['min'], seconds)
+		histogram['max'] = max(histogram['max'], seconds)
+		histogram['buckets'][next((number for number, bound in enumerate(bounds) if seconds <= bound), len(bounds))] += 1
+
+def count(name, value=1):
+	with metrics_lock:
+		counters[name] = counters.get(name, 0) + value
+
+def counts():
+	with metrics_lock:
+		return dict(counters)
+
+def changes(before):
+	''' Counters added since before (a counts() result), as {name: value} '''
+	return {name: value - before.get(name, 0) for name, value in counts().items() if value != before.get(name, 0)}
+
+def merge(deltas):
+	''' Adds counters counted in another process, see compute.run_in_processes '''
+	for name, value in deltas.items():
+		count(name, value)
+
+def open_spans():
+	if not hasattr(local, 'spans'):
+		local.spans, local.phases, local.body = [], {}, 0.0
+	return local.spans
+
+@contextmanager
+def span(name):
+	''' Times the block under name, prefixed with the names of the spans it runs in '''
+	stack = open_spans()
+	stack.append(name)
+	full_name = '/'.join(stack)
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		end_phase(len(stack))
+		seconds = time.perf_counter() - start
+		record(full_name, seconds)
+		stack.pop()
+		if not stack:
+			local.body += seconds														# Time of the request spent in spans
+
+def mark(name):
+	''' Ends the phase marked last in the current span and starts the named one, the last phase ends with the span '''
+	stack = open_spans()
+	end_phase(len(stack))
+	local.phases[len(stack)] = ('/'.join(stack + [name]), time.perf_counter())
+
+def end_phase(depth):
+	phase = local.phases.pop(depth, None)
+	if phase is not None:
+		record(phase[0], time.perf_counter() - phase[1])
+
+def timed(function):
+	''' Decorator: every call of function is a span named after it '''
+	@functools.wraps(function)
+	def wrapper(*args, **kwargs):
+		with span(function.__name__):
+			return function(*args, **kwargs)
+	return wrapper
+
+def quantile(histogram, fraction):
+	''' Upper bound of the bucket holding the fraction of the calls, the maximum for the last bucket '''
+	rank = fraction * histogram['count']
+	total = 0
+	for number, calls in enumerate(histogram['buckets']):
+		total += calls
+		if total >= rank and calls:
+			return bounds[number] if number < len(bounds) else histogram['max']
+	return histogram['max']
+
+# Requests: the app times every callback request and may profile it. A callback timed with timed() is a span of its
+# own, the rest of the request is Dash parsing the request and serializing the result
+
+def start_request(name):
+	open_spans()
+	local.body = 0.0
+	local.request = (name, time.perf_counter(), None)
+	with metrics_lock:
+		take = armed['count'] > 0 and armed['callback'] in [None, name]
+	if take and profile_lock.acquire(blocking=False):
+		with metrics_lock:
+			take = armed['count'] > 0
+			armed['count'] -= take
+		if not take:
+			profile_lock.release()
+			return
+		profiler = cProfile.Profile()
+		profiler.enable()
+		local.request = (name, local.request[1], profiler)
+
+def finish_request(response_bytes):
+	''' Records the request opened by start_request; (name, seconds) or None when there was none '''
+	request = getattr(local, 'request', None)
+	if request is None:
+		return None
+	local.request = None
+	name, start, profiler = request
+	seconds = time.perf_counter() - start
+	if profiler is not None:
+		profiler.disable()
+		profile_lock.release()
+		save_profile(name, profiler, seconds)
+	record(f'request {name}', seconds)
+	if local.body:																		# The callback was timed, the rest is Dash
+		record(f'{name}/serialize and dispatch', max(seconds - local.body, 0))
+	count('bytes sent', response_bytes)
+	return name, seconds
+
+def arm_profile(number=1, callback=None):
+	''' Profiles the next number callback requests (of the callback only, if given) '''
+	with metrics_lock:
+		armed.update(count=number, callback=callback)
+
+def profile_directory():
+	import storage																		# Not at the top, storage imports this module
+	return profile_path or os.path.join(storage.path, '.profiles')
+
+def save_profile(name, profiler, seconds):
+	directory = profile_directory()
+	os.makedirs(directory, exist_ok=True)
+	file = os.path.join(directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{int(time.time() * 1000) % 1000:03d} {name}.prof')
+	profiler.dump_stats(file)
+	text = io.StringIO()
+	pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(profile_lines)
+	with metrics_lock:
+		profiles.append({'callback': name, 'seconds': round(seconds, 4), 'file': file, 'summary': text.getvalue()})
+		del profiles[:-profiles_max]
+	files = sorted(entry.path for entry in os.scandir(directory) if entry.name.endswith('.prof'))
+	for old in files[:-profiles_max]:
+		os.remove(old)
+
+def snapshot(caches=None):
+	''' Plain data of all metrics, with caches ({name: statistics}) as given by the app '''
+	with metrics_lock:
+		spans = {}
+		for name, histogram in histograms.items():
+			spans[name] = {
+				'count': histogram['count'],
+				'total_seconds': round(histogram['total'], 6),
+				'mean_seconds': round(histogram['total'] / histogram['count'], 6),
+				'min_seconds': round(histogram['min'], 6),
+				'max_seconds': round(histogram['max'], 6),
+				'p50_seconds': quantile(histogram, 0.5),
+				'p95_seconds': quantile(histogram, 0.95),
+				'p99_seconds': quantile(histogram, 0.99),
+				'buckets': {str(bound): calls for bound, calls in zip(bounds + ['inf'], histogram['buckets'])},
+			}
+		return {'spans': spans, 'counters': dict(counters), 'caches': caches or {}, 'profiling': dict(armed),
+			'profiles': [{key: value for key, value in profile.items() if key != 'summary'} for profile in profiles]}
+
+def reset():
+	with metrics_lock:
+		histograms.clear()
+		counters.clear()
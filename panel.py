@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+import indicator_cache
+import storage
+
+''' Panel (bars x assets) computation of indicators for many assets at once. The bars of every asset are aligned to the
+last row of a 2-D array (one column per asset, NaN before the first bar of shorter histories), so each indicator of
+indicators.py runs once per chunk of assets instead of once per asset. Leading NaN rows do not change rolling or
+exponential results, so every asset gets the same values as when computed alone, except CCI: its mean deviation is a
+mean over the whole column, which pandas sums in another order with the padding, so it is equal to float tolerance
+(the last bits differ). Assets are sorted by history length before chunking to keep the padding small '''
+
+chunk_size = 256																		# Assets per panel, bounds memory to chunk_size x rows per column
+
+def load_panel(assets, columns):
+	''' Returns ({column: DataFrame bars x assets}, [number of bars of each asset]) '''
+	data = [storage.read_columns(asset, columns, copy=False) for asset in assets]
+	lengths = [len(asset_data[columns[0]]) for asset_data in data]
+	rows = max(lengths)
+
+	panel = {}
+	for column in columns:
+		values = np.full((rows, len(assets)), np.nan)
+		for number, asset_data in enumerate(data):
+			values[rows - lengths[number]:, number] = asset_data[column]
+		panel[column] = pd.DataFrame(values, columns=assets)
+	return panel, lengths
+
+def compute_indicators(panel, selected_indicators):
+	''' {column: DataFrame bars x assets} of the selected indicators, named as in the app ('SMA 20', 'Bollinger') or with
+	parameters ('Bollinger(30, 2.5)'), see indicator_cache.parse_indicator '''
+	results = {}
+
+	for indicator in selected_indicators:
+		name, parameters = indicator_cache.parse_indicator(indicator)
+		function, inputs, outputs, defaults = indicator_cache.indicator_functions[name]
+		values = function(*[panel[column] for column in inputs], *parameters)
+		values = values if type(values) == tuple else (values,)
+		results.update(zip(indicator_cache.column_names(name, parameters), values))
+
+	return results
+
+def scatter(assets, lengths, results):
+	''' Writes each asset's rows of the panel results back to its dataset '''
+	for number, asset in enumerate(assets):
+		storage.write_columns(asset, {column: values.values[len(values) - lengths[number]:, number] for column, values in results.items()})
+
+def calculate_indicators(assets, selected_indicators, columns=['High', 'Low', 'Close']):
+	''' Computes the selected indicators of all assets chunk by chunk and stores them '''
+	assets = sorted(assets, key=lambda asset: storage.read_schema(asset)['rows'])
+	for first in range(0, len(assets), chunk_size):
+		chunk = assets[first:first + chunk_size]
+		panel, lengths = load_panel(chunk, columns)
+		scatter(chunk, lengths, compute_indicators(panel, selected_indicators))
@@ -0,0 +1,170 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+import indicators
+import indicator_cache
+import signals
+import candlestick_patterns
+import storage
+
+''' Dependency graph of indicators, signals and candlestick patterns. Every node declares the columns it reads and
+writes; intermediates (names in parentheses, e.g. '(typical price)') are shared by all nodes that need them but never
+stored. plan() resolves the requested columns down to what the dataset already has, so only missing dependencies are
+computed, and run() executes the plan for one asset and reports what was computed and what was reused '''
+
+def defaults(name):
+	''' Default parameters of an indicator of indicators.py, those of the stored columns ('Upper band', 'RSI', ...) '''
+	return indicator_cache.indicator_functions[name][3]
+
+def node(outputs, inputs, function):
+	return {'name': ', '.join(outputs), 'outputs': outputs, 'inputs': inputs, 'function': function}
+
+def is_intermediate(column):
+	return column.startswith('(')
+
+def sma_node(period):
+	return node([f'SMA {period}'], ['Close'], lambda close_price: indicators.simple_moving_average(close_price, period))
+
+def ema_node(period):
+	return node([f'EMA {period}'], ['Close'], lambda close_price: indicators.exponential_moving_average(close_price, period))
+
+def rolling_extremum_node(column, window, find_max):
+	name = f'({column.lower()} {"max" if find_max else "min"} {window})'
+	function = indicators.rolling_max if find_max else indicators.rolling_min
+	return node([name], [column], lambda price: function(price, window))
+
+def rolling_position_node(column, window, find_max):
+	name = f'({column.lower()} {"argmax" if find_max else "argmin"} {window})'
+	function = indicators.rolling_argmax if find_max else indicators.rolling_argmin
+	return node([name], [column], lambda price: function(price, window))
+
+def pattern_node(pattern):
+	direction, rule = candlestick_patterns.pattern_rules[pattern]
+	def function(features):
+		with np.errstate(invalid='ignore'):
+			return np.where(rule(features), direction, 0)
+	return node([pattern], ['(pattern features)'], function)
+
+def bollinger_nodes(period, multiplier):
+	return [
+		node([f'(typical price std {period})'], ['(typical price)'], lambda typical_price: typical_price.rolling(period).std()),
+		node(['Upper band', 'Lower band'], [f'SMA {period}', f'(typical price std {period})'],
+			lambda sma, standard_deviation: indicators.bollinger_bands(sma, standard_deviation, multiplier)),
+	]
+
+def stochastic_nodes(k_period, d_period):
+	return [
+		rolling_extremum_node('High', k_period, True), rolling_extremum_node('Low', k_period, False),
+		node(['Stochastic %K', 'Stochastic %D'], ['Close', f'(high max {k_period})', f'(low min {k_period})'],
+			lambda close_price, highest_high, lowest_low: indicators.stochastic_from_extremes(close_price, highest_high, lowest_low, d_period)),
+	]
+
+def williams_r_nodes(period):
+	return [
+		rolling_extremum_node('High', period, True), rolling_extremum_node('Low', period, False),
+		node(['Williams %R'], ['Close', f'(high max {period})', f'(low min {period})'], indicators.williams_r_from_extremes),
+	]
+
+def commodity_channel_index_nodes(period, constant):
+	return [
+		node([f'(typical price SMA {period})'], ['(typical price)'], lambda typical_price: indicators.simple_moving_average(typical_price, period)),
+		node(['CCI'], ['(typical price)', f'(typical price SMA {period})'],
+			lambda typical_price, typical_price_sma: indicators.commodity_channel_index_from_mean(typical_price, typical_price_sma, constant)),
+	]
+
+def aroon_nodes(period):
+	return [
+		rolling_position_node('High', period + 1, True), rolling_position_node('Low', period + 1, False),
+		node(['Aroon Up', 'Aroon Down'], [f'(high argmax {period + 1})', f'(low argmin {period + 1})'],
+			lambda high_position, low_position: indicators.aroon_from_positions(high_position, low_position, period)),
+	]
+
+def indicator_node(name, parameters):
+	''' The indicator computed by its function of indicators.py, e.g. for columns with custom parameters ('RSI(21)') '''
+	function, inputs = indicator_cache.indicator_functions[name][:2]
+	return node(indicator_cache.column_names(name, parameters), inputs, lambda *prices: function(*prices, *parameters))
+
+# Indicators with the default parameters share their intermediates (names in parentheses) through the nodes above
+fixed_nodes = [
+	node(['(typical price)'], ['High', 'Low', 'Close'], indicators.typical_price),
+	node(['(pattern features)'], ['Open', 'High', 'Low', 'Close'], candlestick_patterns.Features),
+
+	*bollinger_nodes(*defaults('Bollinger')),
+	indicator_node('RSI', defaults('RSI')),
+	indicator_node('MACD', defaults('MACD')),
+	*stochastic_nodes(*defaults('Stochastic')),
+	*williams_r_nodes(*defaults('Williams %R')),
+	*commodity_channel_index_nodes(*defaults('CCI')),
+	*aroon_nodes(*defaults('Aroon')),
+
+	node(['RSI Signal'], ['Close', 'RSI'], signals.relative_strength_index),
+	node(['MACD Signal'], ['MACD Histogram'], signals.moving_average_convergence_divergence),
+	node(['Bollinger Signal'], ['Close', 'Upper band', 'Lower band'], signals.bollinger),
+	node(['Stochastic Signal'], ['Stochastic %D'], signals.stochastic),
+	node(['Williams %R Signal'], ['Williams %R'], signals.williams_r),
+	node(['CCI Signal'], ['CCI'], signals.commodity_channel_index),
+	node(['Aroon Signal'], ['Aroon Up', 'Aroon Down'], signals.aroon),
+] + [pattern_node(pattern) for pattern in candlestick_patterns.all_patterns]
+
+graph = {output: spec for spec in fixed_nodes for output in spec['outputs']}
+
+def find_node(column):
+	''' Node producing the column, including SMA / EMA of any period, crossovers of any two SMAs and indicators with
+	custom parameters ('Upper band(30, 2.5)') '''
+	if column in graph:
+		return graph[column]
+	match = re.fullmatch(r'(SMA|EMA) (\d+)', column)
+	if match:
+		return (sma_node if match.group(1) == 'SMA' else ema_node)(int(match.group(2)))
+	match = re.fullmatch(r'Crossover SMA (\d+)/(\d+) Signal', column)
+	if match:
+		return node([column], [f'SMA {match.group(1)}', f'SMA {match.group(2)}'], signals.moving_average_crossover)
+	try:
+		return indicator_node(*indicator_cache.parse_column(column))
+	except ValueError:
+		raise KeyError(f'No node computes {column}')
+
+def plan(requested, columns):
+	''' Returns (nodes to run in dependency order, stored columns to read). Requested columns are always recomputed,
+	their dependencies only when the dataset does not have them yet '''
+	order = []
+	reused = []
+	visited = set()
+
+	def visit(column):
+		if column in visited:
+			return
+		visited.add(column)
+		if column not in requested and column in columns:
+			reused.append(column)
+			return
+		spec = find_node(column)
+		for input_column in spec['inputs']:
+			visit(input_column)
+		if spec['name'] not in [planned['name'] for planned in order]:
+			order.append(spec)
+		visited.update(spec['outputs'])
+
+	for column in requested:
+		visit(column)
+	return order, reused
+
+def run(asset, requested):
+	''' Computes the requested columns of the asset and every missing dependency, stores the non-intermediate results.
+	Returns {'computed': node names, 'reused': stored columns read, 'shared': intermediates used by more than one node} '''
+	order, reused = plan(requested, storage.read_schema(asset)['columns'])
+	df = storage.read_dataset(asset, reused)
+	values = {column: df[column] for column in reused}
+
+	for spec in order:
+		results = spec['function'](*[values[column] for column in spec['inputs']])
+		results = results if type(results) == tuple else (results,)
+		for column, result in zip(spec['outputs'], results):
+			values[column] = pd.Series(result, index=df.index) if isinstance(result, np.ndarray) else result
+
+	storage.write_columns(asset, {column: values[column] for spec in order for column in spec['outputs'] if not is_intermediate(column)})
+
+	uses = pd.Series([column for spec in order for column in spec['inputs']], dtype=object).value_counts()
+	return {'computed': [spec['name'] for spec in order], 'reused': reused, 'shared': [column for column, count in uses.items() if count > 1 and is_intermediate(column)]}
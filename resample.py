@@ -0,0 +1,190 @@
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+import incremental
+import planner
+import storage
+
+''' Multi-timeframe bars. Every timeframe of an asset ('W', 'M', '3M', '2W', '15min', '1H', ...) is a level stored as a
+dataset of its own in datasets/<asset>/.timeframes/<timeframe>/, so indicators, signals and candlestick patterns run on
+it like on any asset (see planner.py and incremental.py). A level is built from the coarsest cached level whose bars nest
+into its bars (15min -> 1H -> 1D -> W, 1D -> M -> 3M), or from the base bars, and kept up to date incrementally: only the
+bars since the last, possibly still forming, bar of the level are resampled again. Bars are dated by their last base bar,
+so a weekly bar of a daily history is dated on the last trading day of the week '''
+
+price_columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+daily_timeframes = ['W', 'M', '3M', '12M']												# Suggested in the app
+intraday_timeframes = ['5min', '15min', '1H', '4H', '1D']
+units = {'min': 60, 'H': 3600, 'D': 86400}												# Seconds of the fixed length units
+level_lock = threading.Lock()
+
+def parse_timeframe(timeframe):
+	''' '15min' -> (15, 'min'), 'W' -> (1, 'W'); ValueError for anything else '''
+	match = re.fullmatch(r'\s*(\d*)\s*(min|H|D|W|M)\s*', timeframe or '')
+	if match is None or match.group(1) in ['0']:
+		raise ValueError(f'Unknown timeframe {timeframe}')
+	return int(match.group(1) or 1), match.group(2)
+
+def normalize(timeframe):
+	count, unit = parse_timeframe(timeframe)
+	return unit if count == 1 and unit in ['W', 'M'] else f'{count}{unit}'
+
+def level_name(asset, timeframe):
+	return f'{asset}/.timeframes/{normalize(timeframe)}'
+
+def is_intraday(dates):
+	''' True when the bars have times of day (not all at midnight) '''
+	dates = np.asarray(dates[-100:], dtype='datetime64[ns]')
+	return bool(len(dates)) and bool((dates != dates.astype('datetime64[D]')).any())
+
+def buckets(dates, timeframe):
+	''' Bucket number of every bar, non-decreasing for sorted dates. Fixed length units count from the epoch, weeks start
+	on Monday and months on the 1st, so every bucket of a multiple of a unit is a union of buckets of the unit '''
+	count, unit = parse_timeframe(timeframe)
+	dates = np.asarray(dates, dtype='datetime64[ns]')
+	if unit == 'M':
+		months = dates.astype('datetime64[M]').astype(np.int64)
+		return months // count
+	if unit == 'W':
+		days = dates.astype('datetime64[D]').astype(np.int64)
+		return (days + 3) // 7 // count													# 1970-01-01 was a Thursday
+	return dates.astype('datetime64[s]').astype(np.int64) // (count * units[unit])
+
+def nests(finer, coarser):
+	''' True when every bucket of the coarser timeframe is a union of buckets of the finer one '''
+	finer_count, finer_unit = parse_timeframe(finer)
+	coarser_count, coarser_unit = parse_timeframe(coarser)
+	if finer_unit in units and coarser_unit in units:
+		finer_seconds, coarser_seconds = finer_count * units[finer_unit], coarser_count * units[coarser_unit]
+		return coarser_seconds > finer_seconds and coarser_seconds % finer_seconds == 0
+	if finer_unit in units:																# Days and shorter nest into weeks and months
+		return finer_count * units[finer_unit] <= units['D'] and units['D'] % (finer_count * units[finer_unit]) == 0
+	return finer_unit == coarser_unit and coarser_count > finer_count and coarser_count % finer_count == 0
+
+def aggregate(df, keys):
+	''' OHLCV bars of consecutive rows of df with the same key, dated by their last row '''
+	starts = np.concatenate([[0], np.flatnonzero(np.diff(keys)) + 1]) if len(keys) else np.zeros(0, dtype=int)
+	ends = np.append(starts[1:], len(keys)) - 1
+	bars = {
+		'Date': df['Date'].values[ends],
+		'Open': df['Open'].values[starts],
+		'High': np.fmax.reduceat(df['High'].values, starts) if len(starts) else np.zeros(0),
+		'Low': np.fmin.reduceat(df['Low'].values, starts) if len(starts) else np.zeros(0),
+		'Close': df['Close'].values[ends],
+	}
+	if 'Volume' in df:
+		bars['Volume'] = np.add.reduceat(np.nan_to_num(df['Volume'].values), starts) if len(starts) else np.zeros(0)
+	return pd.DataFrame(bars)
+
+def cached_levels(asset):
+	root = os.path.join(storage.asset_path(asset), '.timeframes')
+	return [timeframe for timeframe in os.listdir(root) if storage.exists(f'{asset}/.timeframes/{timeframe}')] if os.path.exists(root) else []
+
+def level_size(timeframe):
+	''' Approximate length of the timeframe in seconds, to order levels '''
+	count, unit = parse_timeframe(timeframe)
+	return count * {'W': 7 * units['D'], 'M': 30 * units['D']}.get(unit, units.get(unit))
+
+def source(asset, timeframe):
+	''' Dataset the level is resampled from: the coarsest cached level nesting into it, the base dataset otherwise '''
+	finer = [level for level in cached_levels(asset) if nests(level, timeframe)]
+	return level_name(asset, max(finer, key=level_size)) if finer else asset
+
+def build(asset, timeframe, origin):
+	''' Resamples the whole origin dataset into the level '''
+	level = level_name(asset, timeframe)
+	columns = [column for column in ['Date'] + price_columns if column in storage.read_schema(origin)['columns']]
+	df = storage.read_dataset(origin, columns)
+	keys = buckets(df['Date'].values, timeframe)
+	bars = aggregate(df, keys)
+	storage.write_dataset(level, bars)
+	return level, keys
+
+def remember(level, origin, start):
+	''' Saves the origin row where the last bar of the level starts and the origin bar before it, to tell appended
+	origin bars from a rewritten history on the next update '''
+	origin_dates = np.load(storage.column_file(origin, 'Date'), mmap_mode='r')
+	origin_close = np.load(storage.column_file(origin, 'Close'), mmap_mode='r')
+	schema = storage.read_schema(level)
+	schema['origin'] = {'name': origin, 'prices': storage.price_version(origin), 'start': start,
+		'before': [str(origin_dates[start - 1]), float(origin_close[start - 1])] if start else None}
+	storage.write_schema(level, schema)
+
+def update(asset, timeframe):
+	''' Brings the level up to date with the base bars and returns its dataset name; a lookup when nothing changed '''
+	with level_lock:
+		return update_level(asset, normalize(timeframe))
+
+def refresh(asset):
+	''' Brings every cached level of the asset up to date, finest first so coarser levels resample from current bars.
+	Called by the jobs that write the asset (imports, daily updates, compute steps), so reading a level is a lookup '''
+	with level_lock:
+		for timeframe in sorted(cached_levels(asset), key=level_size):
+			update_level(asset, timeframe)
+
+def update_level(asset, timeframe):
+	origin = source(asset, timeframe)
+	if origin != asset:
+		update_level(asset, origin.rsplit('/', 1)[1])
+	level = level_name(asset, timeframe)
+	saved = storage.read_schema(level).get('origin') if storage.exists(level) else None
+	if saved is not None and saved['name'] == origin and saved['prices'] == storage.price_version(origin):
+		sync(asset, level)																# Columns added to the base since
+		return level
+
+	dates = np.load(storage.column_file(origin, 'Date'), mmap_mode='r')
+	close = np.load(storage.column_file(origin, 'Close'), mmap_mode='r')
+	start = saved['start'] if saved is not None and saved['name'] == origin else None
+	appended = start is not None and start < len(dates) and (saved['before'] is None or (start > 0
+		and str(dates[start - 1]) == saved['before'][0] and float(close[start - 1]) == saved['before'][1]))
+
+	if not appended:
+		level, keys = build(asset, timeframe, origin)
+		remember(level, origin, int(np.searchsorted(keys, keys[-1])) if len(keys) else 0)
+		sync(asset, level)
+		return level
+
+	# The last bar of the level is resampled again with every origin bar after it; the indicators, signals and patterns
+	# of that bar are recomputed from there (see incremental.py)
+	columns = [column for column in ['Date'] + price_columns if column in storage.read_schema(origin)['columns']]
+	df = storage.read_dataset(origin, columns, start=start).reset_index(drop=True)
+	keys = buckets(df['Date'].values, timeframe)
+	bars = aggregate(df, keys)
+	schema = storage.read_schema(level)
+	last = schema['rows'] - 1
+	storage.write_tail(level, {column: storage.to_array(column, bars[column].values[:1]) for column in bars.columns}, last)
+	schema = storage.read_schema(level)
+	pending = schema.setdefault('pending', {})
+	for column in schema['columns']:
+		if column not in bars.columns:
+			pending[column] = min(pending.get(column, last), last)
+	schema['prices'] += 1																# New prices of the last bar, for levels resampled from this one
+	storage.write_schema(level, schema)
+	storage.append_rows(level, bars.iloc[1:])
+
+	remember(level, origin, start + int(np.searchsorted(keys, keys[-1])))
+	sync(asset, level)
+	return level
+
+def sync(asset, level):
+	''' Computes on the level every indicator, signal and pattern of the base dataset: pending rows of the ones it has
+	(see incremental.update), all rows of the ones it does not have yet '''
+	schema = storage.read_schema(level)
+	if schema.get('pending'):
+		incremental.update(level)
+		schema = storage.read_schema(level)
+	requested = []
+	for column in storage.read_schema(asset)['columns']:
+		if column in schema['columns']:
+			continue
+		try:
+			planner.find_node(column)
+		except KeyError:																# Not computed by the planner, e.g. stored with the import
+			continue
+		requested.append(column)
+	if requested:
+		planner.run(level, requested)
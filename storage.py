@@ -0,0 +1,228 @@
+import io
+import json
+import os
+import uuid
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+''' Columnar dataset store. Every asset is kept in datasets/<asset>/ as one .npy file per column plus schema.json
+with the column order, number of rows, data versions and an id that is new whenever the whole dataset is written.
+Columns are read through memory maps, so only the rows asked for are paged in, and a single column can be written
+without rewriting the others '''
+
+path = 'datasets/'
+schema_name = 'schema.json'
+state_name = 'state.json'
+
+def asset_path(asset):
+	return os.path.join(path, asset)
+
+def column_file(asset, column):
+	return os.path.join(asset_path(asset), quote(column, safe=' ') + '.npy')
+
+def exists(asset):
+	return os.path.isfile(os.path.join(asset_path(asset), schema_name))
+
+def list_assets():
+	if not os.path.exists(path):
+		return []
+	return sorted(asset for asset in os.listdir(path) if not asset.startswith('.') and exists(asset))
+
+def data_version(asset, schema=None):
+	''' Version of the dataset: the schema's counter, incremented by every write (unlike the schema's modification time,
+	which two writes within one tick of a coarse filesystem clock leave unchanged), prefixed with the dataset id, as
+	the counters start again at 1 when an asset is deleted and imported again. Read from schema if given, so several
+	versions of one read of schema.json agree '''
+	schema = schema or read_schema(asset)
+	return f'{schema.get("id", "")}.{schema["version"]}'
+
+def price_version(asset, schema=None):
+	''' Version of the price data only (Date, OHLCV): changes on write_dataset and append_rows, not when derived columns are written '''
+	schema = schema or read_schema(asset)
+	return f'{schema.get("id", "")}.{schema.get("prices", 0)}'
+
+def read_schema(asset):
+	with open(os.path.join(asset_path(asset), schema_name)) as f:
+		return json.load(f)
+
+def write_schema(asset, schema):
+	schema_path = os.path.join(asset_path(asset), schema_name)
+	with open(schema_path + '.tmp', 'w') as f:
+		json.dump(schema, f)
+	os.replace(schema_path + '.tmp', schema_path)
+
+def to_array(column, values):
+	if column == 'Date':
+		return pd.to_datetime(values).values.astype('datetime64[ns]')
+	values = np.asarray(values)
+	if values.dtype == object:
+		values = values.astype(str)
+	return values
+
+def write_array(asset, column, values):
+	file = column_file(asset, column)
+	with open(file + '.tmp', 'wb') as f:
+		np.save(f, values)
+	os.replace(file + '.tmp', file)
+	metrics.count('bytes written', values.nbytes)
+	metrics.count('rows written', len(values))
+
+def append_array(asset, column, values):
+	''' Appends values to a column file in place, rewriting only the .npy header when it has room for the new shape '''
+	file = column_file(asset, column)
+	with open(file, 'r+b') as f:
+		version = np.lib.format.read_magic(f)
+		read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+		write_header = np.lib.format.write_array_header_1_0 if version == (1, 0) else np.lib.format.write_array_header_2_0
+		shape, fortran_order, dtype = read_header(f)
+		header_size = f.tell()
+		values = np.asarray(values).astype(dtype)
+
+		header = io.BytesIO()
+		write_header(header, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': fortran_order, 'shape': (shape[0] + len(values),)})
+		if len(header.getvalue()) == header_size:
+			f.seek(0)
+			f.write(header.getvalue())
+			f.seek(0, os.SEEK_END)
+			f.write(values.tobytes())
+			metrics.count('bytes written', values.nbytes)
+			metrics.count('rows written', len(values))
+			return
+
+	write_array(asset, column, np.concatenate([np.load(file), values]))
+
+def write_dataset(asset, df):
+	''' Writes the whole DataFrame, replacing any existing dataset of the asset '''
+	os.makedirs(asset_path(asset), exist_ok=True)
+	version = read_schema(asset)['version'] + 1 if exists(asset) else 1
+	prices = read_schema(asset).get('prices', 0) + 1 if exists(asset) else 1
+
+	for column in df.columns:
+		write_array(asset, column, to_array(column, df[column]))
+
+	keep = {os.path.basename(column_file(asset, column)) for column in df.columns}
+	for file in os.listdir(asset_path(asset)):
+		if file.endswith('.npy') and file not in keep:
+			os.remove(os.path.join(asset_path(asset), file))
+	if os.path.exists(os.path.join(asset_path(asset), state_name)):
+		os.remove(os.path.join(asset_path(asset), state_name))
+
+	write_schema(asset, {'id': uuid.uuid4().hex, 'rows': len(df), 'version': version, 'prices': prices, 'columns': list(df.columns)})
+
+def write_columns(asset, columns):
+	''' Adds or replaces the given columns ({name: values}), leaving other columns on disk untouched '''
+	if not columns:
+		return
+	schema = read_schema(asset)
+
+	for column, values in columns.items():
+		values = to_array(column, values)
+		if len(values) != schema['rows']:
+			raise ValueError(f'{asset}: column {column} has {len(values)} rows, dataset has {schema["rows"]}')
+		write_array(asset, column, values)
+		if column not in schema['columns']:
+			schema['columns'].append(column)
+		schema.get('pending', {}).pop(column, None)
+
+	schema['version'] += 1
+	write_schema(asset, schema)
+
+def append_rows(asset, df):
+	''' Appends bars newer than the last stored Date. Columns missing from df (indicators, signals, patterns) are padded
+	with NaN or 0 and marked in schema['pending'] with the first row that still has to be computed '''
+	schema = read_schema(asset)
+	dates = to_array('Date', df['Date'])
+	df = df[dates > np.load(column_file(asset, 'Date'), mmap_mode='r')[-1]]
+	if len(df) == 0:
+		return 0
+
+	pending = schema.setdefault('pending', {})
+	for column in schema['columns']:
+		if column in df.columns:
+			values = to_array(column, df[column])
+		else:
+			dtype = np.load(column_file(asset, column), mmap_mode='r').dtype
+			values = np.full(len(df), np.nan if dtype.kind == 'f' else 0, dtype=dtype)
+			pending[column] = min(pending.get(column, schema['rows']), schema['rows'])
+		append_array(asset, column, values)
+
+	schema['rows'] += len(df)
+	schema['version'] += 1
+	schema['prices'] = schema.get('prices', 0) + 1
+	write_schema(asset, schema)
+	return len(df)
+
+def write_tail(asset, columns, start):
+	''' Overwrites rows from start onwards of existing columns in place through a writable memory map '''
+	if not columns:
+		return
+	schema = read_schema(asset)
+
+	for column, values in columns.items():
+		array = np.load(column_file(asset, column), mmap_mode='r+')
+		array[start:] = values
+		array.flush()
+		metrics.count('bytes written', array[start:].nbytes)
+		metrics.count('rows written', len(array) - start)
+		del array
+		schema.get('pending', {}).pop(column, None)
+
+	schema['version'] += 1
+	write_schema(asset, schema)
+
+def read_state(asset):
+	''' Saved running state of the incremental indicator kernels, see incremental.py '''
+	state_path = os.path.join(asset_path(asset), state_name)
+	if not os.path.exists(state_path):
+		return {}
+	with open(state_path) as f:
+		return json.load(f)
+
+def write_state(asset, state):
+	state_path = os.path.join(asset_path(asset), state_name)
+	with open(state_path + '.tmp', 'w') as f:
+		json.dump(state, f)
+	os.replace(state_path + '.tmp', state_path)
+
+def read_columns(asset, columns, start=0, copy=True):
+	''' Returns {name: array} for the given columns from row start onwards, paging in only those rows through a memory map.
+	The arrays are copies unless copy is False: write_tail rewrites column files in place, so a memory-mapped array kept
+	across writes (e.g. in the app's dataset cache) would change under its reader. Callers that copy the values into
+	arrays of their own right away pass copy=False '''
+	data = {column: np.load(column_file(asset, column), mmap_mode='r')[start:] for column in columns}
+	if copy:
+		data = {column: np.array(values) for column, values in data.items()}
+	metrics.count('bytes read', sum(values.nbytes for values in data.values()))
+	metrics.count('rows read', sum(len(values) for values in data.values()))
+	return data
+
+def read_dataset(asset, columns=None, start=0):
+	''' Returns the dataset (or only the given columns, from row start onwards) as a DataFrame, without touching other data on disk '''
+	schema = read_schema(asset)
+	if columns is None:
+		columns = schema['columns']
+	data = read_columns(asset, columns, start, copy=False)								# The DataFrame copies the columns
+	return pd.DataFrame(data, columns=columns, index=pd.RangeIndex(start, schema['rows']))
+
+def migrate():
+	''' One-shot migration of datasets/<asset>.csv files into the store. CSVs are left in place (the sample dataset is
+	tracked by git) and skipped once their asset has a store, which is what the app reads from then on '''
+	if not os.path.exists(path):
+		return []
+
+	migrated = []
+	for file in sorted(os.listdir(path)):
+		asset = file.replace('.csv', '')
+		if file.endswith('.csv') and not exists(asset):
+			write_dataset(asset, pd.read_csv(os.path.join(path, file)))
+			migrated.append(asset)
+
+	return migrated
+
+if __name__ == '__main__':
+	for asset in migrate():
+		print(asset)
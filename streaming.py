@@ -0,0 +1,310 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+import storage
+import update
+import incremental
+import planner
+import candlestick_patterns
+from incremental import Kernel, RollingMean, RollingVariance, ExponentialMean, span_com, alpha_com
+
+''' Live streaming of intraday bars. StreamingEngine keeps O(1)-per-bar state of every indicator in indicators.py,
+seeded once from the stored daily history. Each intraday bar updates the forming daily candle and the live values of
+indicators, candlestick patterns and signals are evaluated for it with Kernel.preview(), without touching history.
+When a bar of a new day arrives the forming candle is committed to the state. Feeds are plain iterators of bars:
+replay_feed() replays a local stooq-format file, stooq_feed() polls stooq '''
+
+NaN = float('nan')
+
+class RollingExtremum(Kernel):
+	''' Trailing window maximum (or minimum) and its position with a monotonic deque, O(1) amortised per bar.
+	Ties resolve to the oldest bar and incomplete or NaN windows give NaN, like indicators.rolling_extremum '''
+
+	def __init__(self, window, find_max=True):
+		self.window = window
+		self.sign = 1.0 if find_max else -1.0
+		self.queue = deque()
+		self.index = 0
+		self.nan_index = -1
+
+	def update(self, value):
+		value = self.sign * value
+		if value != value:
+			self.nan_index = self.index
+		else:
+			while self.queue and self.queue[-1][1] < value:
+				self.queue.pop()
+			self.queue.append((self.index, value))
+		start = self.index - self.window + 1
+		while self.queue and self.queue[0][0] < start:
+			self.queue.popleft()
+		self.index += 1
+
+		if start < 0 or self.nan_index >= start:
+			return NaN, NaN
+		return self.sign * self.queue[0][1], self.queue[0][0] - start
+
+	def preview(self, value):
+		value = self.sign * value
+		start = self.index - self.window + 1
+		if start < 0 or value != value or self.nan_index >= start:
+			return NaN, NaN
+		best = next((item for item in self.queue if item[0] >= start), None)
+		if best is None or value > best[1]:
+			return self.sign * value, self.window - 1
+		return self.sign * best[1], best[0] - start
+
+class RunningMean(Kernel):
+	''' Mean of all values so far, skipping NaN, like Series.mean() '''
+
+	def __init__(self):
+		self.total = 0.0
+		self.count = 0
+
+	def update(self, value):
+		if value == value:
+			self.total += value
+			self.count += 1
+		return self.total / self.count if self.count else NaN
+
+	def preview(self, value):
+		if value == value:
+			return (self.total + value) / (self.count + 1)
+		return self.total / self.count if self.count else NaN
+
+''' Streaming indicators: (kernels, step) pairs. step(kernels, bar, previous, apply) returns {column: value} for the
+bar, where previous is the last committed bar and apply(kernel, value) is either update or preview. Parameters are those
+of the functions of indicators.py; the engine streams the default ones (see planner.defaults), which the stored columns have '''
+
+def sma(period):
+	def step(kernels, bar, previous, apply):
+		return {f'SMA {period}': apply(kernels[0], bar['Close'])}
+	return [RollingMean(period)], step
+
+def ema(period):
+	def step(kernels, bar, previous, apply):
+		return {f'EMA {period}': apply(kernels[0], bar['Close'])}
+	return [ExponentialMean(span_com(period), adjust=False, min_periods=period)], step
+
+def bollinger(period, multiplier):
+	def step(kernels, bar, previous, apply):
+		typical_price = (bar['High'] + bar['Low'] + bar['Close']) / 3
+		variance = apply(kernels[0], typical_price)
+		standard_deviation = 0.0 if variance < 0 else np.sqrt(variance)
+		middle = apply(kernels[1], bar['Close'])
+		return {'Upper band': middle + multiplier * standard_deviation, 'Lower band': middle - multiplier * standard_deviation}
+	return [RollingVariance(period), RollingMean(period)], step
+
+def rsi(period):
+	def step(kernels, bar, previous, apply):
+		previous_close = previous['Close'] if previous is not None else NaN
+		upward_change = bar['Close'] - previous_close if bar['Close'] > previous_close else 0.0
+		downward_change = previous_close - bar['Close'] if bar['Close'] < previous_close else 0.0
+		with np.errstate(divide='ignore', invalid='ignore'):
+			relative_strength = np.float64(apply(kernels[0], upward_change)) / apply(kernels[1], downward_change)
+			return {'RSI': 100 - (100 / (1 + relative_strength))}
+	return [ExponentialMean(alpha_com(1 / period)), ExponentialMean(alpha_com(1 / period))], step
+
+def macd(slow_ma_period, fast_ma_period, macd_ma_period):
+	def step(kernels, bar, previous, apply):
+		macd = apply(kernels[1], bar['Close']) - apply(kernels[0], bar['Close'])
+		macd_signal_line = apply(kernels[2], macd)
+		return {'MACD': macd, 'MACD Signal Line': macd_signal_line, 'MACD Histogram': macd - macd_signal_line}
+	return [ExponentialMean(alpha_com(2 / slow_ma_period)), ExponentialMean(alpha_com(2 / fast_ma_period)), ExponentialMean(alpha_com(2 / macd_ma_period))], step
+
+def stochastic(k_period, d_period):
+	def step(kernels, bar, previous, apply):
+		highest_high = apply(kernels[0], bar['High'])[0]
+		lowest_low = apply(kernels[1], bar['Low'])[0]
+		with np.errstate(divide='ignore', invalid='ignore'):
+			stochastic_k = float((bar['Close'] - lowest_low) / np.float64(highest_high - lowest_low) * 100)
+		return {'Stochastic %K': stochastic_k, 'Stochastic %D': apply(kernels[2], stochastic_k)}
+	return [RollingExtremum(k_period), RollingExtremum(k_period, find_max=False), RollingMean(d_period)], step
+
+def williams_r(period):
+	def step(kernels, bar, previous, apply):
+		highest_high = apply(kernels[0], bar['High'])[0]
+		lowest_low = apply(kernels[1], bar['Low'])[0]
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return {'Williams %R': float((highest_high - bar['Close']) / np.float64(highest_high - lowest_low) * -100)}
+	return [RollingExtremum(period), RollingExtremum(period, find_max=False)], step
+
+def commodity_channel_index(period, constant):
+	def step(kernels, bar, previous, apply):
+		typical_price = (bar['High'] + bar['Low'] + bar['Close']) / 3
+		deviation = typical_price - apply(kernels[0], typical_price)
+		mean_deviation = apply(kernels[1], abs(deviation))
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return {'CCI': float(deviation / np.float64(mean_deviation * constant)), 'CCI deviation': deviation, 'CCI mean deviation': mean_deviation}
+	return [RollingMean(period), RunningMean()], step
+
+def aroon(period):
+	def step(kernels, bar, previous, apply):
+		return {'Aroon Up': 100 * apply(kernels[0], bar['High'])[1] / period, 'Aroon Down': 100 * apply(kernels[1], bar['Low'])[1] / period}
+	return [RollingExtremum(period + 1), RollingExtremum(period + 1, find_max=False)], step
+
+def all_indicators():
+	return [sma(period) for period in [5, 10, 20, 50, 100, 200]] + [ema(period) for period in [5, 10, 20, 50, 100, 200]] + [
+		bollinger(*planner.defaults('Bollinger')), rsi(*planner.defaults('RSI')), macd(*planner.defaults('MACD')),
+		stochastic(*planner.defaults('Stochastic')), williams_r(*planner.defaults('Williams %R')),
+		commodity_channel_index(*planner.defaults('CCI')), aroon(*planner.defaults('Aroon'))]
+
+all_signal_columns = ['Crossover SMA 5/20 Signal', 'Crossover SMA 10/50 Signal', 'Crossover SMA 20/100 Signal', 'Crossover SMA 50/200 Signal',
+	'MACD Signal', 'RSI Signal', 'Bollinger Signal', 'Stochastic Signal', 'Williams %R Signal', 'CCI Signal', 'Aroon Signal']
+
+def update_kernel(kernel, value):
+	return kernel.update(value)
+
+def preview_kernel(kernel, value):
+	return kernel.preview(value)
+
+class StreamingEngine:
+	''' Live indicators, patterns and signals of one asset, fed with intraday bars through on_bar() '''
+
+	def __init__(self, asset):
+		self.asset = asset
+		self.indicators = all_indicators()
+		self.committed = deque(maxlen=2)												# Last two daily bars with their indicator values
+		self.forming = None
+		self.snapshot = {}
+		self.time = None
+		self.ticks = 0
+		self.lock = threading.Lock()
+
+		history = storage.read_dataset(asset, ['Date', 'Open', 'High', 'Low', 'Close', 'Volume'])
+		for bar in history.to_dict('records'):
+			self.commit(bar)
+
+		columns = list(self.committed[-1]) + all_signal_columns
+		self.rules = {name: spec for name, spec in incremental.find_specs(columns).items() if spec['kernels'] is None and spec['context'] == 1}
+
+	def evaluate(self, bar, apply):
+		previous = self.committed[-1] if self.committed else None
+		values = dict(bar)
+		for kernels, step in self.indicators:
+			values.update(step(kernels, bar, previous, apply))
+		return values
+
+	def commit(self, bar):
+		self.committed.append(self.evaluate(bar, update_kernel))
+
+	def on_bar(self, bar):
+		''' Takes one intraday bar (Date, Time, Open, High, Low, Close, Volume). O(1): only the forming candle is updated,
+		live values are evaluated on the next latest() call, so bursts of ticks cost nothing until the chart asks '''
+		date = pd.Timestamp(bar['Date'])
+		with self.lock:
+			if self.committed and date <= self.committed[-1]['Date']:				# Day already in the stored history
+				return
+			if self.forming is not None and date > self.forming['Date']:
+				self.commit(self.forming)
+				self.forming = None
+
+			if self.forming is None:
+				self.forming = {'Date': date, 'Open': bar['Open'], 'High': bar['High'], 'Low': bar['Low'], 'Close': bar['Close'], 'Volume': bar['Volume']}
+			else:
+				self.forming['High'] = max(self.forming['High'], bar['High'])
+				self.forming['Low'] = min(self.forming['Low'], bar['Low'])
+				self.forming['Close'] = bar['Close']
+				self.forming['Volume'] += bar['Volume']
+			self.time = bar.get('Time')
+			self.ticks += 1
+
+	def latest(self):
+		''' Live indicators, patterns and signals of the forming bar ({} before the first tick) '''
+		with self.lock:
+			if self.forming is None or self.snapshot.get('Ticks') == self.ticks:
+				return dict(self.snapshot)
+
+			values = self.evaluate(self.forming, preview_kernel)
+			frame = pd.DataFrame(list(self.committed) + [values])
+			with np.errstate(divide='ignore', invalid='ignore'):							# CCI of past bars is normalised by today's mean too
+				frame['CCI'] = frame['CCI deviation'] / (values['CCI mean deviation'] * planner.defaults('CCI')[1])
+			for name, spec in self.rules.items():
+				for column, result in spec['run'](None, frame, len(frame) - 1).items():
+					values[column] = int(result[-1])
+			for pattern, result in candlestick_patterns.find_patterns(frame['Open'], frame['High'], frame['Low'], frame['Close']).items():
+				values[pattern] = int(result[-1])
+
+			self.snapshot = dict(values, Time=self.time, Ticks=self.ticks)
+			return dict(self.snapshot)
+
+def replay_feed(path, delay=0.0):
+	''' Intraday bars from a local stooq-format file (Date,Time,Open,High,Low,Close,Volume lines), one every delay seconds '''
+	with open(path) as f:
+		bars = update.parse_intraday(f.read())
+	for bar in bars.to_dict('records'):
+		yield bar
+		time.sleep(delay)
+
+def stooq_feed(asset, interval=60, stopped=None, url=update.stooq_url):
+	''' Polls stooq for today's intraday bars every interval seconds and yields the ones not seen before '''
+	session = update.create_session(1)
+	seen = 0
+	while stopped is None or not stopped.is_set():
+		try:
+			bars, size = update.get_intraday(asset, session, url)
+		except Exception as error:
+			print(asset, 'live feed failed:', error)
+			bars = pd.DataFrame()
+		if len(bars) < seen:															# New day
+			seen = 0
+		for bar in bars.iloc[seen:].to_dict('records'):
+			yield bar
+		seen = len(bars)
+		if stopped is not None:
+			stopped.wait(interval)
+		else:
+			time.sleep(interval)
+
+replay_path = None																		# Local stooq-format file streamed instead of polling stooq, e.g. for testing
+replay_delay = 1.0																		# Seconds between replayed bars
+live_engines = {}																		# asset -> (engine, stop event)
+live_lock = threading.Lock()
+
+def start(asset, feed=None):
+	''' Starts streaming the asset in a background thread (the given feed, replay_path if set, stooq polling otherwise) '''
+	with live_lock:
+		if asset in live_engines:
+			return live_engines[asset][0]
+	engine = StreamingEngine(asset)														# Reads the history, not under the lock
+	stopped = threading.Event()
+	with live_lock:
+		if asset in live_engines:														# Started by another thread meanwhile
+			return live_engines[asset][0]
+		live_engines[asset] = (engine, stopped)
+
+	if feed is None:
+		feed = replay_feed(replay_path, replay_delay) if replay_path else stooq_feed(asset, stopped=stopped)
+
+	def run():
+		for bar in feed:
+			if stopped.is_set():
+				break
+			engine.on_bar(bar)
+
+	threading.Thread(target=run, daemon=True).start()
+	return engine
+
+def stop(asset=None):
+	''' Stops streaming the asset, or every asset '''
+	with live_lock:
+		for name in [asset] if asset is not None else list(live_engines):
+			if name in live_engines:
+				live_engines.pop(name)[1].set()
+
+def latest(asset):
+	with live_lock:
+		engine = live_engines.get(asset, (None,))[0]
+	return engine.latest() if engine is not None else {}
+
+def live_columns():
+	''' Columns the engine streams: OHLCV and every indicator column '''
+	bar = {'Date': None, 'Open': NaN, 'High': NaN, 'Low': NaN, 'Close': NaN, 'Volume': NaN}
+	values = dict(bar)
+	for kernels, step in all_indicators():
+		values.update(step(kernels, bar, None, update_kernel))
+	return [column for column in values if column not in ['Date', 'CCI deviation', 'CCI mean deviation']]
@@ -0,0 +1,141 @@
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+import storage
+
+''' Latest-state index of the universe: the last bar of every column (prices, indicators, signals, candlestick
+patterns) of every asset in one small file, datasets/.summary.npz. The compute steps, the daily update and imports
+refresh the assets they wrote; any asset whose data version changed since is refreshed when the index is read, so a
+screen over thousands of assets reads one file and stats their schemas instead of loading their histories '''
+
+index_file = os.path.join(storage.path, '.summary.npz')
+index_lock = threading.Lock()
+index_cache = {}																		# Index read last and the file version it came from
+
+def last_value(file):
+	''' Last item of a .npy file, read from its header and its last bytes only '''
+	with open(file, 'rb') as f:
+		version = np.lib.format.read_magic(f)
+		read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+		shape, fortran_order, dtype = read_header(f)
+		if not shape or not shape[0] or dtype.hasobject:
+			return None
+		f.seek(-dtype.itemsize, os.SEEK_END)
+		return np.frombuffer(f.read(dtype.itemsize), dtype=dtype)[0]
+
+def latest(asset):
+	''' (date, data version, {column: value}) of the last bar of the asset, from the last item of every numeric column '''
+	schema = storage.read_schema(asset)
+	version = storage.data_version(asset)
+	values = {}
+	for column in schema['columns']:
+		value = last_value(storage.column_file(asset, column))
+		if column != 'Date' and value is not None and value.dtype.kind in 'biuf':
+			values[column] = float(value)
+	date = last_value(storage.column_file(asset, 'Date'))
+	return (date if date is not None else np.datetime64('NaT')), version, values
+
+def read_file():
+	''' Index as stored: DataFrame of last values (asset x column) with Date and Version columns '''
+	try:
+		stat = os.stat(index_file)
+		version = (stat.st_ino, stat.st_size, stat.st_mtime_ns)							# Not the time alone, see storage.data_version
+	except FileNotFoundError:
+		return pd.DataFrame({'Date': pd.Series(dtype='datetime64[ns]'), 'Version': pd.Series(dtype=object)})
+	if index_cache.get('version') != version:
+		with np.load(index_file) as data:
+			index = pd.DataFrame(data['values'], index=data['assets'], columns=data['columns'])
+			index.insert(0, 'Version', data['versions'])
+			index.insert(0, 'Date', data['dates'])
+		index_cache.update(version=version, index=index)
+	return index_cache['index']
+
+def write_file(index):
+	temporary = f'{index_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+	values = index.drop(columns=['Date', 'Version'])
+	with open(temporary, 'wb') as f:
+		np.savez(f, assets=index.index.values.astype(str), columns=values.columns.values.astype(str), values=values.values.astype(np.float64),
+			dates=index['Date'].values.astype('datetime64[ns]'), versions=index['Version'].values.astype(str))
+	os.replace(temporary, index_file)
+
+def update(assets=None):
+	''' Refreshes the assets (by default the ones whose data version changed) and drops deleted assets '''
+	with index_lock:
+		index = read_file()
+		existing = storage.list_assets()
+		if assets is None:
+			versions = index['Version'].to_dict()
+			assets = [asset for asset in existing if versions.get(asset) != storage.data_version(asset)]
+		assets = [asset for asset in assets if storage.exists(asset)]
+		removed = index.index.difference(existing)
+		if not assets and not len(removed):
+			return index
+
+		rows = {}
+		for asset in assets:
+			date, version, values = latest(asset)
+			rows[asset] = dict(values, Date=date, Version=version)
+		index = index.drop(index=removed.union(list(rows)), errors='ignore')
+		if rows:
+			index = pd.concat([index, pd.DataFrame.from_dict(rows, orient='index')])
+		index = index[['Date', 'Version'] + [column for column in index.columns if column not in ['Date', 'Version']]].sort_index()
+		index['Date'] = pd.to_datetime(index['Date'])
+		index['Version'] = index['Version'].fillna('').astype(str)
+		write_file(index)
+		return read_file()
+
+def read_index(refresh=True):
+	''' Last bar of every asset (asset x column DataFrame with a Date column), refreshed first unless refresh=False '''
+	index = update() if refresh else read_file()
+	return index.drop(columns='Version')
+
+operators = {'==': np.equal, '!=': np.not_equal, '>=': np.greater_equal, '<=': np.less_equal, '>': np.greater, '<': np.less}
+
+def parse_conditions(text, errors=None):
+	''' 'Bullish Engulfing == 1 or RSI Signal == 1; Close > 10' -> [[('Bullish Engulfing', '==', 1.0), ('RSI Signal',
+	'==', 1.0)], [('Close', '>', 10.0)]]: all conditions separated by semicolons must hold, one of those joined by or.
+	Conditions that do not parse are skipped and appended to errors, if given '''
+	conditions = []
+	for item in re.split(r'[;\n]', text or ''):
+		alternatives = []
+		for part in re.split(r'\s+or\s+', item.strip()):
+			if not part.strip():
+				continue
+			match = re.fullmatch(r'(.+?)\s*(==|!=|>=|<=|>|<|=)\s*(-?\d+(?:\.\d+)?)', part.strip())
+			if match is None:
+				if errors is not None:
+					errors.append(f'Not a condition: {part.strip()}')
+				continue
+			column, operator, value = match.groups()
+			alternatives.append((column, '==' if operator == '=' else operator, float(value)))
+		if alternatives:
+			conditions.append(alternatives)
+	return conditions
+
+def screen(conditions, sort=None, ascending=False, columns=None, refresh=True):
+	''' Assets of the index meeting the conditions (text or parsed, see parse_conditions), sorted by a column. Returns the
+	Date, the columns of the conditions, the sort column and the requested columns; a condition on a column the index does
+	not have matches nothing. ValueError for text with conditions that do not parse '''
+	if isinstance(conditions, str):
+		errors = []
+		conditions = parse_conditions(conditions, errors)
+		if errors:
+			raise ValueError('; '.join(errors))
+	index = read_index(refresh)
+	selected = np.ones(len(index), dtype=bool)
+	for alternatives in conditions:
+		matched = np.zeros(len(index), dtype=bool)
+		for column, operator, value in alternatives:
+			if column in index:
+				with np.errstate(invalid='ignore'):
+					matched |= operators[operator](index[column].values, value)
+		selected &= matched
+	shown = ['Date'] + [column for alternatives in conditions for column, operator, value in alternatives] + [sort] + list(columns or [])
+	result = index.loc[selected, [column for column in dict.fromkeys(shown) if column in index]]
+	if sort in result:
+		result = result.sort_values(sort, ascending=ascending)
+	return result.rename_axis('Asset').reset_index()
@@ -0,0 +1,213 @@
+import hashlib
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import backtest
+import compute
+import indicators
+import signals
+import storage
+
+''' Grid search of signal parameters across assets. Every configuration of a strategy (e.g. SMA crossover fast/slow
+periods) is turned into a signal column and backtested (see backtest.py). Prices of all assets are loaded once into
+shared memory and worker processes attach to it, so a task only carries an asset number and a block of configurations.
+A block is one 2-D array (bars x configurations) with indicators shared by the configurations that use them. Finished
+tasks are appended to a checkpoint file named after the sweep, so an interrupted sweep resumes where it stopped '''
+
+sweep_path = os.path.join(storage.path, '.sweeps')
+cells_per_task = 1 << 22																# Bars x configurations per task, bounds worker memory
+price_columns = ['Open', 'High', 'Low', 'Close']
+metric = 'Sharpe'																		# Ranking of configurations
+
+def sma_crossover(prices, configurations):
+	periods = {period for configuration in configurations for period in configuration}
+	averages = {period: indicators.simple_moving_average(prices['Close'], period).values for period in periods}
+	fast_ma = pd.DataFrame(np.column_stack([averages[fast] for fast, slow in configurations]))
+	slow_ma = pd.DataFrame(np.column_stack([averages[slow] for fast, slow in configurations]))
+	return signals.moving_average_crossover(fast_ma, slow_ma)
+
+def rsi(prices, configurations):
+	values = {period: indicators.relative_strength_index(prices['Close'], period).values for period in {configuration[0] for configuration in configurations}}
+	rsi_values = pd.DataFrame(np.column_stack([values[configuration[0]] for configuration in configurations]))
+	levels = np.array(configurations, dtype=float)
+	return signals.relative_strength_index(prices['Close'], rsi_values, levels[:, 1], levels[:, 2])
+
+def bollinger(prices, configurations):
+	bands = {}
+	for period in {configuration[0] for configuration in configurations}:
+		upper_band, lower_band = indicators.bollinger(prices['High'], prices['Low'], prices['Close'], period, 1)
+		bands[period] = ((upper_band + lower_band).values / 2, (upper_band - lower_band).values / 2)		# SMA and standard deviation
+	sma = np.column_stack([bands[period][0] for period, multiplier in configurations])
+	deviation = np.column_stack([bands[period][1] for period, multiplier in configurations])
+	multiplier = np.array([multiplier for period, multiplier in configurations])
+	close_price = pd.DataFrame(np.repeat(prices['Close'].values[:, None], len(configurations), axis=1))
+	return signals.bollinger(close_price, pd.DataFrame(sma + multiplier * deviation), pd.DataFrame(sma - multiplier * deviation))
+
+# name: (function, parameters, default ranges, valid configuration)
+strategies = {
+	'SMA Crossover': (sma_crossover, ['Fast', 'Slow'], {'Fast': range(2, 101), 'Slow': range(10, 301, 2)}, lambda fast, slow: fast < slow),
+	'RSI': (rsi, ['Period', 'Overbought', 'Oversold'], {'Period': range(5, 31), 'Overbought': range(60, 91, 2), 'Oversold': range(10, 41, 2)}, lambda period, overbought, oversold: oversold < overbought),
+	'Bollinger': (bollinger, ['Period', 'Multiplier'], {'Period': range(5, 101), 'Multiplier': [round(1 + step / 10, 1) for step in range(21)]}, lambda period, multiplier: True),
+}
+
+def grid(strategy, ranges=None):
+	''' Valid configurations (tuples of parameters) of the strategy, every combination of the ranges (defaults for the
+	parameters left out) '''
+	function, parameters, defaults, valid = strategies[strategy]
+	ranges = dict(defaults, **(ranges or {}))
+	return [configuration for configuration in itertools.product(*[list(ranges[parameter]) for parameter in parameters]) if valid(*configuration)]
+
+def parse_ranges(text):
+	''' 'Fast 5-50/5; Slow 100-200/10' -> {'Fast': [5, 10, ... 50], 'Slow': [100, 110, ... 200]}, a single value or a
+	comma separated list work too; entries that do not parse are skipped '''
+	ranges = {}
+	for item in (text or '').split(';'):
+		try:
+			name, values = item.strip().split(' ', 1)
+			if '-' in values:
+				bounds, step = (values.split('/') + ['1'])[:2]
+				low, high = [float(bound) for bound in bounds.split('-')]
+				ranges[name] = list(np.round(np.arange(low, high + float(step) / 2, float(step)), 6))
+			else:
+				ranges[name] = [float(value) for value in values.replace(',', ' ').split()]
+			ranges[name] = [int(value) if float(value).is_integer() else value for value in ranges[name]]
+		except ValueError:
+			continue
+	return ranges
+
+# Shared memory: dates as int64 then the price columns as float64, one after another for all assets
+worker = {}
+
+def attach(name, offsets, strategy, configurations):
+	''' Worker initializer: views of the shared prices '''
+	memory = shared_memory.SharedMemory(name=name)
+	rows = offsets[-1]
+	worker.update(memory=memory, offsets=offsets, strategy=strategy, configurations=configurations,
+		dates=np.ndarray(rows, dtype='datetime64[ns]', buffer=memory.buf),
+		prices=np.ndarray((len(price_columns), rows), dtype=float, buffer=memory.buf, offset=rows * 8))
+
+def evaluate(number, first, last, mode, commission, slippage, hold):
+	''' Statistics (configurations x statistics array) of configurations first to last on asset number '''
+	start, end = worker['offsets'][number], worker['offsets'][number + 1]
+	dates = worker['dates'][start:end]
+	prices = {column: pd.Series(worker['prices'][position, start:end]) for position, column in enumerate(price_columns)}
+	configurations = worker['configurations'][first:last]
+	signal = strategies[worker['strategy']][0](prices, configurations)
+	close_price = np.broadcast_to(prices['Close'].values[:, None], signal.shape)
+	returns, held = backtest.strategy_returns(close_price, signal, mode, commission, slippage, hold)
+	return backtest.statistics(returns, held, dates, commission + slippage).values
+
+def share(assets):
+	''' Shared memory with the prices of the assets and the row offsets of each '''
+	data = [storage.read_columns(asset, ['Date'] + price_columns, copy=False) for asset in assets]
+	offsets = np.concatenate([[0], np.cumsum([len(asset_data['Date']) for asset_data in data])]).tolist()
+	rows = offsets[-1]
+	memory = shared_memory.SharedMemory(create=True, size=max(1, rows * 8 * (1 + len(price_columns))))
+	dates = np.ndarray(rows, dtype='datetime64[ns]', buffer=memory.buf)
+	prices = np.ndarray((len(price_columns), rows), dtype=float, buffer=memory.buf, offset=rows * 8)
+	for number, asset_data in enumerate(data):
+		dates[offsets[number]:offsets[number + 1]] = asset_data['Date']
+		for position, column in enumerate(price_columns):
+			prices[position, offsets[number]:offsets[number + 1]] = asset_data[column]
+	del dates, prices																	# No views may outlive close()
+	return memory, offsets
+
+def checkpoint_file(assets, strategy, configurations, mode, commission, slippage, hold):
+	key = repr((sorted((asset, storage.price_version(asset)) for asset in assets), strategy, configurations, mode, commission, slippage, hold))
+	return os.path.join(sweep_path, hashlib.sha1(key.encode()).hexdigest() + '.csv')
+
+def read_checkpoint(file, tasks):
+	''' Results of the tasks finished before, only tasks with all of their rows intact (the last write may be cut short) '''
+	if not os.path.exists(file):
+		return pd.DataFrame()
+	results = pd.read_csv(file, on_bad_lines='skip')
+	if results.empty:
+		return pd.DataFrame()
+	expected = pd.DataFrame(tasks, columns=['Asset', 'First', 'Expected'])
+	results = results.merge(expected, on=['Asset', 'First'])
+	results = results[results['Last'] == results['Expected']]
+	rows = results.groupby(['Asset', 'First'])['Configuration'].transform('size')
+	return results[rows == results['Last'] - results['First']].drop(columns=['Last', 'Expected']).reset_index(drop=True)
+
+def run(assets, strategy, configurations, mode='long', commission=backtest.commission, slippage=backtest.slippage, hold=None,
+	workers=compute.max_workers, progress=None, stopped=None):
+	''' Backtests every configuration on every asset. Returns a DataFrame with one row per asset and configuration
+	(Asset, Configuration number, statistics). progress(done tasks, all tasks, new results) is called as tasks finish;
+	once stopped (a threading.Event) is set, tasks not started yet are dropped and the sweep can be resumed later '''
+	assets = [asset for asset in assets if storage.exists(asset)]
+	lengths = {asset: storage.read_schema(asset)['rows'] for asset in assets}
+	tasks = []
+	for asset in assets:
+		size = max(1, cells_per_task // max(lengths[asset], 1))
+		tasks += [(asset, first, min(first + size, len(configurations))) for first in range(0, len(configurations), size)]
+
+	file = checkpoint_file(assets, strategy, configurations, mode, commission, slippage, hold)
+	results = [read_checkpoint(file, tasks)]
+	done = set(zip(results[0]['Asset'], results[0]['First'])) if len(results[0]) else set()
+	tasks = [task for task in tasks if (task[0], task[1]) not in done]
+	total = len(done) + len(tasks)
+	columns = list(backtest.statistics(np.zeros((2, 1)), np.zeros((2, 1)), np.array(['2000-01-01', '2000-01-02'], dtype='datetime64[ns]')).columns)
+	os.makedirs(sweep_path, exist_ok=True)
+	if progress is not None:
+		progress(len(done), total, results[0])
+
+	def collect(task, values):
+		asset, first, last = task
+		rows = pd.DataFrame(values, columns=columns)
+		rows.insert(0, 'Configuration', range(first, last))
+		rows.insert(0, 'First', first)
+		rows.insert(0, 'Asset', asset)
+		rows['Last'] = last																# Marks complete lines
+		with open(file, 'a') as f:														# One write per task, a cut one is redone on resume
+			f.write(rows.to_csv(index=False, header=f.tell() == 0))
+		results.append(rows.drop(columns='Last'))
+		done.add((asset, first))
+		if progress is not None:
+			progress(len(done), total, rows)
+
+	memory, offsets = share(assets)
+	numbers = {asset: number for number, asset in enumerate(assets)}
+	try:
+		if workers == 1 or len(tasks) <= 1:
+			attach(memory.name, offsets, strategy, configurations)
+			for task in tasks:
+				if stopped is not None and stopped.is_set():
+					break
+				collect(task, evaluate(numbers[task[0]], task[1], task[2], mode, commission, slippage, hold))
+		else:
+			with ProcessPoolExecutor(max_workers=workers, mp_context=compute.pool_context, initializer=attach,
+					initargs=(memory.name, offsets, strategy, configurations)) as executor:
+				futures = {executor.submit(evaluate, numbers[task[0]], task[1], task[2], mode, commission, slippage, hold): task for task in tasks}
+				running = set(futures)
+				while running:
+					finished, running = wait(running, timeout=0.5, return_when=FIRST_COMPLETED)
+					if stopped is not None and stopped.is_set():
+						for future in running:
+							future.cancel()
+					for future in finished:
+						if not future.cancelled():
+							collect(futures[future], future.result())
+	finally:
+		if worker:																		# Views of the in-process run go before the memory
+			attached = worker.pop('memory')
+			worker.clear()
+			attached.close()
+		memory.close()
+		memory.unlink()
+
+	return pd.concat([result for result in results if len(result)], ignore_index=True).drop(columns='First') if done else pd.DataFrame()
+
+def rank(results, strategy, configurations, top=50):
+	''' Configurations ordered by the metric averaged over assets, with their parameters '''
+	if results.empty:
+		return pd.DataFrame()
+	table = results.drop(columns=['Asset', 'First'], errors='ignore').groupby('Configuration').mean()
+	table.insert(0, 'Assets', results.groupby('Configuration').size())
+	parameters = pd.DataFrame([configurations[number] for number in table.index], columns=strategies[strategy][1], index=table.index)
+	table = pd.concat([parameters, table], axis=1)
+	return table.sort_values(metric, ascending=False).head(top).reset_index(drop=True)
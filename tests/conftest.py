@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+sample_csv = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'datasets', 'KGH.csv')
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+	''' Runs the test in an empty directory, so the relative datasets/ paths of the modules are scratch '''
+	monkeypatch.chdir(tmp_path)
+	os.makedirs('datasets')
+	return tmp_path
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+import candlestick_patterns
+import compute
+import incremental
+import storage
+from conftest import sample_csv
+
+''' Bars appended and computed incrementally against a full recompute of the whole history, bit for bit '''
+
+price_columns = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
+selected_indicators = ['SMA 5', 'SMA 20', 'SMA 50', 'EMA 10', 'EMA 50', 'Bollinger', 'RSI', 'MACD', 'Stochastic', 'Williams %R',
+	'CCI', 'Aroon', 'Bollinger(30, 2.5)', 'RSI(21)', 'Stochastic(14, 5)']				# The last ones with custom parameters
+selected_signals = ['Crossover SMA 5/20', 'MACD', 'RSI', 'Bollinger', 'Stochastic', 'Williams %R', 'CCI', 'Aroon']
+
+def compute_all(asset):
+	compute.calculate_indicators([asset], selected_indicators)
+	compute.find_candlestick_patterns(asset, candlestick_patterns.all_patterns)
+	compute.find_signals(asset, selected_signals)
+
+def test_appended_bars_equal_full_recompute(workdir):
+	df = pd.read_csv(sample_csv, parse_dates=['Date'])[price_columns].head(600)
+	storage.write_dataset('FULL', df)
+	compute_all('FULL')
+
+	storage.write_dataset('KGH', df.iloc[:500])
+	compute_all('KGH')
+	storage.write_columns('KGH', {'Note': np.arange(500.0)})							# Nothing computes it, left padded
+	for first, last in [(500, 501), (501, 560), (560, 600)]:							# Saved kernel state is continued
+		storage.append_rows('KGH', df.iloc[first:last])
+		report = incremental.update('KGH')
+		assert not storage.read_schema('KGH').get('pending')
+	assert report['Note'] == 'padded'
+
+	full, appended = storage.read_dataset('FULL'), storage.read_dataset('KGH')
+	assert set(full.columns) == set(appended.columns) - {'Note'}
+	for column in full.columns:
+		assert np.array_equal(full[column].values, appended[column].values, equal_nan=True), column
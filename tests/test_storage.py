@@ -0,0 +1,27 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import indicator_cache
+import storage
+import summary
+from conftest import sample_csv
+
+''' Versions and caches keyed by them across a dataset deleted and imported again '''
+
+def test_reimport_gets_new_versions(workdir):
+	df = pd.read_csv(sample_csv, parse_dates=['Date'])[['Date', 'Open', 'High', 'Low', 'Close', 'Volume']].head(300)
+	storage.write_dataset('KGH', df)
+	versions = storage.data_version('KGH'), storage.price_version('KGH')
+	first = indicator_cache.compute('KGH', 'SMA', (10,))['SMA 10']
+	summary.update()
+
+	shutil.rmtree(storage.asset_path('KGH'))											# Deleted and imported again, other prices
+	df['Close'] = df['Close'] * 2
+	storage.write_dataset('KGH', df)
+	assert (storage.data_version('KGH'), storage.price_version('KGH')) != versions
+
+	second = indicator_cache.compute('KGH', 'SMA', (10,))['SMA 10']
+	np.testing.assert_allclose(second[9:], 2 * first[9:])
+	assert summary.read_index().loc['KGH', 'Close'] == df['Close'].iloc[-1]
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+import candlestick_patterns
+import planner
+import storage
+import streaming
+from conftest import sample_csv
+
+''' Streamed values against the batch computation of indicators.py (through the planner) on the same bars '''
+
+price_columns = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
+
+def ticks(bar, time):
+	''' Two intraday bars adding up to the daily bar: the open, then the rest of the day '''
+	half = bar['Volume'] // 2
+	return [
+		{'Date': bar['Date'], 'Time': time, 'Open': bar['Open'], 'High': bar['Open'], 'Low': bar['Open'], 'Close': bar['Open'], 'Volume': half},
+		{'Date': bar['Date'], 'Time': time, 'Open': bar['Close'], 'High': bar['High'], 'Low': bar['Low'], 'Close': bar['Close'], 'Volume': bar['Volume'] - half},
+	]
+
+def batch_last_bar(df):
+	''' Every streamed column of the last bar of df, computed by the planner over the whole history '''
+	storage.write_dataset('BATCH', df)
+	columns = [column for column in streaming.live_columns() if column not in price_columns]
+	columns += streaming.all_signal_columns + list(candlestick_patterns.all_patterns)
+	planner.run('BATCH', columns)
+	return storage.read_dataset('BATCH', columns).iloc[-1]
+
+def test_replay_equals_batch(workdir):
+	df = pd.read_csv(sample_csv, parse_dates=['Date'])[price_columns].head(400)
+	storage.write_dataset('KGH', df.iloc[:-3])
+	engine = streaming.StreamingEngine('KGH')
+
+	for bar in df.iloc[-3:].to_dict('records'):										# Two days committed, the last one forming
+		for tick in ticks(bar, '17:00'):
+			engine.on_bar(tick)
+	live = engine.latest()
+	expected = batch_last_bar(df)
+
+	assert live['Date'] == df['Date'].iloc[-1]
+	assert live['Close'] == df['Close'].iloc[-1]
+	for column, value in expected.items():
+		assert np.isclose(live[column], value, rtol=1e-9, equal_nan=True), column
+
+def test_replay_feed_skips_stored_days(workdir, tmp_path):
+	df = pd.read_csv(sample_csv, parse_dates=['Date'])[price_columns].head(300)
+	storage.write_dataset('KGH', df)
+	engine = streaming.StreamingEngine('KGH')
+
+	file = tmp_path / 'intraday.txt'
+	stored = df.iloc[-1]
+	file.write_text(f'{stored["Date"]:%Y-%m-%d},09:00,1,1,1,1,1\n2030-01-02,09:00,10,12,9,11,100\n2030-01-02,09:05,11,13,10,12,50\n')
+	for bar in streaming.replay_feed(file):
+		engine.on_bar(bar)
+
+	live = engine.latest()
+	assert live['Ticks'] == 2
+	assert [live[column] for column in ['Open', 'High', 'Low', 'Close', 'Volume']] == [10, 13, 9, 12, 150]
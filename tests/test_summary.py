@@ -0,0 +1,13 @@
+import pytest
+
+import summary
+
+def test_parse_conditions():
+	errors = []
+	conditions = summary.parse_conditions('RSI < 30 or RSI Signal = 1; Close > 1.2.3; Volume >= -5.5; Clsoe >', errors)
+	assert conditions == [[('RSI', '<', 30.0), ('RSI Signal', '==', 1.0)], [('Volume', '>=', -5.5)]]
+	assert errors == ['Not a condition: Close > 1.2.3', 'Not a condition: Clsoe >']
+
+def test_screen_rejects_invalid_conditions(workdir):
+	with pytest.raises(ValueError, match='1.2.3'):
+		summary.screen('Close > 1.2.3')
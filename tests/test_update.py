@@ -0,0 +1,92 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pandas as pd
+import pytest
+import requests
+
+import storage
+import update
+from conftest import sample_csv
+
+''' The importer and the daily update against a local stub of the stooq endpoints '''
+
+history = pd.read_csv(sample_csv)[['Date', 'Open', 'High', 'Low', 'Close', 'Volume']].head(300).to_csv(index=False).encode()
+intraday = b'<html><body><pre>2030-01-02,09:00,10,12,9,11,100\n2030-01-02,09:01,11,13,10,12,50\n</pre></body></html>'
+
+class Handler(BaseHTTPRequestHandler):
+	failures = {}																		# symbol: 503 responses left before it succeeds
+	requests = []
+
+	def do_GET(self):
+		url = urlparse(self.path)
+		symbol = parse_qs(url.query)['s'][0]
+		Handler.requests.append((url.path, symbol))
+		if Handler.failures.get(symbol):
+			Handler.failures[symbol] -= 1
+			self.reply(503, b'busy')
+		elif symbol == 'MISSING':
+			self.reply(404, b'')
+		elif url.path == '/history':
+			self.reply(200, history, 'text/csv')
+		else:
+			self.reply(200, intraday, 'text/html')
+
+	def reply(self, status, body, content_type='text/plain'):
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+@pytest.fixture
+def server():
+	Handler.failures, Handler.requests = {}, []
+	httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+	thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+	thread.start()
+	yield f'http://127.0.0.1:{httpd.server_port}'
+	httpd.shutdown()
+	httpd.server_close()
+
+def test_parse_symbols():
+	assert update.parse_symbols('KGH, PKN;CDR\nKGH  ALE\n') == ['KGH', 'PKN', 'CDR', 'ALE']
+	assert update.parse_symbols('') == []
+
+def test_import_streams_and_counts_bytes(workdir, server):
+	result = update.import_dataset('KGH', requests.Session(), url=server + '/history')
+	assert result['rows'] == 300
+	assert result['bytes'] == len(history)
+	df = storage.read_dataset('KGH')
+	assert list(df.columns) == ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
+	assert len(df) == 300
+
+def test_import_retries_server_errors(workdir, server):
+	Handler.failures['KGH'] = 2
+	result = update.import_dataset('KGH', update.create_session(1), url=server + '/history')
+	assert result['rows'] == 300
+	assert Handler.requests.count(('/history', 'KGH')) == 3
+
+def test_bulk_import_reports_failures_per_symbol(workdir, server):
+	results = update.import_datasets(['KGH', 'MISSING'], workers=2, url=server + '/history')
+	assert results['KGH']['rows'] == 300
+	assert isinstance(results['MISSING'], requests.HTTPError)
+	assert storage.list_assets() == ['KGH']
+
+def test_update_appends_the_daily_bar(workdir, server):
+	update.import_dataset('KGH', requests.Session(), url=server + '/history')
+	results = update.update(['KGH'], workers=1, url=server + '/intraday')
+	assert results['KGH']['rows'] == 1
+	df = storage.read_dataset('KGH')
+	assert len(df) == 301
+	assert df[['Open', 'High', 'Low', 'Close', 'Volume']].iloc[-1].tolist() == [10, 13, 9, 12, 150]
+	assert df['Date'].iloc[-1] == pd.Timestamp('2030-01-02')							# The session's day, not the day of the run
+	assert not storage.read_schema('KGH').get('pending')
+
+	results = update.update(['KGH'], workers=1, url=server + '/intraday')				# Same session again, e.g. on a weekend
+	assert results['KGH']['rows'] == 0
+	assert len(storage.read_dataset('KGH')) == 301
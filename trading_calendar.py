@@ -0,0 +1,77 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+''' Non-trading time of a dataset as Plotly rangebreaks, so the chart x axis has no empty weekends, holidays or nights.
+Weekdays without a single bar in the whole history (weekends) are one 'day of week' break, the other missing days of
+the history (holidays) one break listing them and, for intraday bars, times of day without a single bar (nights, lunch
+breaks) 'hour' breaks. Nothing with a bar is ever hidden. Breaks are computed with a few vectorized passes over the
+dates, once per dataset price version, and kept in a small LRU cache, so a render only pays for a dictionary lookup.
+Bars more than a day apart (weekly or monthly bars) get no breaks '''
+
+enabled = True																			# False leaves the x axis continuous
+breaks_max = 64																			# Datasets whose breaks are kept in memory
+breaks = OrderedDict()
+breaks_lock = threading.Lock()
+min_closed_time = np.timedelta64(30, 'm')												# Shorter times of day without bars are not hidden
+weekday_names = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+def weekday(days):
+	''' Monday 0 to Sunday 6 of datetime64[D] values '''
+	return (days.astype(np.int64) + 3) % 7												# 1970-01-01 was a Thursday
+
+def closed_runs(is_open):
+	''' (start, end) of the runs of closed slots of a cyclic week or day, end exclusive and possibly wrapping around '''
+	if is_open.all() or not is_open.any():
+		return []
+	shift = int(np.flatnonzero(is_open)[-1]) + 1										# Start the cycle at a closed slot after an open one
+	rolled = np.roll(is_open, -shift)
+	edges = np.diff(np.concatenate([[1], rolled.astype(np.int8), [1]]))
+	starts, ends = np.flatnonzero(edges == -1), np.flatnonzero(edges == 1)
+	return [((start + shift) % len(is_open), (end + shift) % len(is_open)) for start, end in zip(starts, ends)]
+
+def compute(dates):
+	''' Rangebreaks of sorted datetime64 dates '''
+	dates = np.asarray(dates, dtype='datetime64[m]')
+	if len(dates) < 2:
+		return []
+	days = dates.astype('datetime64[D]')
+	trading_days = days[np.concatenate([[True], days[1:] != days[:-1]])]				# Sorted, no np.unique needed
+	if len(trading_days) > 1 and np.median(np.diff(trading_days)) > np.timedelta64(1, 'D'):
+		return []																		# Weekly or monthly bars
+
+	result = []
+	weekdays = np.bincount(weekday(trading_days), minlength=7) > 0
+	for start, end in closed_runs(weekdays):
+		result.append(dict(bounds=[weekday_names[start], weekday_names[end]]))
+
+	all_days = np.arange(trading_days[0], trading_days[-1] + 1)
+	holidays = all_days[weekdays[weekday(all_days)] & ~np.isin(all_days, trading_days, assume_unique=True)]
+	if len(holidays):
+		result.append(dict(values=np.datetime_as_string(holidays).tolist()))
+
+	minutes = np.bincount((dates - days).astype(np.int64), minlength=1440) > 0			# Minutes of the day with bars
+	if minutes[1:].any():
+		step = max(1, int(np.median(np.diff(np.flatnonzero(minutes))))) if minutes.sum() > 1 else 1	# Bar size in minutes
+		slots = np.add.reduceat(minutes, np.arange(0, 1440, step)) > 0
+		for start, end in closed_runs(slots):
+			if (end - start) % len(slots) * step >= min_closed_time.astype(int):
+				result.append(dict(bounds=[start * step / 60, end * step / 60], pattern='hour'))
+	return result
+
+def rangebreaks(key, dates):
+	''' Rangebreaks of the dates cached under key, e.g. (asset, price version); dates are only read on a miss '''
+	if not enabled:
+		return []
+	with breaks_lock:
+		result = breaks.get(key)
+		if result is not None:
+			breaks.move_to_end(key)
+			return result
+	result = compute(dates)
+	with breaks_lock:
+		breaks[key] = result
+		while len(breaks) > breaks_max:
+			breaks.popitem(last=False)
+	return result
@@ -1,29 +1,65 @@
 import schedule
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
 import pandas as pd
-from datetime import datetime
-import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+import sys
+
+import storage
+import incremental
+import resample
+import summary
+import metrics
+
+stooq_url = 'https://stooq.pl/q/a2/d/'
+stooq_history_url = 'https://stooq.com/q/d/l/'
+max_workers = 16																		# Concurrent requests
+retries = 3																				# Retries per request, with exponential backoff
+backoff_factor = 0.5
 
 def list_assets():
-	datasets = os.listdir('datasets/')
-	assets = []
-	for dataset in datasets:
-		assets.append(dataset.replace('.csv',''))
+	return storage.list_assets()
 
-	return assets
+def create_session(pool_size=max_workers):
+	''' HTTP session shared by all workers: keep-alive connection pool sized to the number of workers, retries with backoff '''
+	session = requests.Session()
+	retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET'])
+	adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+	session.mount('http://', adapter)
+	session.mount('https://', adapter)
+	return session
 
-def get_ohlcv(asset):
-	url = 'https://stooq.pl/q/a2/d/?s=' + asset + '&i=1'
-	response = requests.get(url)
+def parse_intraday(content):
+	''' Parses stooq intraday bars (Date,Time,Open,High,Low,Close,Volume lines) into a DataFrame with numeric prices '''
+	daily_df = pd.DataFrame([x.split(',') for x in content.split('\n')], columns=['Date', 'Time', 'Open', 'High', 'Low', 'Close', 'Volume'])
+	daily_df[['Open', 'High', 'Low', 'Close', 'Volume']] = daily_df[['Open', 'High', 'Low', 'Close', 'Volume']].apply(pd.to_numeric, errors='coerce')
+	return daily_df.dropna(subset=['Close']).reset_index(drop=True)
+
+def get_intraday(asset, session=requests, url=stooq_url):
+	''' Today's intraday bars of the asset and the size of the response in bytes '''
+	response = session.get(url + '?s=' + asset + '&i=1', timeout=30)
+	response.raise_for_status()
 	soup = BeautifulSoup(response.content, 'html.parser')
 	content = soup.get_text()
-	daily_df = pd.DataFrame([x.split(',') for x in content.split('\n')], columns=['Date', 'Time', 'Open', 'High', 'Low', 'Close', 'Volume'])
-	date = datetime.today().strftime('%Y-%m-%d')
+	return parse_intraday(content), len(response.content)
+
+@metrics.timed
+def get_ohlcv(asset, session=requests, url=stooq_url):
+	metrics.mark('download')
+	daily_df, size = get_intraday(asset, session, url)
+	metrics.count('bytes downloaded', size)
+	if daily_df.empty:
+		raise ValueError(f'{asset}: no intraday data')
+	metrics.mark('daily bar')
+	# The day of the session, not of the run: on a weekend or a holiday the last session comes again
+	date = pd.to_datetime(daily_df['Date'].iloc[-1]).strftime('%Y-%m-%d')
 	daily_open = daily_df['Open'].iloc[0]
 	daily_high = daily_df['High'].max()
 	daily_low = daily_df['Low'].min()
-	daily_close = daily_df['Close'].iloc[-2]
+	daily_close = daily_df['Close'].iloc[-1]
 	daily_volume = daily_df['Volume'].sum()
 
 	df = pd.DataFrame(index=[0])
@@ -35,20 +71,101 @@ def get_ohlcv(asset):
 	df['Close'] = daily_close
 	df['Volume'] = daily_volume
 
-	print(df.head())
+	return df, size
+
+def update_asset(asset, session, url=stooq_url):
+	start = time.perf_counter()
+	df, size = get_ohlcv(asset, session, url)
+	rows = storage.append_rows(asset, df)												# 0 when the session is stored already
+	if rows:																			# Only the new bar is computed, see incremental.py
+		incremental.update(asset)
+		resample.refresh(asset)
+	return {'rows': rows, 'bytes': size, 'seconds': time.perf_counter() - start}
+
+def run_concurrently(function, assets, workers=max_workers, progress=None, **kwargs):
+	''' Calls function(asset, session, **kwargs) for every asset in a thread pool sharing one session and reports throughput.
+	progress(asset, result) is called as each asset finishes. Returns {asset: result or exception} '''
+	session = create_session(workers)
+	results = {}
+	start = time.perf_counter()
+
+	with ThreadPoolExecutor(max_workers=workers) as executor:
+		futures = {executor.submit(function, asset, session, **kwargs): asset for asset in assets}
+		for future in as_completed(futures):
+			asset = futures[future]
+			try:
+				results[asset] = future.result()
+				print(asset, results[asset])
+			except Exception as error:
+				results[asset] = error
+				print(asset, 'failed:', error)
+			if progress:
+				progress(asset, results[asset])
 
-def update():
+	session.close()
+	elapsed = time.perf_counter() - start
+	failed = sum(isinstance(result, Exception) for result in results.values())
+	downloaded = sum(result['bytes'] for result in results.values() if not isinstance(result, Exception))
+	print(f'{len(assets)} assets in {elapsed:.2f} s ({len(assets) / max(elapsed, 1e-9):.1f} assets/s, {downloaded / 1024 / max(elapsed, 1e-9):.0f} KiB/s), {failed} failed')
 
-	assets = list_assets()
+	return results
 
-	for asset in assets:
-		print(asset)
-		get_ohlcv(asset)
+def update(assets=None, workers=max_workers, url=stooq_url):
+	''' Fetches today's bar of every asset concurrently and appends it to the dataset. Returns {asset: stats or exception} '''
+	if assets is None:
+		assets = list_assets()
+	results = run_concurrently(update_asset, assets, workers, url=url)
+	summary.update([asset for asset, result in results.items() if not isinstance(result, Exception)])
+	return results
 
-update()
+def parse_symbols(text):
+	''' Symbols separated by commas, semicolons, whitespace or new lines, as typed in the import modal or read from a file '''
+	symbols = text.replace(',', ' ').replace(';', ' ').split()
+	return list(dict.fromkeys(symbols))
+
+def import_dataset(symbol, session=requests, url=stooq_history_url):
+	''' Downloads the whole daily history of the symbol and writes it into the dataset store, parsing the response as it streams in '''
+	start = time.perf_counter()
+	with session.get(url + '?s=' + symbol + '&i=d', stream=True, timeout=60) as response:
+		response.raise_for_status()
+		response.raw.decode_content = True
+		counted = CountingReader(response.raw)
+		df = pd.read_csv(counted)
+	if list(df.columns[:5]) != ['Date', 'Open', 'High', 'Low', 'Close'] or df.empty:
+		raise ValueError(f'{symbol}: no data')
+	storage.write_dataset(symbol, df)
+	resample.refresh(symbol)															# Levels of an asset imported before
+	return {'rows': len(df), 'bytes': counted.bytes, 'seconds': time.perf_counter() - start}
+
+class CountingReader:
+	''' File-like wrapper counting bytes read from a streamed response '''
+
+	def __init__(self, raw):
+		self.raw = raw
+		self.bytes = 0
+
+	def read(self, size=-1):
+		data = self.raw.read(size)
+		self.bytes += len(data)
+		return data
+
+	def __iter__(self):
+		return iter(self.raw)
+
+def import_datasets(symbols, workers=max_workers, url=stooq_history_url, progress=None):
+	''' Bulk import of many symbols in parallel, see import_dataset '''
+	results = run_concurrently(import_dataset, symbols, workers, progress, url=url)
+	summary.update([symbol for symbol, result in results.items() if not isinstance(result, Exception)])
+	return results
+
+if __name__ == '__main__':
+	if len(sys.argv) > 1:																# python update.py symbols.txt imports listed symbols
+		with open(sys.argv[1]) as f:
+			import_datasets(parse_symbols(f.read()))
+	else:
+		update()
 
 #schedule.every().day.at('18:00').do(update)
 
 #while True:
 #	schedule.run_pending()
-
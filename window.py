@@ -0,0 +1,69 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+''' The part of a dataset the chart shows. Rows of a date range are found by binary search on the sorted dates, and
+the extremes of a column over any rows come from a sparse table, so panning or zooming costs the same whatever the
+history length. Tables are built once per dataset version and column and kept in a small LRU cache '''
+
+margin = 0.25																			# Rows drawn on each side of the view, as a fraction of the view
+block_size = 64																		# Rows per block of the sparse table
+tables_max = 64																			# Sparse tables kept in memory
+tables = OrderedDict()
+tables_lock = threading.Lock()
+
+def rows(dates, start, end):
+	''' (first, last) rows with start <= date <= end, dates sorted ascending '''
+	return int(np.searchsorted(dates, start, 'left')), int(np.searchsorted(dates, end, 'right'))
+
+class RangeExtremes:
+	''' Minimum and maximum of values[first:last] in O(1), NaN ignored. Blocks of block_size rows are summarized by
+	their extremes and a sparse table over the blocks answers whole blocks with two overlapping lookups; the partial
+	blocks at the ends are scanned directly, at most 2 * block_size values '''
+
+	def __init__(self, values, block_size=block_size):
+		self.values = np.asarray(values, dtype=float)
+		self.block_size = block_size
+		blocks = np.arange(0, len(self.values), block_size)
+		with np.errstate(invalid='ignore'):
+			self.minimum = [np.fmin.reduceat(self.values, blocks)] if len(blocks) else [np.zeros(0)]
+			self.maximum = [np.fmax.reduceat(self.values, blocks)] if len(blocks) else [np.zeros(0)]
+		span = 1
+		while 2 * span <= len(self.minimum[0]):											# Level k holds the extremes of 2^k blocks
+			self.minimum.append(np.fmin(self.minimum[-1][:-span], self.minimum[-1][span:]))
+			self.maximum.append(np.fmax(self.maximum[-1][:-span], self.maximum[-1][span:]))
+			span *= 2
+
+	def query(self, first, last):
+		''' (minimum, maximum) of values[first:last], NaN if there are no real values '''
+		first, last = int(first), int(last)
+		first_block = -(-first // self.block_size)
+		last_block = last // self.block_size
+		parts = []
+		if first_block < last_block:
+			level = (last_block - first_block).bit_length() - 1
+			parts += [self.minimum[level][first_block], self.minimum[level][last_block - (1 << level)],
+				self.maximum[level][first_block], self.maximum[level][last_block - (1 << level)]]
+			parts += list(self.values[first:first_block * self.block_size]) + list(self.values[last_block * self.block_size:last])
+		else:
+			parts += list(self.values[first:last])
+		parts = np.array(parts, dtype=float)
+		if not np.isfinite(parts).any():
+			return np.nan, np.nan
+		return np.nanmin(parts), np.nanmax(parts)
+
+def extremes(key, values, first, last):
+	''' (minimum, maximum) of values[first:last] with the sparse table cached under key, e.g. (asset, data version,
+	column); values are only read when the table is not cached yet '''
+	with tables_lock:
+		table = tables.get(key)
+		if table is not None:
+			tables.move_to_end(key)
+	if table is None:
+		table = RangeExtremes(values)
+		with tables_lock:
+			tables[key] = table
+			while len(tables) > tables_max:
+				tables.popitem(last=False)
+	return table.query(first, last)